@@ -0,0 +1,98 @@
+"""
+Cold start benchmark for the API.
+
+Starts fresh Python processes and reports:
+- the import time of each module when the app is first imported (from python -X importtime)
+- the time to create the app and the time to the first and second responses, with and without
+  the start-up warm-up (WARMUP_ON_START)
+
+Run from the src folder, with the same .env as the API:
+
+    python benchmarks/cold_start.py [--path /attractions/all] [--runs 5] [--top 20]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in each fresh process. Prints the timings, in milliseconds, as JSON.
+FIRST_RESPONSE_SCRIPT = """
+import json, sys
+from time import perf_counter
+started = perf_counter()
+from dotenv import load_dotenv
+load_dotenv()
+from main import create_app
+imported = perf_counter()
+app = create_app()
+created = perf_counter()
+client = app.test_client()
+status = client.get(sys.argv[1]).status_code
+first = perf_counter()
+client.get(sys.argv[1])
+second = perf_counter()
+print(json.dumps({
+    'status': status,
+    'import_ms': (imported - started) * 1000,
+    'create_app_ms': (created - imported) * 1000,
+    'first_response_ms': (first - created) * 1000,
+    'second_response_ms': (second - first) * 1000,
+    'time_to_first_response_ms': (first - started) * 1000,
+}))
+"""
+
+def run_python(args, env=None):
+    return subprocess.run(
+        [sys.executable, *args], cwd=SRC_DIR, env=env, capture_output=True, text=True, check=True
+    )
+
+def module_import_times(top):
+    """
+    Imports the app in a fresh process with -X importtime and returns the `top` modules by cumulative
+    import time, as (module, self ms, cumulative ms) tuples.
+    """
+    result = run_python(["-X", "importtime", "-c", "import main"])
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:"):].split("|")
+        times.append((module.strip(), int(self_us) / 1000, int(cumulative_us) / 1000))
+    times.sort(key=lambda entry: entry[2], reverse=True)
+    return times[:top]
+
+def first_response_times(path, runs, warm_up):
+    """
+    Returns the median of each timing over `runs` fresh processes.
+    """
+    env = dict(os.environ, WARMUP_ON_START="1" if warm_up else "0")
+    results = [json.loads(run_python(["-c", FIRST_RESPONSE_SCRIPT, path], env).stdout) for _ in range(runs)]
+    medians = {key: statistics.median([result[key] for result in results]) for key in results[0] if key != 'status'}
+    medians['status'] = results[0]['status']
+    return medians
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default="/attractions/all", help="Endpoint requested as the first response")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh processes per measurement")
+    parser.add_argument("--top", type=int, default=20, help="Number of modules to list by import time")
+    args = parser.parse_args()
+
+    print(f"Slowest {args.top} modules to import (ms):")
+    print(f"{'self':>10} {'cumulative':>12}  module")
+    for module, self_ms, cumulative_ms in module_import_times(args.top):
+        print(f"{self_ms:>10.1f} {cumulative_ms:>12.1f}  {module}")
+
+    print(f"\nTime to first response for GET {args.path} (median of {args.runs} runs, ms):")
+    columns = ['import_ms', 'create_app_ms', 'first_response_ms', 'second_response_ms', 'time_to_first_response_ms']
+    print(f"{'warm-up':<8}" + "".join(f"{column[:-3]:>26}" for column in columns) + f"{'status':>8}")
+    for warm_up in (False, True):
+        medians = first_response_times(args.path, args.runs, warm_up)
+        print(f"{'on' if warm_up else 'off':<8}" + "".join(f"{medians[column]:>26.1f}" for column in columns) + f"{medians['status']:>8}")
+
+if __name__ == "__main__":
+    main()
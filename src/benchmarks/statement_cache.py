@@ -0,0 +1,98 @@
+"""
+Statement construction benchmark for the hot query paths.
+
+For each hot statement, compares building it the way the endpoints used to (a new statement per request)
+with reusing the prebuilt statement and passing its parameters. Reports, per call in microseconds:
+- build: constructing the statement and generating its cache key, which SQLAlchemy does before it can look
+  up the compiled SQL (the prebuilt statements keep their cache key, so this is close to nothing for them)
+- execute: running the statement and fetching its rows, including the build and the cache lookup
+
+and the statement cache hit ratio over the run.
+
+Run from the src folder, with the same .env as the API (the lookups match no rows, so nothing is changed):
+
+    python benchmarks/statement_cache.py [--iterations 2000]
+"""
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+def hot_paths():
+    """
+    Returns (name, rebuild, prebuilt statement, parameters) for each hot path. `rebuild` builds the
+    statement the way the endpoints did before it was prebuilt.
+    """
+    from init import db
+    from models.user import User
+    from models.attraction import Attraction
+    from models.attraction_content_version import AttractionContentVersion
+    from models.booking import Booking
+    from models.review import Review
+    from utils.auth_utils import user_is_admin_stmt
+    from utils.security_utils import requested_bookings_count_stmt, recent_bookings_cost_stmt, recent_bookings_params
+    from utils.attraction_cache_utils import attraction_version_stmt
+    from controllers.auth_controller import user_by_email_stmt
+    from controllers.review_controller import user_review_stmt
+
+    since = datetime.utcnow() - timedelta(days=1)
+    return [
+        ('authorise_as_admin', lambda: db.select(User).filter_by(id=0), user_is_admin_stmt, {'user_id': 0}),
+        ('login', lambda: db.select(User).filter_by(email=''), user_by_email_stmt, {'email': ''}),
+        # The version check that decides whether the cached JSON of the attraction can be served
+        ('get_one_attraction', lambda: db.select(
+            Attraction.version_id, db.func.coalesce(AttractionContentVersion.version, 0), Attraction.available_slots,
+        ).outerjoin(AttractionContentVersion).where(Attraction.id == 0),
+         attraction_version_stmt, {'attraction_id': 0}),
+        ('is_rate_limited', lambda: db.select(db.func.count()).select_from(Booking).where(
+            Booking.user_id == 0, Booking.created_at >= since, Booking.status == 'Requested'
+        ), requested_bookings_count_stmt, recent_bookings_params(0, since)),
+        ('exceeded_booking_cost_limit', lambda: db.select(db.func.sum(Booking.total_cost)).where(
+            Booking.user_id == 0, Booking.created_at >= since
+        ), recent_bookings_cost_stmt, recent_bookings_params(0, since)),
+        ('update_review', lambda: db.select(Review).filter_by(id=0, user_id=0),
+         user_review_stmt, {'review_id': 0, 'user_id': 0}),
+    ]
+
+def per_call_us(fn, iterations):
+    started = perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (perf_counter() - started) / iterations * 1_000_000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000, help="Calls timed per measurement")
+    args = parser.parse_args()
+
+    load_dotenv()
+    from main import create_app
+    from init import db
+
+    app = create_app()
+    with app.app_context():
+        cache_stats = app.extensions['statement_cache_stats']
+        print(f"Per call (us, {args.iterations} calls each):")
+        print(f"{'path':<30}{'build':>10}{'prebuilt':>10}{'execute':>10}{'prebuilt':>10}{'saved':>8}")
+        for name, rebuild, stmt, params in hot_paths():
+            build_us = per_call_us(lambda: rebuild()._generate_cache_key(), args.iterations)
+            prebuilt_build_us = per_call_us(lambda: stmt._generate_cache_key(), args.iterations)
+            # Runs each once first, so both are timed with the compiled SQL already cached
+            db.session.execute(rebuild()).all()
+            db.session.execute(stmt, params).all()
+            execute_us = per_call_us(lambda: db.session.execute(rebuild()).all(), args.iterations)
+            prebuilt_execute_us = per_call_us(lambda: db.session.execute(stmt, params).all(), args.iterations)
+            saved = (execute_us - prebuilt_execute_us) / execute_us * 100
+            print(f"{name:<30}{build_us:>10.1f}{prebuilt_build_us:>10.1f}{execute_us:>10.1f}{prebuilt_execute_us:>10.1f}{saved:>7.1f}%")
+            db.session.rollback()
+
+        stats = cache_stats.stats()
+        print(f"\nStatement cache: {stats['hits']} hits, {stats['misses']} misses, hit ratio {stats['hit_ratio']}")
+
+if __name__ == "__main__":
+    main()
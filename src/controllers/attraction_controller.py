@@ -1,35 +1,165 @@
-from flask import Blueprint, request, abort, jsonify
+import io
+import json
+
+from flask import Blueprint, Response, current_app, request, abort, jsonify
 from flask_jwt_extended import jwt_required
+from sqlalchemy import bindparam
 
 from init import db
-from models.attraction import Attraction, attraction_schema, attractions_schema 
+from models.attraction import Attraction, attraction_schema
 from utils.auth_utils import authorise_as_admin
+from utils.etag_utils import etag_header, check_if_match
+from utils.availability_utils import current_slots
+from utils.attraction_cache_utils import attraction_list_response, attraction_response, bump_content_versions
+from utils.opening_hours_utils import open_attraction_versions_stmt, open_at_params
+from utils.import_utils import IMPORT_FORMATS, import_attractions
+from utils.admission_utils import admission_pool, hold_admission_until_closed
+from utils.recommendation_utils import related_attractions_stmt
 
 attraction_bp = Blueprint('attraction_bp', __name__, url_prefix='/attractions')
 
+# Built once, so each request reuses the statement and its cache key rather than rebuilding both
+attraction_stmt = db.select(Attraction).where(Attraction.id == bindparam('attraction_id'))
+
 @attraction_bp.route('/all', methods=['GET'])  # Show all attractions
 def get_all_attractions():
     """
     Retrieves all attractions from the database, sorts them alphabetically by their names, and
     returns them to the client. It does not require authentication and is accessible by any user or guest.
+
+    Only the ID, content version and available slots of each attraction are read per request. The body is
+    joined from the cached JSON of each attraction (see utils/attraction_cache_utils.py), loading and
+    serialising only those whose content changed.
+    """
+    return attraction_list_response()
+
+@attraction_bp.route('', methods=['GET']) # Find attractions open at a time
+def get_open_attractions():
+    """
+    Retrieves the attractions open at the time given in the `open_at` query parameter ('HH:MM'), on the day
+    given in `day` ('mon' to 'sun', today by default), ordered by name. Without `open_at`, every attraction
+    is returned, as by /all. It does not require authentication and is accessible by any user or guest.
+
+    The time is matched in the database against each attraction's parsed hours for that day (including
+    hours from the day before that run past midnight), using the opening hours indexes.
+    """
+    open_at = request.args.get('open_at')
+    if open_at is None:
+        return attraction_list_response()
+    try:
+        params = open_at_params(open_at, request.args.get('day'))
+    except ValueError as err:
+        return {"error": str(err)}, 400
+    return attraction_list_response(open_attraction_versions_stmt, params)
+
+@attraction_bp.route('/stream', methods=['GET']) # Live availability of attractions
+@admission_pool('streams')
+def stream_availability():
     """
-    stmt = db.select(Attraction).order_by(Attraction.name)
-    attractions = db.session.scalars(stmt).all()
-    return attractions_schema.dump(attractions), 200
+    Streams the available slots of the attractions given in the `ids` query parameter (comma separated)
+    as Server-Sent Events. It does not require authentication and is accessible by any user or guest.
+
+    The stream starts with a 'snapshot' event holding the current slots of every requested attraction that exists,
+    followed by a 'slots' event ({"id": ..., "available_slots": ...}) each time one of them changes. Changes
+    that happen in quick succession are sent once, with the latest value. A keep-alive comment is sent every
+    SSE_HEARTBEAT_SECONDS so proxies don't close an idle stream.
+
+    No database connection is held while the stream is open. Each process accepts up to STREAM_MAX_CLIENTS
+    streams, and answers 503 Service Unavailable with a Retry-After header beyond that.
+    """
+    try:
+        attraction_ids = sorted({int(value) for value in request.args.get('ids', '').split(',') if value.strip()})
+    except ValueError:
+        return {"error": "ids must be a comma separated list of attraction IDs"}, 400
+    if not attraction_ids:
+        return {"error": "At least one attraction ID is required in ids"}, 400
+    if len(attraction_ids) > current_app.config["STREAM_MAX_IDS"]:
+        return {"error": f"At most {current_app.config['STREAM_MAX_IDS']} attractions can be streamed at once"}, 400
+
+    broker = current_app.extensions['availability_broker']
+    # Subscribes before reading the snapshot, so a change committed in between is sent after it rather than lost
+    subscriber = broker.subscribe(attraction_ids, current_app.config["STREAM_MAX_CLIENTS"])
+    if subscriber is None:
+        return {"error": "Too many live streams open, try again later"}, 503, {'Retry-After': '30'}
+
+    try:
+        snapshot = current_slots(attraction_ids)
+    except Exception:
+        broker.unsubscribe(subscriber)
+        raise
+    # Returns the connection to the pool now rather than when the stream ends
+    db.session.remove()
+    heartbeat = current_app.config["SSE_HEARTBEAT_SECONDS"]
+
+    def events():
+        yield f"event: snapshot\ndata: {json.dumps(snapshot)}\n\n"
+        while True:
+            changes = subscriber.wait(heartbeat)
+            if not changes:
+                yield ": keep-alive\n\n"
+            for attraction_id, available_slots in changes.items():
+                yield f"event: slots\ndata: {json.dumps({'id': attraction_id, 'available_slots': available_slots})}\n\n"
+
+    response = Response(events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # Stops nginx from buffering the stream
+        'X-Accel-Buffering': 'no',
+    })
+    # Runs when the client disconnects (the next write fails) or the worker shuts down
+    response.call_on_close(lambda: broker.unsubscribe(subscriber))
+    # The stream holds its thread, and its place in the streams pool, until it is closed
+    return hold_admission_until_closed(response)
 
 @attraction_bp.route('/<int:attraction_id>', methods=['Get']) # View one attraction
 def get_one_attraction(attraction_id): 
     """
     Retrieves one attractions from the database identified by it's ID.
     It does not require authentication and is accessible by any user or guest.
+
+    The response includes an ETag header with the attraction's current version, which can be sent
+    back in an If-Match header when updating or deleting it. The body comes from the attraction's cached JSON
+    when it hasn't changed since it was cached.
     """
-    stmt = db.select(Attraction).filter_by(attraction_id=attraction_id) 
-    attraction = db.session.scalar(stmt)
-    if attraction:
-        return attraction_schema.dump(attraction)
+    response = attraction_response(attraction_id)
+    if response is not None:
+        return response
     else:
         return {"error": f"Attraction with id {attraction_id} not found"}, 404
 
+@attraction_bp.route('/<int:attraction_id>/related', methods=['GET']) # People who booked this also booked
+def get_related_attractions(attraction_id):
+    """
+    Retrieves the attractions most often booked by the users who booked this one, best match first, up to
+    the `limit` query parameter (default 10, at most RECOMMENDATIONS_TOP_K). It does not require
+    authentication and is accessible by any user or guest.
+
+    The matches come from the precomputed recommendation index (see utils/recommendation_utils.py), so
+    a request only slices the index and reads the matched attractions by ID.
+    """
+    index = current_app.extensions['recommendations'].get()
+    if index is None:
+        return {"error": "Recommendations haven't been built yet"}, 503
+
+    limit = request.args.get('limit', 10, type=int)
+    related_ids, scores = index.related(attraction_id, max(1, min(limit, current_app.config["RECOMMENDATIONS_TOP_K"])))
+    attractions = {
+        row.id: row for row in db.session.execute(related_attractions_stmt, {'attraction_ids': [attraction_id, *related_ids]})
+    }
+    if attraction_id not in attractions:
+        return {"error": f"Attraction with id {attraction_id} not found"}, 404
+
+    # Attractions deleted since the index was built are left out
+    return [
+        {
+            'id': related_id,
+            'name': attractions[related_id].name,
+            'location': attractions[related_id].location,
+            'ticket_price': attractions[related_id].ticket_price,
+            'score': round(score, 4),
+        }
+        for related_id, score in zip(related_ids, scores) if related_id in attractions
+    ], 200
+
 @attraction_bp.route('/create', methods=['POST']) # Create attraction - admin only
 @jwt_required()
 @authorise_as_admin
@@ -47,6 +177,7 @@ def create_attraction():
     - contact_phone: A contact phone number for inquiries.
     - contact_email: A contact email for inquiries.
     - opening_hours: The opening hours of the attraction in 'HH:MM - HH:MM' format.
+    - weekday_hours: Optional hours for particular days, such as {"sat": "09:00 - 23:00", "mon": "closed"}.
     - available_slots: The number of slots available for booking (int)
 
     """
@@ -61,13 +192,50 @@ def create_attraction():
         contact_phone = body_data.get('contact_phone'),
         contact_email = body_data.get('contact_email'),
         opening_hours = body_data.get('opening_hours'),
+        weekday_hours = body_data.get('weekday_hours'),
         available_slots = body_data.get('available_slots')
     )
 
     db.session.add(attraction)
     db.session.commit()
 
-    return attraction_schema.dump(attraction), 201
+    return attraction_schema.dump(attraction), 201, etag_header(attraction)
+
+@attraction_bp.route('/import', methods=['POST']) # Import many attractions from a file - admin only
+@admission_pool('admin')
+@jwt_required()
+@authorise_as_admin
+def import_attractions_file():
+    """
+    Creates or updates many attractions from a CSV or newline delimited JSON file. Restricted to admin only.
+
+    The file is sent as the 'file' field of a multipart form, or as the request body. Its format comes from
+    the `format` query parameter ('csv' or 'ndjson'), or else from the file name or Content-Type. CSV files
+    need a header row with the same field names as Create Attraction, and weekday_hours as JSON.
+
+    Rows are read and validated in batches of IMPORT_BATCH_SIZE, and an attraction with the same name as
+    an existing one updates it. Invalid rows are skipped and listed in the response by row number (the
+    line number in the file), without stopping the rest of the import.
+    """
+    upload = request.files.get('file')
+    if upload is not None:
+        stream, file_name, content_type = upload.stream, upload.filename or '', upload.mimetype
+    else:
+        stream, file_name, content_type = request.stream, '', request.mimetype
+
+    file_format = request.args.get('format')
+    if file_format is None:
+        if file_name.endswith('.csv') or content_type == 'text/csv':
+            file_format = 'csv'
+        elif file_name.endswith(('.ndjson', '.jsonl')) or content_type == 'application/x-ndjson':
+            file_format = 'ndjson'
+    if file_format not in IMPORT_FORMATS:
+        return {"error": f"Set format to one of: {', '.join(IMPORT_FORMATS)}."}, 400
+
+    # utf-8-sig also accepts the byte order mark spreadsheet programs put at the start of CSV files
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    result = import_attractions(text, file_format, current_app.config["IMPORT_BATCH_SIZE"])
+    return result, 200
 
 @attraction_bp.route('/update/<int:attraction_id>', methods=['PUT']) # Update attraction - admin only
 @jwt_required()
@@ -89,15 +257,19 @@ def update_attraction(attraction_id):
     - contact_phone: A new contact phone number for inquiries.
     - contact_email: A new contact email for inquiries.
     - opening_hours: The new opening hours of the attraction in 'HH:MM - HH:MM' format.
+    - weekday_hours: New hours for particular days (replacing any set before), or null to use opening_hours every day.
     - available_slots: The updated number of slots available for booking (int).
 
+    If an If-Match header is sent and the attraction has changed since that ETag was issued,
+    the update is rejected with 412 Precondition Failed.
     """
     body_data = attraction_schema.load(request.get_json(), partial=True)
 
-    stmt = db.select(Attraction).filter_by(id=attraction_id)
-    attraction = db.session.scalar(stmt)
+    attraction = db.session.scalar(attraction_stmt, {'attraction_id': attraction_id})
     
     if attraction:
+        check_if_match(attraction)
+
         # Update attraction fields with provided values, defaulting to current values if not provided
         attraction.name = body_data.get('name', attraction.name)
         attraction.description = body_data.get('description', attraction.description)
@@ -106,10 +278,12 @@ def update_attraction(attraction_id):
         attraction.contact_phone = body_data.get('contact_phone', attraction.contact_phone)
         attraction.contact_email = body_data.get('contact_email', attraction.contact_email)
         attraction.opening_hours = body_data.get('opening_hours', attraction.opening_hours)  
+        attraction.weekday_hours = body_data.get('weekday_hours', attraction.weekday_hours)
         attraction.available_slots = body_data.get('available_slots', attraction.available_slots)  
+        bump_content_versions(Attraction.id == attraction_id)
         
         db.session.commit()
-        return attraction_schema.dump(attraction), 200
+        return attraction_schema.dump(attraction), 200, etag_header(attraction)
     else:
         return {'error': f'Attraction with id {attraction_id} not found'}, 404
 
@@ -121,11 +295,15 @@ def delete_attraction(attraction_id):
     Deletes an attraction identified by its ID. Restricted to admin only.
 
     Attempts to find an attraction with the provided ID. If found, the attraction is deleted from
-    the database. If no attraction with the provided ID exists, a 404 Not Found error is returned.
+    the database along with its bookings, reviews and daily rollups (ON DELETE CASCADE), in one statement.
+    If no attraction with the provided ID exists, a 404 Not Found error is returned.
+    If an If-Match header is sent and the attraction has changed since, a 412 error is returned.
     """
     attraction = Attraction.query.get(attraction_id)
     if attraction is None:
         return {'message': f"The requested attraction does not exist"}, 404
+    check_if_match(attraction)
     db.session.delete(attraction)
     db.session.commit()
+    current_app.extensions['attraction_cache'].evict(attraction_id)
     return {'message': f"Attraction '{attraction.name}' deleted successfully"}, 200
\ No newline at end of file
@@ -1,14 +1,23 @@
-from datetime import timedelta
-
-from flask import Blueprint, request, abort, g
-from flask_jwt_extended import create_access_token, jwt_required
+from flask import Blueprint, request, abort, g, current_app
+from flask_jwt_extended import create_access_token, jwt_required, get_jwt
+from sqlalchemy import bindparam
 
 from init import db, bcrypt
 from models.user import User, UserSchema, user_schema, users_schema, user_registration_schema
 from utils.auth_utils import authorise_as_admin, hash_password, validate_data, load_current_user
+from utils.slot_utils import release_user_slots
+from utils.rollup_utils import remove_user_from_rollups
+from utils.revocation_utils import ACCESS_TOKEN_LIFETIME, revoke_token, revoke_user_tokens
+from utils.profile_utils import profile_summary, profile_full_page
+from utils.audit_utils import audit
+from utils.attraction_cache_utils import bump_content_versions, reviewed_by
+from utils.admission_utils import admission_pool
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/auth')
 
+# Built once, so each login reuses the statement and its cache key rather than rebuilding both
+user_by_email_stmt = db.select(User).where(User.email == bindparam('email'))
+
 @auth_bp.route("/register", methods=["POST"]) # Register a new user
 def auth_register():
     """
@@ -77,18 +86,31 @@ def auth_login():
     # Extract request data, expecting JSON containing 'email' and 'password'
     body_data = request.get_json()
     
-    stmt = db.select(User).filter_by(email=body_data.get("email"))
-    user = db.session.scalar(stmt)
+    user = db.session.scalar(user_by_email_stmt, {'email': body_data.get("email")})
     
     # Check if a user was found and the password matches hashed password in database
     # Generate a JWT token for the authenticated user, setting the token's expiry to 1 day
     if user and bcrypt.check_password_hash(user.password, body_data["password"]):
-        token = create_access_token(identity=str(user.id), expires_delta=timedelta(days=1))
+        token = create_access_token(identity=str(user.id), expires_delta=ACCESS_TOKEN_LIFETIME)
         return {"email": user.email, "token": token, "is_admin": user.is_admin}
     else:
         abort(401)
 
+@auth_bp.route("/logout", methods=["POST"]) # Logout by revoking the current token
+@jwt_required()
+def auth_logout():
+    """
+    Revokes the JWT token used to make this request, so it can no longer be used.
+
+    Returns:
+        A JSON message confirming the logout with a 200 OK status.
+    """
+    revoke_token(get_jwt())
+    db.session.commit()
+    return {"message": "Logged out successfully"}, 200
+
 @auth_bp.route("/users", methods=["GET"]) # View all users (as an admin)
+@admission_pool('admin')
 @jwt_required() 
 @authorise_as_admin 
 def get_all_users():
@@ -117,8 +139,16 @@ def get_user(user_id):
     Requires JWT authentication. The JWT token must belong to an admin or the user 
     whose details are being requested.
 
+    Query parameters:
+        - view (str): 'summary' (default) for the account details with booking counts by status, total spend,
+          review count and the PROFILE_RECENT_BOOKINGS most recent bookings. 'full' for the account details
+          with the user's bookings and reviews, one page at a time.
+        - page (int): Page of bookings and reviews in the full view, starting from 1.
+        - per_page (int): Bookings and reviews per page in the full view, up to PROFILE_MAX_PAGE_SIZE.
+
     Returns:
         - JSON object containing the user's details with a 200 OK status, if access is granted.
+        - A 400 error for an unknown view or invalid paging.
         - A 403 error if the requesting user is neither the account holder nor an admin.
         - A 404 Not Found error if the user with the specified ID does not exist.
     """
@@ -133,7 +163,19 @@ def get_user(user_id):
     if not user:
         abort(404)
 
-    return user_schema.dump(user), 200
+    view = request.args.get('view', 'summary')
+    if view == 'summary':
+        return profile_summary(user, current_app.config["PROFILE_RECENT_BOOKINGS"]), 200
+    if view != 'full':
+        return {"error": "view must be either 'summary' or 'full'."}, 400
+
+    max_page_size = current_app.config["PROFILE_MAX_PAGE_SIZE"]
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 20, type=int)
+    if page < 1 or not 1 <= per_page <= max_page_size:
+        return {"error": f"page must be 1 or more, and per_page between 1 and {max_page_size}."}, 400
+
+    return profile_full_page(user, page, per_page), 200
 
 @auth_bp.route("/update", methods=["PUT"])  # Update user
 @jwt_required()
@@ -180,6 +222,10 @@ def update_account():
     for key, value in validated_data.items():
         setattr(user, key, value)
 
+    # Reviewers' names are shown with the attractions they reviewed
+    if 'name' in validated_data:
+        bump_content_versions(reviewed_by(user.id))
+
     db.session.commit()
 
     return user_schema.dump(user), 200
@@ -200,6 +246,10 @@ def delete_account(user_id):
         - A 401 Unauthorized error if a user is trying to delete an account that is not theirs, or an account that doesn't exist
         - A 403 Forbidden error if the requesting user is not authorised.
         - A 404 Not Found error if the user with the specified ID does not exist.
+
+    The user's bookings and reviews are deleted by the database (ON DELETE CASCADE) in the same statement,
+    after the slots held by their bookings are given back and the bookings are removed from the daily rollups.
+    All tokens issued to the user are revoked.
     """
     current_user = g.current_user
     
@@ -213,6 +263,11 @@ def delete_account(user_id):
     if not user_to_delete:
         abort(404)
 
+    release_user_slots(user_id)
+    remove_user_from_rollups(user_id)
+    revoke_user_tokens(user_id)
+    # Their reviews are deleted with them, changing the attractions they reviewed
+    bump_content_versions(reviewed_by(user_id))
     db.session.delete(user_to_delete)
     db.session.commit()
     
@@ -229,6 +284,7 @@ def unlock_user_account(user_id):
     user_to_unlock.is_locked = False  
     user_to_unlock.booking_attempts = 0
     db.session.commit()
+    audit('user.unlocked', 'user', user_id)
 
     return {'message': f'User account {user_id} unlocked successfully'}, 200
 
@@ -1,15 +1,38 @@
 from datetime import datetime, timedelta
 
-from flask import Blueprint, request, abort, g, jsonify
+from flask import Blueprint, current_app, request, abort, g, jsonify, make_response, Response, stream_with_context
 from flask_jwt_extended import jwt_required
+from sqlalchemy import bindparam
+from sqlalchemy.orm import joinedload
 
 from init import db
 from models.user import User
 from models.booking import Booking, booking_schema, bookings_schema, booking_status
 from models.attraction import Attraction
+from models.booking_rollup import BookingRollup
+from models.archived_booking import ArchivedBooking, archived_bookings_schema
 
 from utils.auth_utils import authorise_as_admin, load_current_user
+from utils.idempotency_utils import idempotent
+from utils.etag_utils import etag_header, check_if_match
 from utils.security_utils import is_rate_limited, exceeded_booking_cost_limit
+from utils.export_utils import csv_chunks, ndjson_chunks, gzip_chunks, decode_cursor
+from utils.slot_counter_utils import sold_out
+from utils.rollup_utils import booking_snapshot, record_booking_change, record_bulk_change
+from utils.slot_utils import holds_slots, reserve_slots, release_slots, adjust_slots_bulk
+from utils.audit_utils import audit, audit_status_changes
+from utils.admission_utils import admission_pool
+
+# Number of rows fetched from the server-side cursor per round trip when exporting bookings
+EXPORT_BATCH_SIZE = 1000
+
+# Maximum number of booking IDs accepted by a single bulk status update
+BULK_STATUS_MAX_IDS = 10000
+
+# Built once, so each request reuses the statement and its cache key rather than rebuilding both
+user_bookings_stmt = db.select(Booking).where(Booking.user_id == bindparam('user_id'))
+
+BOOKING_STATUSES = [booking_status.REQUESTED, booking_status.CONFIRMED, booking_status.CANCELLED]
 
 booking_bp = Blueprint('booking_bp', __name__, url_prefix='/booking')
 
@@ -31,6 +54,12 @@ def check_attraction_slots(attraction_id, required_slots):
         return False, attraction
     return True, attraction
 
+def audit_details(snapshot):
+    """
+    Converts a booking snapshot to the JSON details of an audit event.
+    """
+    return dict(snapshot, day=snapshot['day'].isoformat())
+
 def create_booking_logic(user_id, data, bypass_limits_for_admin=False):
     """
     Handles the common logic for creating a booking for a user. Includes validating the booking date,
@@ -55,6 +84,16 @@ def create_booking_logic(user_id, data, bypass_limits_for_admin=False):
     Helps to identify errors related to security checks, attractions not having
     enough availability.
     """
+    body_data = request.get_json()
+    attraction_id = body_data.get('id')  
+    number_of_guests = body_data.get('number_of_guests')
+    booking_date = body_data.get('booking_date') 
+
+    # Rejects bookings for attractions the host's shared slot counters show as sold out, before any of the
+    # checks below query the database. Bookings that pass still reserve their slots in the database.
+    if sold_out(current_app.extensions.get('slot_counters'), attraction_id, number_of_guests):
+        abort(make_response(jsonify(message="Not enough available slots for this booking."), 400))
+
     user = User.query.get(user_id)
     if not user:
         abort(404)
@@ -63,11 +102,6 @@ def create_booking_logic(user_id, data, bypass_limits_for_admin=False):
     if not (user.is_admin and bypass_limits_for_admin):
         if is_rate_limited(user_id) or exceeded_booking_cost_limit(user_id):
             abort(jsonify(message="Account locked for security reasons. Please contact admin."), 429)
-        
-    body_data = request.get_json()
-    attraction_id = body_data.get('id')  
-    number_of_guests = body_data.get('number_of_guests')
-    booking_date = body_data.get('booking_date') 
 
     if number_of_guests > 20:
         abort(jsonify(message="For bookings greater than 20, please contact the attraction directly.")), 400
@@ -105,18 +139,21 @@ def create_booking_logic(user_id, data, bypass_limits_for_admin=False):
     if booking.total_cost >= 1000 and not bypass_limits_for_admin:
         abort(jsonify(message="Bookings over $1000 require admin permission."), 403)
 
-    available, _ = check_attraction_slots(attraction_id, number_of_guests)
-    if not available:
+    # Takes the slots with a single conditional update so concurrent bookings can't overbook the attraction
+    if not reserve_slots(attraction.id, number_of_guests):
         abort(jsonify(message="Not enough available slots for this booking."), 400)
-    else:
-        db.session.add(booking)
-        db.session.commit()
+
+    db.session.add(booking)
+    record_booking_change(after=booking_snapshot(booking))
+    db.session.commit()
+    audit('booking.created', 'booking', booking.id, audit_details(booking_snapshot(booking)))
 
     return booking
 
 @booking_bp.route('/new', methods=['POST']) # User create a new booking
 @jwt_required()
 @load_current_user
+@idempotent
 def create_booking():
     """
     Endpoint for creating a new booking. Checks the user ID from the current user,
@@ -124,6 +161,9 @@ def create_booking():
     This endpoint applies for both regular users and admins, with admins
     having the ability to bypass security restrictions.
 
+    Clients can send an Idempotency-Key header so a retried request returns the original
+    response instead of creating a second booking.
+
     Returns:
         JSON: booking object along with a 201 status code for a successful booking creation.
     """
@@ -132,11 +172,12 @@ def create_booking():
     if not booking:
         abort(400)
     
-    return booking_schema.dump(booking), 201
+    return booking_schema.dump(booking), 201, etag_header(booking)
 
 @booking_bp.route("/admin/<int:user_id>", methods=["POST"]) # Admin create a booking for user by their user ID
 @jwt_required()
 @authorise_as_admin
+@idempotent
 def admin_create_booking(user_id):
     """
     Allows an admin to create a booking for a specific user.
@@ -155,7 +196,7 @@ def admin_create_booking(user_id):
     if not booking:
         abort(400)
 
-    return booking_schema.dump(booking), 201
+    return booking_schema.dump(booking), 201, etag_header(booking)
 
 @booking_bp.route('/my_bookings', methods=['GET']) # Logged in user view bookings
 @jwt_required()
@@ -166,10 +207,28 @@ def view_my_bookings():
 
     User to be authenticated via JWT and token provided in authorisation header of the request.
     It uses the @load_current_user decorator to load the current user's details.
+    Bookings that have been archived are listed by /my_bookings/archived.
     """
-    bookings = Booking.query.filter_by(user_id=g.current_user.id).all()
+    bookings = db.session.scalars(user_bookings_stmt, {'user_id': g.current_user.id}).all()
     return bookings_schema.dump(bookings)
 
+@booking_bp.route('/my_bookings/archived', methods=['GET']) # Logged in user view archived bookings
+@jwt_required()
+@load_current_user
+def view_my_archived_bookings():
+    """
+    Retrieves the currently logged-in user's past bookings that have been moved to the archive
+    by `flask db archive-bookings`, most recent booking date first.
+    """
+    stmt = (
+        db.select(ArchivedBooking)
+        .options(joinedload(ArchivedBooking.attraction))
+        .where(ArchivedBooking.user_id == g.current_user.id)
+        .order_by(ArchivedBooking.booking_date.desc())
+    )
+    bookings = db.session.scalars(stmt).all()
+    return archived_bookings_schema.dump(bookings)
+
 @booking_bp.route('/<int:booking_id>', methods=['PUT']) # Admin update any user booking
 @jwt_required()
 @authorise_as_admin
@@ -184,11 +243,15 @@ def update_booking(booking_id):
             - 'number_of_guests' (int): Updated number of guests for the booking.
             - 'status' (str): New status of the booking (Requested, Confirmed, Cancelled).
 
+    If an If-Match header is sent and the booking has changed since that ETag was issued,
+    the update is rejected with 412 Precondition Failed.
     """
     booking = Booking.query.get(booking_id)
     if not booking:
         abort(404)
+    check_if_match(booking)
 
+    before = booking_snapshot(booking)
     data = request.get_json()
 
     # If booking date is entered, checks for correct format. Returns an error if required
@@ -198,18 +261,10 @@ def update_booking(booking_id):
         except ValueError:
             abort(jsonify(message="Invalid booking date format. Enter as DD-MM-YYYY.")), 400
 
-    # If number of guests is updated, checks for availability and returns an error if required
+    # If number of guests is updated, recalculates the cost. Availability is checked once the new status is known.
     if 'number_of_guests' in data:
-        new_guest_count = data['number_of_guests']
-        guest_difference = new_guest_count - booking.number_of_guests
-        attraction = Attraction.query.get(booking.attraction_id)
-        
-        if attraction.available_slots - guest_difference < 0:
-            abort(jsonify(message="Not enough availability for the updated number of guests.")), 400
-
-        # Updates the number of guests in the booking and attraction based on changes made
-        booking.number_of_guests = new_guest_count
-        attraction.available_slots -= guest_difference  
+        booking.number_of_guests = data['number_of_guests']
+        booking.calculate_total_cost()
 
     # If status is updated, checks it is a valid status and returns an error if required.
     if 'status' in data and data['status'] in [booking_status.REQUESTED, booking_status.CONFIRMED, booking_status.CANCELLED]:
@@ -220,8 +275,26 @@ def update_booking(booking_id):
             "message": "Status can only be 'Requested', 'Confirmed', or 'Cancelled'.",
         }), 422 
 
+    # Adjusts the attraction's slots for any change in guests, or for cancelling / reinstating the booking
+    held_before = before['number_of_guests'] if holds_slots(before['status']) else 0
+    held_after = booking.number_of_guests if holds_slots(booking.status) else 0
+    if held_after > held_before:
+        if not reserve_slots(booking.attraction_id, held_after - held_before):
+            abort(jsonify(message="Not enough availability for the updated number of guests."), 400)
+    elif held_after < held_before:
+        release_slots(booking.attraction_id, held_before - held_after)
+
+    after = booking_snapshot(booking)
+    record_booking_change(before=before, after=after)
     db.session.commit()
-    return booking_schema.dump(booking), 200
+
+    before, after = audit_details(before), audit_details(after)
+    changes = {field: [before[field], after[field]] for field in after if before[field] != after[field]}
+    if changes:
+        audit('booking.updated', 'booking', booking.id, {'changes': changes})
+    if 'status' in changes:
+        audit('booking.status_changed', 'booking', booking.id, {'from': before['status'], 'to': after['status'], 'reason': 'admin_update'})
+    return booking_schema.dump(booking), 200, etag_header(booking)
 
 @booking_bp.route('/delete/<int:booking_id>', methods=['DELETE']) # Delete booking as admin
 @jwt_required()
@@ -232,18 +305,259 @@ def delete_booking(booking_id):
 
     Upon deletion, it returns a confirmation message. 
     Additionally, the available slots for the attraction related to the booking are added back.
-
+    If an If-Match header is sent and the booking has changed since, a 412 error is returned.
     """
     booking = Booking.query.get(booking_id)
     
     if booking is None:
         abort(404)
+    check_if_match(booking)
     
-    # Retrieve attraction associated with booking
-    attraction = Attraction.query.get(booking.attraction_id)
-    if attraction:
-        attraction.available_slots += booking.number_of_guests
+    # Gives the booking's slots back to the attraction, unless they were already released by cancelling it
+    if holds_slots(booking.status):
+        release_slots(booking.attraction_id, booking.number_of_guests)
 
+    snapshot = booking_snapshot(booking)
+    record_booking_change(before=snapshot)
     db.session.delete(booking)
     db.session.commit()
-    return ({'message': 'Booking deleted successfully'}), 200
\ No newline at end of file
+    audit('booking.deleted', 'booking', booking_id, audit_details(snapshot))
+    return ({'message': 'Booking deleted successfully'}), 200
+
+@booking_bp.route('/export', methods=['GET']) # Admin export all bookings
+@admission_pool('admin')
+@jwt_required()
+@authorise_as_admin
+def export_bookings():
+    """
+    Streams every booking matching the optional filters as CSV or newline delimited JSON. Only accessible by admin.
+
+    Query parameters (all optional):
+        - from / to (str): Inclusive booking date range in DD-MM-YYYY format.
+        - status (str): Only export bookings with this status (Requested, Confirmed, Cancelled).
+        - format (str): 'csv' (default) or 'ndjson'.
+        - cursor (str): Resume token taken from the 'cursor' column of the last row received.
+
+    Rows are read from a server-side cursor in batches with the user and attraction names joined in the
+    same query, so memory use is constant no matter how many bookings exist. Rows are ordered by booking ID,
+    which allows a dropped download to be resumed from the last cursor received. The response is gzip
+    compressed on the fly when the client accepts it.
+    """
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        return {"error": "Format must be either 'csv' or 'ndjson'."}, 400
+
+    stmt = (
+        db.select(
+            Booking.id, Booking.booking_date, Booking.created_at, Booking.status, Booking.number_of_guests,
+            Booking.total_cost, Booking.attraction_id, Attraction.name.label('attraction_name'),
+            Attraction.location.label('attraction_location'), Booking.user_id,
+            User.name.label('user_name'), User.email.label('user_email')
+        )
+        .join(Attraction, Attraction.id == Booking.attraction_id)
+        .join(User, User.id == Booking.user_id)
+        .order_by(Booking.id)
+    )
+
+    # Apply date, status and cursor filters, returning an error for any invalid values
+    try:
+        if request.args.get('from'):
+            stmt = stmt.where(Booking.booking_date >= datetime.strptime(request.args['from'], '%d-%m-%Y'))
+        if request.args.get('to'):
+            stmt = stmt.where(Booking.booking_date < datetime.strptime(request.args['to'], '%d-%m-%Y') + timedelta(days=1))
+    except ValueError:
+        return {"error": "Invalid date format. Enter as DD-MM-YYYY."}, 400
+
+    status = request.args.get('status')
+    if status:
+        if status not in BOOKING_STATUSES:
+            return {"error": "Status can only be 'Requested', 'Confirmed', or 'Cancelled'."}, 400
+        stmt = stmt.where(Booking.status == status)
+
+    if request.args.get('cursor'):
+        last_id = decode_cursor(request.args['cursor'])
+        if last_id is None:
+            return {"error": "Invalid cursor."}, 400
+        stmt = stmt.where(Booking.id > last_id)
+
+    def generate():
+        result = db.session.execute(stmt.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        try:
+            chunks = csv_chunks(result) if export_format == 'csv' else ndjson_chunks(result)
+            if use_gzip:
+                chunks = gzip_chunks(chunks)
+            yield from chunks
+        finally:
+            result.close()
+
+    use_gzip = request.accept_encodings['gzip'] > 0
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=bookings.{export_format}'
+    response.headers['Vary'] = 'Accept-Encoding'
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+@booking_bp.route('/reports', methods=['GET']) # Admin daily revenue and guest reports
+@admission_pool('admin')
+@jwt_required()
+@authorise_as_admin
+def booking_reports():
+    """
+    Returns daily booking counts, guest counts and revenue grouped by attraction or location. Only accessible by admin.
+
+    Query parameters:
+        - group_by (str): 'attraction' (default) or 'location'.
+        - from / to (str): Inclusive date range in DD-MM-YYYY format. Defaults to the last 30 days.
+
+    Cancelled bookings are excluded. Totals are read from the daily rollup table, so the cost of a report
+    depends on the number of days requested rather than the number of bookings.
+    """
+    group_by = request.args.get('group_by', 'attraction')
+    if group_by not in ('attraction', 'location'):
+        return {"error": "group_by must be either 'attraction' or 'location'."}, 400
+
+    try:
+        end_date = datetime.strptime(request.args['to'], '%d-%m-%Y').date() if request.args.get('to') else datetime.utcnow().date()
+        start_date = datetime.strptime(request.args['from'], '%d-%m-%Y').date() if request.args.get('from') else end_date - timedelta(days=30)
+    except ValueError:
+        return {"error": "Invalid date format. Enter as DD-MM-YYYY."}, 400
+    if start_date > end_date:
+        return {"error": "The 'from' date must be on or before the 'to' date."}, 400
+
+    group_columns = [Attraction.id, Attraction.name] if group_by == 'attraction' else [Attraction.location]
+    stmt = (
+        db.select(
+            BookingRollup.day, *group_columns,
+            db.func.sum(BookingRollup.bookings), db.func.sum(BookingRollup.guests), db.func.sum(BookingRollup.revenue)
+        )
+        .join(Attraction, Attraction.id == BookingRollup.attraction_id)
+        .where(BookingRollup.day >= start_date, BookingRollup.day <= end_date)
+        .group_by(BookingRollup.day, *group_columns)
+        .order_by(BookingRollup.day, *group_columns)
+    )
+
+    report = []
+    for row in db.session.execute(stmt):
+        if group_by == 'attraction':
+            day, attraction_id, name, bookings, guests, revenue = row
+            entry = {"date": day.strftime('%d-%m-%Y'), "attraction_id": attraction_id, "attraction": name}
+        else:
+            day, location, bookings, guests, revenue = row
+            entry = {"date": day.strftime('%d-%m-%Y'), "location": location}
+        entry.update({"bookings": bookings, "guests": guests, "revenue": round(revenue, 2)})
+        report.append(entry)
+
+    return {"group_by": group_by, "from": start_date.strftime('%d-%m-%Y'), "to": end_date.strftime('%d-%m-%Y'), "report": report}, 200
+
+@booking_bp.route('/bulk-status', methods=['PUT']) # Admin change the status of many bookings at once
+@admission_pool('admin')
+@jwt_required()
+@authorise_as_admin
+def bulk_update_status():
+    """
+    Changes the status of many bookings in a single statement. Only accessible by admin.
+
+    Requires a JSON payload with the new 'status' and either a list of booking 'ids' or a 'filter' with one
+    or more of 'attraction_id', 'booking_date' (DD-MM-YYYY) and 'status' (the current status).
+
+    Example JSON:
+    {
+        "status": "Cancelled",
+        "filter": {"attraction_id": 2, "booking_date": "25-07-2024", "status": "Requested"}
+    }
+
+    Bookings are updated with one UPDATE ... RETURNING, and available slots are adjusted with one update
+    covering every affected attraction: cancelling gives slots back, reinstating a cancelled booking takes them.
+    If an attraction doesn't have enough slots to reinstate its bookings, nothing is changed.
+
+    Returns the outcome for each booking: 'updated' (with its previous status), 'unchanged' (already in the
+    requested status) or 'not_found' (only reported when IDs are given).
+    """
+    data = request.get_json()
+    new_status = data.get('status')
+    if new_status not in BOOKING_STATUSES:
+        return {"error": "Status can only be 'Requested', 'Confirmed', or 'Cancelled'."}, 422
+
+    # Builds the booking conditions from either the list of IDs or the filter
+    ids = data.get('ids')
+    booking_filter = data.get('filter')
+    if (ids is None) == (booking_filter is None):
+        return {"error": "Provide either a list of booking 'ids' or a 'filter'."}, 400
+
+    if ids is not None:
+        if not isinstance(ids, list) or not ids or not all(isinstance(booking_id, int) and not isinstance(booking_id, bool) for booking_id in ids):
+            return {"error": "'ids' must be a non-empty list of booking IDs."}, 400
+        if len(ids) > BULK_STATUS_MAX_IDS:
+            return {"error": f"A maximum of {BULK_STATUS_MAX_IDS} bookings can be updated at once."}, 400
+        conditions = [Booking.id.in_(ids)]
+    else:
+        if not isinstance(booking_filter, dict):
+            return {"error": "'filter' must be an object."}, 400
+        conditions = []
+        if 'attraction_id' in booking_filter:
+            attraction_id = booking_filter['attraction_id']
+            if not isinstance(attraction_id, int) or isinstance(attraction_id, bool):
+                return {"error": "Filter 'attraction_id' must be an attraction ID."}, 400
+            conditions.append(Booking.attraction_id == attraction_id)
+        if 'booking_date' in booking_filter:
+            try:
+                day = datetime.strptime(booking_filter['booking_date'], '%d-%m-%Y')
+            except (TypeError, ValueError):
+                return {"error": "Invalid booking date format. Enter as DD-MM-YYYY."}, 400
+            conditions.extend([Booking.booking_date >= day, Booking.booking_date < day + timedelta(days=1)])
+        if 'status' in booking_filter:
+            if booking_filter['status'] not in BOOKING_STATUSES:
+                return {"error": "Filter status can only be 'Requested', 'Confirmed', or 'Cancelled'."}, 400
+            conditions.append(Booking.status == booking_filter['status'])
+        if not conditions:
+            return {"error": "The filter needs at least one of 'attraction_id', 'booking_date' or 'status'."}, 400
+
+    # Locks the matching bookings and changes their status in one statement, returning each previous status
+    previous = (
+        db.select(Booking.id, Booking.status.label('previous_status'))
+        .where(*conditions, Booking.status != new_status)
+        .with_for_update()
+        .subquery('previous')
+    )
+    changed = db.session.execute(
+        db.update(Booking)
+        .where(Booking.id == previous.c.id)
+        .values(status=new_status, version_id=Booking.version_id + 1)
+        .returning(
+            Booking.id, Booking.attraction_id, Booking.number_of_guests, Booking.booking_date,
+            Booking.total_cost, previous.c.previous_status
+        )
+        .execution_options(synchronize_session=False)
+    ).all()
+
+    # Works out the slot changes per attraction, and which bookings leave or rejoin the daily rollups
+    slot_deltas = {}
+    released = [row for row in changed if holds_slots(row.previous_status) and not holds_slots(new_status)]
+    reinstated = [row for row in changed if not holds_slots(row.previous_status) and holds_slots(new_status)]
+    for row, sign in [(row, 1) for row in released] + [(row, -1) for row in reinstated]:
+        slot_deltas[row.attraction_id] = slot_deltas.get(row.attraction_id, 0) + sign * row.number_of_guests
+
+    expected = {attraction_id for attraction_id, delta in slot_deltas.items() if delta}
+    short = expected - adjust_slots_bulk(slot_deltas)
+    if short:
+        db.session.rollback()
+        return {"error": "Not enough available slots to reinstate these bookings.", "attraction_ids": sorted(short)}, 400
+
+    record_bulk_change(released, -1)
+    record_bulk_change(reinstated, 1)
+    db.session.commit()
+    audit_status_changes([(row.id, row.previous_status) for row in changed], new_status, 'admin_bulk_update')
+
+    # Reports the outcome for every booking
+    results = [{"id": row.id, "outcome": "updated", "previous_status": row.previous_status} for row in changed]
+    if ids is not None:
+        skipped = set(ids) - {row.id for row in changed}
+        existing = set(db.session.scalars(db.select(Booking.id).where(Booking.id.in_(skipped)))) if skipped else set()
+        results.extend(
+            {"id": booking_id, "outcome": "unchanged" if booking_id in existing else "not_found"}
+            for booking_id in sorted(skipped)
+        )
+
+    return {"status": new_status, "updated": len(changed), "results": results}, 200
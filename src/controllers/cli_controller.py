@@ -1,12 +1,25 @@
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+from time import monotonic
 
-from flask import Blueprint
+import click
+from flask import Blueprint, current_app
 
 from init import db, bcrypt
 from models.user import User
 from models.booking import Booking, booking_status
 from models.attraction import Attraction
 from models.review import Review
+from utils.rollup_utils import rebuild_booking_rollups
+from utils.confirmation_utils import load_rules, run_confirmation_worker
+from utils.sweeper_utils import preview_stale_bookings, sweep_stale_bookings
+from utils.idempotency_utils import purge_expired_idempotency_keys
+from utils.migration_utils import run_migrations
+from utils.revocation_utils import purge_expired_revocations
+from utils.partition_utils import partition_bookings, archive_bookings, month_start
+from utils.import_utils import IMPORT_FORMATS, import_attractions
+from utils.recommendation_utils import refresh_recommendations
 
 db_commands = Blueprint('db', __name__)
 
@@ -20,6 +33,15 @@ def drop_tables():
     db.drop_all()
     print("Tables dropped")
 
+@db_commands.cli.command('upgrade')
+def upgrade_tables():
+    """
+    Brings an existing database up to date with the models without dropping any data.
+    """
+    for description in run_migrations():
+        print(f"Applied: {description}")
+    print("Database upgraded")
+
 @db_commands.cli.command('seed')
 def seed_tables():
     users = [
@@ -105,5 +127,134 @@ def seed_tables():
 
     db.session.add_all(reviews)
     db.session.commit()
+
+    rebuild_booking_rollups()
     
-    print("Tables seeded")
\ No newline at end of file
+    print("Tables seeded")
+
+@db_commands.cli.command('rebuild-rollups')
+def rebuild_rollups():
+    count = rebuild_booking_rollups()
+    print(f"Booking rollups rebuilt ({count} daily rows)")
+
+@db_commands.cli.command('confirm-bookings')
+@click.option('--workers', default=2, show_default=True, help='Number of worker threads.')
+@click.option('--batch-size', default=200, show_default=True, help='Bookings claimed per transaction.')
+@click.option('--interval', type=float, default=None, help='Keep running, starting a new pass every INTERVAL seconds.')
+def confirm_bookings(workers, batch_size, interval):
+    """
+    Confirms "Requested" bookings that pass the AUTO_CONFIRM_RULES checks, in batches.
+
+    Runs a single pass by default. With --interval it keeps running until interrupted.
+    Several copies of this command can safely run at the same time.
+    """
+    try:
+        rules = load_rules(current_app.config["AUTO_CONFIRM_RULES"])
+    except ValueError as err:
+        raise click.BadParameter(str(err), param_hint='AUTO_CONFIRM_RULES')
+
+    app = current_app._get_current_object()
+    stop_event = Event()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(run_confirmation_worker, app, rules, batch_size, interval, stop_event)
+            for _ in range(workers)
+        ]
+        try:
+            results = [future.result() for future in futures]
+        except KeyboardInterrupt:
+            stop_event.set()
+            results = [future.result() for future in futures]
+
+    confirmed = sum(result['confirmed'] for result in results)
+    held = set().union(*(result['held_ids'] for result in results))
+    print(f"Bookings confirmed: {confirmed} ({len(held)} held for admin review)")
+
+@db_commands.cli.command('sweep-bookings')
+@click.option('--dry-run', is_flag=True, help='Only report what would be expired.')
+@click.option('--batch-size', type=int, default=None, help='Bookings expired per transaction (default SWEEPER_BATCH_SIZE).')
+@click.option('--max-batches', type=int, default=None, help='Stop after this many batches.')
+def sweep_bookings(dry_run, batch_size, max_batches):
+    """
+    Cancels "Requested" bookings whose date has passed or that were never confirmed,
+    and gives their slots back to the attractions.
+    """
+    if dry_run:
+        preview = preview_stale_bookings()
+        print(f"Dry run: {preview['bookings']} stale bookings would be expired, releasing {preview['slots']} slots across {preview['attractions']} attractions")
+        return
+
+    result = sweep_stale_bookings(batch_size, max_batches)
+    print(f"Expired {result['bookings_expired']} stale bookings in {result['batches']} batches, released {result['slots_released']} slots ({result['seconds']}s)")
+
+@db_commands.cli.command('purge-idempotency-keys')
+def purge_idempotency_keys():
+    count = purge_expired_idempotency_keys()
+    print(f"Expired idempotency keys deleted: {count}")
+
+@db_commands.cli.command('purge-revoked-tokens')
+def purge_revoked_tokens():
+    count = purge_expired_revocations()
+    print(f"Expired token revocations deleted: {count}")
+
+@db_commands.cli.command('partition-bookings')
+@click.option('--months-ahead', default=12, show_default=True, help='Create partitions up to this many months from now.')
+def partition_bookings_table(months_ahead):
+    """
+    Partitions the bookings table by booking date month, or adds partitions for upcoming months if it
+    already is. Converting the table blocks writes to bookings while the rows are copied.
+    """
+    count = partition_bookings(months_ahead)
+    print(f"Booking partitions created: {count}")
+
+@db_commands.cli.command('archive-bookings')
+@click.option('--before', required=True, help='Archive bookings dated before this month (MM-YYYY).')
+@click.option('--batch-size', default=5000, show_default=True, help='Bookings moved per transaction outside monthly partitions.')
+def archive_old_bookings(before, batch_size):
+    """
+    Moves bookings dated before a month to the archived_bookings table. The month can't be later than the current one.
+    """
+    try:
+        before = datetime.strptime(before, '%m-%Y').date()
+    except ValueError:
+        raise click.BadParameter("Enter the month as MM-YYYY.", param_hint='--before')
+    if before > month_start(datetime.utcnow().date()):
+        raise click.BadParameter("Only bookings dated before the current month can be archived.", param_hint='--before')
+
+    for description in archive_bookings(before, batch_size):
+        print(description)
+    print("Bookings archived")
+
+@db_commands.cli.command('import-attractions')
+@click.argument('file', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(IMPORT_FORMATS), default=None, help='File format (default from the file extension).')
+@click.option('--batch-size', type=int, default=None, help='Rows validated and written together (default IMPORT_BATCH_SIZE).')
+def import_attractions_file(file, file_format, batch_size):
+    """
+    Creates or updates attractions from a CSV (with a header row) or newline delimited JSON file.
+    Attractions with the same name as an existing one update it. Invalid rows are listed and skipped.
+    """
+    if file_format is None:
+        file_format = 'csv' if file.endswith('.csv') else 'ndjson'
+    with open(file, encoding='utf-8-sig', newline='') as stream:
+        result = import_attractions(stream, file_format, batch_size or current_app.config["IMPORT_BATCH_SIZE"])
+
+    for error in result['errors']:
+        print(f"Row {error['row']}: {error['errors']}")
+    if result['errors_truncated']:
+        print(f"Only the first {len(result['errors'])} row errors are listed")
+    print(f"Attractions imported: {result['inserted']} created, {result['updated']} updated, {result['failed']} failed")
+
+@db_commands.cli.command('build-recommendations')
+def build_recommendations():
+    """
+    Rebuilds the "also booked" index of related attractions from the bookings, and saves it to
+    RECOMMENDATIONS_PATH, where the API processes pick it up.
+    """
+    started = monotonic()
+    try:
+        index, user_count = refresh_recommendations(current_app)
+    except ValueError as err:
+        raise click.BadParameter(str(err), param_hint='RECOMMENDATIONS_METRIC')
+    stats = index.stats()
+    print(f"Recommendations built from {user_count} users: {stats['pairs']} related pairs for {stats['attractions']} attractions ({round(monotonic() - started, 3)}s)")
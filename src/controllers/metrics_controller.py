@@ -0,0 +1,43 @@
+from flask import Blueprint, current_app
+from flask_jwt_extended import jwt_required
+
+from utils.auth_utils import authorise_as_admin
+from utils.admission_utils import admission_pool
+
+metrics_bp = Blueprint('metrics_bp', __name__, url_prefix='/metrics')
+
+@metrics_bp.route('', methods=['GET']) # Admin view of the API process' internal counters
+@admission_pool('admin')
+@jwt_required()
+@authorise_as_admin
+def get_metrics():
+    """
+    Returns the internal counters of the API process that served the request. Restricted to admin only.
+
+    Counters are kept per process since it started, so with several worker processes each answers for itself.
+
+    Includes:
+    - statement_cache: SQLAlchemy compiled statement cache hits, misses and hit ratio.
+    - compression_cache: entries, size, hits and misses of the compressed response cache.
+    - attraction_cache: entries, hits and misses of the encoded attraction cache.
+    - audit_log: audit events recorded, written, dropped and queued.
+    - admission: the limit, requests in flight and waiting, and admitted and rejected counts of each pool.
+    - availability_streams: open live availability streams and the attractions they watch.
+    - slot_counters: attractions with a known count in the host's shared slot counters, how many are sold
+      out, and the bookings this process rejected early because of them.
+    - recommendations: when the loaded recommendation index was built, and its attractions, pairs and size.
+    - profiler: requests profiled, and skipped because another was being profiled or the per-minute limit was reached.
+    """
+    extensions = current_app.extensions
+    broker = extensions['availability_broker']
+    return {
+        'statement_cache': extensions['statement_cache_stats'].stats(),
+        'compression_cache': extensions['compression_cache'].stats(),
+        'attraction_cache': extensions['attraction_cache'].stats(),
+        'audit_log': extensions['audit_log'].stats(),
+        'admission': {name: limiter.stats() for name, limiter in extensions.get('admission_limiters', {}).items()},
+        'availability_streams': {'clients': broker.count, 'attractions': len(broker.watched_ids())},
+        'slot_counters': extensions['slot_counters'].stats() if 'slot_counters' in extensions else None,
+        'recommendations': extensions['recommendations'].stats(),
+        'profiler': extensions['request_profiler'].stats() if 'request_profiler' in extensions else None,
+    }, 200
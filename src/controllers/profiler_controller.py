@@ -0,0 +1,43 @@
+from flask import Blueprint, current_app, request, send_from_directory
+from flask_jwt_extended import jwt_required
+
+from utils.auth_utils import authorise_as_admin
+from utils.admission_utils import admission_pool
+from utils.profiler_utils import list_profiles
+
+profiler_bp = Blueprint('profiler_bp', __name__, url_prefix='/profiles')
+
+@profiler_bp.route('', methods=['GET']) # List stored request profiles - admin only
+@admission_pool('admin')
+@jwt_required()
+@authorise_as_admin
+def get_profiles():
+    """
+    Lists the stored request profiles, newest first, with the time each took and where it went.
+    Restricted to admin only.
+
+    Profiles are written by every API process to the shared PROFILER_DIR.
+    """
+    return list_profiles(current_app.config["PROFILER_DIR"]), 200
+
+@profiler_bp.route('/<profile_id>', methods=['GET']) # Download one request profile - admin only
+@admission_pool('admin')
+@jwt_required()
+@authorise_as_admin
+def get_profile(profile_id):
+    """
+    Downloads a request profile. Restricted to admin only.
+
+    Returns the JSON report by default, with the SQL statements run, the time spent in each section and
+    the slowest functions. With `format=pstats`, returns the raw profiler stats instead, for loading into
+    pstats or snakeviz.
+    """
+    file_format = request.args.get('format', 'json')
+    if file_format == 'json':
+        return send_from_directory(current_app.config["PROFILER_DIR"], f"{profile_id}.json", mimetype='application/json')
+    if file_format == 'pstats':
+        return send_from_directory(
+            current_app.config["PROFILER_DIR"], f"{profile_id}.prof",
+            mimetype='application/octet-stream', as_attachment=True,
+        )
+    return {"error": "Set format to one of: json, pstats."}, 400
@@ -1,33 +1,55 @@
-from datetime import datetime
+from datetime import datetime, time
 
 from flask import Blueprint, request, g
 from flask_jwt_extended import jwt_required
 from marshmallow import ValidationError
+from sqlalchemy import bindparam
+from sqlalchemy.dialects.postgresql import insert
 
 from init import db
 from models.review import Review, review_schema, reviews_schema
-from models.booking import Booking
+from models.booking import Booking, booking_status
+from models.attraction import Attraction
 
 from utils.auth_utils import load_current_user
+from utils.attraction_cache_utils import bump_content_versions
 
 review_bp = Blueprint('review_bp', __name__, url_prefix='/review')
 
-def user_has_confirmed_booking(user_id, attraction_id):
-    """
-    Checks if a user has a confirmed booking for an attraction that has already occurred.
-
-    Returns (boolean) True if there is a confirmed booking for the attraction that has occurred, False otherwise.
-    """
-    current_date = datetime.utcnow().date()
-
-    booking = Booking.query.filter(
-        Booking.user_id == user_id,
-        Booking.attraction_id == attraction_id,
-        Booking.status == 'Confirmed',  # Use == instead of calling status as a function
-        Booking.booking_date < current_date
-    ).first()
-
-    return booking is not None
+# The review statements are built once with bound parameters, so each request reuses them and their cache key
+# rather than rebuilding both.
+
+# True when the user has a confirmed booking for the attraction that has already occurred. The booking date is
+# compared with the start of today as a datetime, the same type as the column, so the check is answered from the
+# ix_bookings_confirmed_user_attraction index.
+confirmed_past_booking = db.exists().where(
+    Booking.user_id == bindparam('user_id'),
+    Booking.attraction_id == bindparam('attraction_id'),
+    Booking.status == booking_status.CONFIRMED,
+    Booking.booking_date < bindparam('start_of_today'),
+)
+
+# Inserts the review only if the user has a confirmed past booking and hasn't reviewed the attraction yet
+insert_review_stmt = (
+    insert(Review)
+    .from_select(
+        ['user_id', 'attraction_id', 'rating', 'comment', 'created_at'],
+        db.select(
+            bindparam('user_id', type_=db.Integer),
+            bindparam('attraction_id', type_=db.Integer),
+            bindparam('rating', type_=db.Integer),
+            bindparam('comment', type_=db.String),
+            bindparam('created_at', type_=db.DateTime),
+        ).where(confirmed_past_booking)
+    )
+    .on_conflict_do_nothing(constraint='uix_user_attraction_review')
+    .returning(Review.id)
+)
+user_review_id_stmt = db.select(Review.id).where(
+    Review.user_id == bindparam('user_id'), Review.attraction_id == bindparam('attraction_id')
+)
+user_reviews_stmt = db.select(Review).where(Review.user_id == bindparam('user_id'))
+user_review_stmt = db.select(Review).where(Review.id == bindparam('review_id'), Review.user_id == bindparam('user_id'))
 
 @review_bp.route('/create/<int:attraction_id>', methods=['POST']) # Create review
 @jwt_required()
@@ -39,6 +61,10 @@ def leave_review(attraction_id):
     
     If users have already left a review for an attraction, they won't be able to leave another.
 
+    The checks and the insert are a single INSERT ... SELECT ... WHERE EXISTS statement. A second review
+    for the same attraction is skipped by ON CONFLICT DO NOTHING on the uix_user_attraction_review constraint,
+    so concurrent requests can't both add one.
+
     JSON Payload example:
     
     {
@@ -48,28 +74,32 @@ def leave_review(attraction_id):
     """
     user_id = g.current_user.id
 
-    # Check if the user already left a review for this attraction.
-    existing_review = Review.query.filter_by(user_id=user_id, attraction_id=attraction_id).first()
-    if existing_review:
-        return {"error": "You have already left a review for this attraction"}, 403
-
-    # Check if the user has a past confirmed booking
-    if not user_has_confirmed_booking(user_id, attraction_id):
-        return {"error": "No confirmed booking for this attraction"}, 403
-
     body_data = request.get_json()
-    rating = body_data.get('rating')
-    comment = body_data.get('comment')
-
-    review = Review(
-        user_id=user_id,
-        attraction_id=attraction_id,
-        rating=rating,
-        comment=comment
-    )
-    db.session.add(review)
+    validated_data = review_schema.load(body_data)
+
+    now = datetime.utcnow()
+    review_id = db.session.scalar(insert_review_stmt, {
+        'user_id': user_id,
+        'attraction_id': attraction_id,
+        'rating': validated_data['rating'],
+        'comment': validated_data.get('comment'),
+        'created_at': now,
+        'start_of_today': datetime.combine(now.date(), time.min),
+    })
+    if review_id is not None:
+        # Reviews are shown with the attraction, so its cached JSON is out of date
+        bump_content_versions(Attraction.id == attraction_id)
     db.session.commit()
 
+    if review_id is None:
+        # Nothing was inserted, either because of an existing review or no eligible booking
+        existing_review = db.session.scalar(
+            user_review_id_stmt, {'user_id': user_id, 'attraction_id': attraction_id}
+        )
+        if existing_review:
+            return {"error": "You have already left a review for this attraction"}, 403
+        return {"error": "No confirmed booking for this attraction"}, 403
+
     return {"message": "Review successfully added"}, 201
 
 @review_bp.route('/my_reviews', methods=['GET']) # See reviews as user
@@ -83,7 +113,7 @@ def get_my_reviews():
     associated with the user's ID and returns them.
     """
     user_id = g.current_user.id
-    reviews = Review.query.filter_by(user_id=user_id).all()
+    reviews = db.session.scalars(user_reviews_stmt, {'user_id': user_id}).all()
     return reviews_schema.dump(reviews), 200
 
 @review_bp.route('/update/<int:review_id>', methods=['PUT']) # Update review
@@ -102,7 +132,7 @@ def update_review(review_id):
 
     """
     user_id = g.current_user.id
-    review = Review.query.filter_by(id=review_id, user_id=user_id).first()
+    review = db.session.scalar(user_review_stmt, {'review_id': review_id, 'user_id': user_id})
     
     if review is None:
         return {"error": "Review not found or access denied"}, 404
@@ -116,6 +146,7 @@ def update_review(review_id):
     
     review.rating = validated_data.get('rating', review.rating)
     review.comment = validated_data.get('comment', review.comment)
+    bump_content_versions(Attraction.id == review.attraction_id)
     
     db.session.commit()
     
@@ -137,17 +168,18 @@ def delete_review(review_id):
 
     # Admin users can delete any review
     if user.is_admin:
-        review = Review.query.get(review_id)
+        review = db.session.get(Review, review_id)
         if review is None:
             return {"error": "Review not found"}, 404
     else:
         # Regular users can only delete their own reviews
-        review = Review.query.filter_by(id=review_id, user_id=user.id).first()
+        review = db.session.scalar(user_review_stmt, {'review_id': review_id, 'user_id': user.id})
         if review is None:
             return {"error": "Review not found or access denied"}, 404
 
     # Proceed with deletion
     db.session.delete(review)
+    bump_content_versions(Attraction.id == review.attraction_id)
     db.session.commit()
 
     return {"message": "Review deleted successfully"}, 200
\ No newline at end of file
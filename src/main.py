@@ -1,7 +1,10 @@
 import os
+import tempfile
+from zoneinfo import ZoneInfo
 
 from flask import Flask
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
 from psycopg2 import errorcodes
 from marshmallow.exceptions import ValidationError
 
@@ -20,12 +23,156 @@ def create_app():
     # Configures the app from environment variables (in the .env file)
     app.config["SQLALCHEMY_DATABASE_URI"]=os.environ.get("DATABASE_URI")
     app.config["JWT_SECRET_KEY"]=os.environ.get("JWT_SECRET_KEY")
+
+    # Connection pool of each process. Every thread serving requests can hold one connection.
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"]={
+        "pool_size": int(os.environ.get("DB_POOL_SIZE") or 5),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW") or 10),
+        "pool_pre_ping": True,
+    }
+
+    # Set by serve.py, which starts the background threads in each worker process after it is forked
+    app.config["DEFER_BACKGROUND_WORKERS"]=os.environ.get("DEFER_BACKGROUND_WORKERS", "").lower() in ("1", "true", "yes")
+
+    # Rules and limits used by the background booking confirmation workers (flask db confirm-bookings)
+    app.config["AUTO_CONFIRM_RULES"]=os.environ.get("AUTO_CONFIRM_RULES", "account_unlocked,booking_cost,daily_spend")
+    app.config["AUTO_CONFIRM_MAX_BOOKING_COST"]=float(os.environ.get("AUTO_CONFIRM_MAX_BOOKING_COST") or 1000)
+    app.config["AUTO_CONFIRM_DAILY_SPEND_LIMIT"]=float(os.environ.get("AUTO_CONFIRM_DAILY_SPEND_LIMIT") or 2500)
+
+    # Expiry of stale "Requested" bookings (flask db sweep-bookings, or in-process every SWEEPER_INTERVAL_SECONDS)
+    app.config["REQUESTED_BOOKING_TTL_HOURS"]=float(os.environ.get("REQUESTED_BOOKING_TTL_HOURS") or 72)
+    app.config["SWEEPER_BATCH_SIZE"]=int(os.environ.get("SWEEPER_BATCH_SIZE") or 500)
+    app.config["SWEEPER_INTERVAL_SECONDS"]=float(os.environ.get("SWEEPER_INTERVAL_SECONDS") or 0)
+
+    # How long booking responses are kept for Idempotency-Key replays, and how long a retry waits for the original
+    app.config["IDEMPOTENCY_KEY_TTL_HOURS"]=float(os.environ.get("IDEMPOTENCY_KEY_TTL_HOURS") or 24)
+    app.config["IDEMPOTENCY_LOCK_TIMEOUT_SECONDS"]=float(os.environ.get("IDEMPOTENCY_LOCK_TIMEOUT_SECONDS") or 10)
+
+    # Response compression: gzip/deflate level, smallest body worth compressing, and memory for compressed bodies
+    app.config["COMPRESSION_LEVEL"]=int(os.environ.get("COMPRESSION_LEVEL") or 6)
+    app.config["COMPRESSION_MIN_BYTES"]=int(os.environ.get("COMPRESSION_MIN_BYTES") or 1024)
+    app.config["COMPRESSION_CACHE_BYTES"]=int(os.environ.get("COMPRESSION_CACHE_BYTES") or 32 * 1024 * 1024)
+
+    # How often each process reloads the revoked token filter, picking up logouts made in other processes
+    app.config["REVOCATION_REFRESH_SECONDS"]=float(os.environ.get("REVOCATION_REFRESH_SECONDS") or 30)
+
+    # Number of recent bookings in the user profile summary, and the largest page of the full profile view
+    app.config["PROFILE_RECENT_BOOKINGS"]=int(os.environ.get("PROFILE_RECENT_BOOKINGS") or 5)
+    app.config["PROFILE_MAX_PAGE_SIZE"]=int(os.environ.get("PROFILE_MAX_PAGE_SIZE") or 100)
+
+    # Time zone of the attractions' opening hours, which decides what "today" is for open_at queries
+    app.config["ATTRACTIONS_TIMEZONE"]=ZoneInfo(os.environ.get("ATTRACTIONS_TIMEZONE") or "Australia/Sydney")
+
+    # Audit log writer: queue size, events per insert, longest wait before writing, and what to do when the queue is full
+    app.config["AUDIT_QUEUE_SIZE"]=int(os.environ.get("AUDIT_QUEUE_SIZE") or 10000)
+    app.config["AUDIT_BATCH_SIZE"]=int(os.environ.get("AUDIT_BATCH_SIZE") or 500)
+    app.config["AUDIT_FLUSH_INTERVAL_MS"]=float(os.environ.get("AUDIT_FLUSH_INTERVAL_MS") or 200)
+    app.config["AUDIT_QUEUE_FULL_POLICY"]=os.environ.get("AUDIT_QUEUE_FULL_POLICY", "block")
+    app.config["AUDIT_ENQUEUE_TIMEOUT_MS"]=float(os.environ.get("AUDIT_ENQUEUE_TIMEOUT_MS") or 50)
+
+    # Most attractions kept encoded as JSON for the attraction endpoints, per process
+    app.config["ATTRACTION_CACHE_SIZE"]=int(os.environ.get("ATTRACTION_CACHE_SIZE") or 1000)
+
+    # Attraction imports: rows validated and written together, and the most row errors reported
+    app.config["IMPORT_BATCH_SIZE"]=int(os.environ.get("IMPORT_BATCH_SIZE") or 1000)
+    app.config["IMPORT_MAX_ERRORS"]=int(os.environ.get("IMPORT_MAX_ERRORS") or 1000)
+
+    # "Also booked" recommendations: related attractions kept per attraction, how they're scored (cosine or cooccurrence),
+    # where the index is saved, how often each process checks it for a rebuild, and how often it's rebuilt in-process (0 for never)
+    app.config["RECOMMENDATIONS_TOP_K"]=int(os.environ.get("RECOMMENDATIONS_TOP_K") or 20)
+    app.config["RECOMMENDATIONS_METRIC"]=os.environ.get("RECOMMENDATIONS_METRIC") or "cosine"
+    app.config["RECOMMENDATIONS_PATH"]=os.environ.get("RECOMMENDATIONS_PATH") or os.path.join(app.instance_path, "recommendations.npz")
+    app.config["RECOMMENDATIONS_RELOAD_SECONDS"]=float(os.environ.get("RECOMMENDATIONS_RELOAD_SECONDS") or 60)
+    app.config["RECOMMENDATIONS_REFRESH_SECONDS"]=float(os.environ.get("RECOMMENDATIONS_REFRESH_SECONDS") or 0)
+
+    # Slot counters shared by the API processes on a host, for rejecting bookings of sold out attractions early (turned on by serve.py): the
+    # memory-mapped file, the highest attraction ID it holds plus one, and how often each process refreshes it from the database
+    app.config["SLOT_COUNTERS"]=os.environ.get("SLOT_COUNTERS", "").lower() in ("1", "true", "yes")
+    app.config["SLOT_COUNTERS_PATH"]=os.environ.get("SLOT_COUNTERS_PATH") or os.path.join(
+        "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "attractions-api-slots"
+    )
+    app.config["SLOT_COUNTERS_CAPACITY"]=int(os.environ.get("SLOT_COUNTERS_CAPACITY") or 65536)
+    app.config["SLOT_COUNTERS_REFRESH_SECONDS"]=float(os.environ.get("SLOT_COUNTERS_REFRESH_SECONDS") or 60)
+
+    # Live availability streams: most clients per process, most attractions per stream, and seconds between keep-alives
+    app.config["STREAM_MAX_CLIENTS"]=int(os.environ.get("STREAM_MAX_CLIENTS") or 20)
+    app.config["STREAM_MAX_IDS"]=int(os.environ.get("STREAM_MAX_IDS") or 50)
+    app.config["SSE_HEARTBEAT_SECONDS"]=float(os.environ.get("SSE_HEARTBEAT_SECONDS") or 15)
+
+    # Admission control: concurrency limit per endpoint pool, the queue of requests waiting for each pool and
+    # how long they wait, the server threads per process (as in serve.py) that running and queued requests must
+    # fit in, and an optional latency target the limits adapt to
+    app.config["ADMISSION_CONTROL"]=os.environ.get("ADMISSION_CONTROL", "true").lower() in ("1", "true", "yes")
+    app.config["ADMISSION_LIMITS"]=(
+        os.environ.get("ADMISSION_LIMITS") or f"bookings=10,admin=2,default=20,streams={app.config['STREAM_MAX_CLIENTS']}"
+    )
+    app.config["ADMISSION_QUEUE_SIZES"]=os.environ.get("ADMISSION_QUEUE_SIZES") or "bookings=10,admin=0,default=5,streams=0"
+    app.config["ADMISSION_MAX_THREADS"]=int(
+        os.environ.get("WEB_THREADS") or app.config["SQLALCHEMY_ENGINE_OPTIONS"]["pool_size"] + app.config["STREAM_MAX_CLIENTS"]
+    )
+    app.config["ADMISSION_QUEUE_TIMEOUT_MS"]=float(os.environ.get("ADMISSION_QUEUE_TIMEOUT_MS") or 500)
+    app.config["ADMISSION_TARGET_LATENCY_MS"]=float(os.environ.get("ADMISSION_TARGET_LATENCY_MS") or 0)
+    app.config["ADMISSION_RETRY_AFTER_SECONDS"]=int(os.environ.get("ADMISSION_RETRY_AFTER_SECONDS") or 1)
+
+    # Opt-in request profiling: requests an admin sends with an X-Profile header, or one in every PROFILER_SAMPLE_EVERY
+    # (0 for none), are profiled. At most PROFILER_MAX_PER_MINUTE per process, keeping the newest profiles within the file and disk limits.
+    app.config["PROFILER_ENABLED"]=os.environ.get("PROFILER_ENABLED", "").lower() in ("1", "true", "yes")
+    app.config["PROFILER_SAMPLE_EVERY"]=int(os.environ.get("PROFILER_SAMPLE_EVERY") or 0)
+    app.config["PROFILER_DIR"]=os.environ.get("PROFILER_DIR") or os.path.join(tempfile.gettempdir(), "attractions-api-profiles")
+    app.config["PROFILER_MAX_PER_MINUTE"]=int(os.environ.get("PROFILER_MAX_PER_MINUTE") or 6)
+    app.config["PROFILER_MAX_FILES"]=int(os.environ.get("PROFILER_MAX_FILES") or 50)
+    app.config["PROFILER_MAX_DISK_MB"]=int(os.environ.get("PROFILER_MAX_DISK_MB") or 100)
+    app.config["PROFILER_MAX_STATEMENTS"]=int(os.environ.get("PROFILER_MAX_STATEMENTS") or 200)
+
+    # Optional warm-up when the app is created, so the first requests after a deploy aren't slowed by lazy setup
+    app.config["WARMUP_ON_START"]=os.environ.get("WARMUP_ON_START", "").lower() in ("1", "true", "yes")
+    app.config["WARMUP_POOL_CONNECTIONS"]=int(os.environ.get("WARMUP_POOL_CONNECTIONS") or 2)
     
     # Initialises extensions in app
     db.init_app(app)
     ma.init_app(app)
     bcrypt.init_app(app)
     jwt.init_app(app)
+
+    # Compresses large responses for clients that accept it
+    from utils.compression_utils import init_compression
+    init_compression(app)
+
+    # Registers the revoked token check with the JWT manager, and the filter's background rebuild
+    from utils.revocation_utils import init_revocations
+    init_revocations(app)
+
+    # Audit trail of booking and account changes, written in batches by a background thread
+    from utils.audit_utils import init_audit
+    init_audit(app)
+
+    # Encoded JSON of each attraction, reused until the attraction changes
+    from utils.attraction_cache_utils import init_attraction_cache
+    init_attraction_cache(app)
+
+    # "Also booked" recommendation index, loaded from disk and reloaded when it is rebuilt
+    from utils.recommendation_utils import init_recommendations
+    init_recommendations(app)
+
+    # Per-pool concurrency limits, so a burst on one kind of endpoint can't starve the others
+    from utils.admission_utils import init_admission
+    init_admission(app)
+
+    # Profiles requests on demand, after admission so time spent queued isn't counted
+    from utils.profiler_utils import init_profiler
+    init_profiler(app)
+
+    # Remaining slots of each attraction in memory shared by the processes on the host, checked before booking
+    from utils.slot_counter_utils import init_slot_counters
+    init_slot_counters(app)
+
+    # Live slot counts for the availability stream, fed by Postgres notifications to each process
+    from utils.availability_utils import init_availability
+    init_availability(app)
+
+    # Counts compiled statement cache hits and misses, reported by /metrics
+    from utils.statement_cache_utils import init_statement_cache_stats
+    init_statement_cache_stats(app)
     
     # Global error handlers for common errors that return JSON responses
     @app.errorhandler(404)
@@ -78,6 +225,14 @@ def create_app():
             return {"error": error_message}, 409
 
         return {"error": "A database integrity error occurred."}, 500
+
+    @app.errorhandler(StaleDataError)
+    def stale_data_error(err):
+        """
+        Handler for optimistic locking conflicts, raised when a versioned row was changed
+        by another request between being loaded and being updated or deleted.
+        """
+        return {"error": "This record has been changed by another request. Reload it and try again."}, 412
         
     from controllers.cli_controller import db_commands
     app.register_blueprint(db_commands)
@@ -93,5 +248,24 @@ def create_app():
     
     from controllers.review_controller import review_bp
     app.register_blueprint(review_bp)
+
+    from controllers.metrics_controller import metrics_bp
+    app.register_blueprint(metrics_bp)
+
+    from controllers.profiler_controller import profiler_bp
+    app.register_blueprint(profiler_bp)
+
+    if app.config["WARMUP_ON_START"]:
+        from utils.warmup_utils import warm_up
+        # When preloaded by serve.py, the database steps run in each worker after it is forked instead (see post_fork)
+        warm_up(app, database=not app.config["DEFER_BACKGROUND_WORKERS"])
+
+    from utils.background_utils import register_background_worker, start_background_workers
+    from utils.sweeper_utils import start_sweeper_thread
+    register_background_worker(app, start_sweeper_thread)
+    from utils.recommendation_utils import start_recommendation_thread
+    register_background_worker(app, start_recommendation_thread)
+    if not app.config["DEFER_BACKGROUND_WORKERS"]:
+        start_background_workers(app)
     
     return app
\ No newline at end of file
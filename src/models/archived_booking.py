@@ -0,0 +1,32 @@
+from datetime import datetime
+
+from init import db
+from models.booking import BookingSchema
+
+class ArchivedBooking(db.Model):
+    """
+    A past booking moved out of the bookings table by `flask db archive-bookings`.
+
+    Has the same columns as Booking, so rows can be copied across as they are, plus the time they were archived.
+    Archived bookings are read only. They are still deleted with their user or attraction.
+
+    Attributes:
+        archived_at: Timestamp when the booking was moved to the archive.
+    """
+    __tablename__ = "archived_bookings"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    attraction_id = db.Column(db.Integer, db.ForeignKey('attractions.id', ondelete='CASCADE'), nullable=False, index=True)
+    booking_date = db.Column(db.DateTime, nullable=False)
+    number_of_guests = db.Column(db.Integer, nullable=False)
+    total_cost = db.Column(db.Float)
+    status = db.Column(db.String, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    version_id = db.Column(db.Integer, nullable=False, server_default='1')
+    archived_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
+
+    attraction = db.relationship('Attraction')
+
+# Archived bookings are only listed for their own user
+archived_bookings_schema = BookingSchema(many=True, exclude=['user'])
@@ -1,11 +1,12 @@
-from sqlalchemy.orm import column_property
-from sqlalchemy import select, func
-from marshmallow import fields
-from marshmallow.validate import Regexp, Length
+from sqlalchemy.orm import Session, column_property
+from sqlalchemy import event, inspect, select, func
+from marshmallow import fields, validates_schema, ValidationError, EXCLUDE
+from marshmallow.validate import Regexp, Length, OneOf, Range
 
 from init import db, ma
 
 from models.review import Review
+from models.opening_hours import OpeningHours, WEEKDAYS, HOURS_PATTERN, CLOSED, weekly_hours
 
 class Attraction(db.Model):
     """
@@ -20,7 +21,10 @@ class Attraction(db.Model):
         contact_phone: Contact phone number for the attraction (must be 10 characters representative of an Australian mobile or landline).
         contact_email: Contact email address for the attraction (must be in correct email format).
         opening_hours: Opening hours of the attraction, in 'HH:MM - HH:MM' 24hr format.
+        weekday_hours: Optional hours for particular days that differ from opening_hours, as {day name: hours},
+            where day names are 'mon' to 'sun' and hours are in the same format or 'closed'.
         available_slots: Number of available slots for booking the attraction.
+        version_id: Incremented on every change, used to detect conflicting updates (exposed as the ETag).
     """
     __tablename__ = "attractions"
     
@@ -32,10 +36,15 @@ class Attraction(db.Model):
     contact_phone = db.Column(db.String, nullable=False)
     contact_email = db.Column(db.String, nullable=False)
     opening_hours = db.Column(db.String, nullable=False)
+    weekday_hours = db.Column(db.JSON)
     available_slots = db.Column(db.Integer, nullable=False)
+    version_id = db.Column(db.Integer, nullable=False, server_default='1')
 
-    bookings = db.relationship('Booking', back_populates='attraction', cascade='all, delete')
-    reviews = db.relationship('Review', back_populates='attraction', cascade='all, delete')
+    # Bookings and reviews are removed by ON DELETE CASCADE in the database, without being loaded first
+    bookings = db.relationship('Booking', back_populates='attraction', cascade='all, delete', passive_deletes=True)
+    reviews = db.relationship('Review', back_populates='attraction', cascade='all, delete', passive_deletes=True)
+    # Parsed from opening_hours and weekday_hours, for "open at" queries
+    hours = db.relationship('OpeningHours', cascade='all, delete-orphan', passive_deletes=True)
 
     average_rating = column_property(
         select(func.coalesce(func.avg(Review.rating), 0))
@@ -43,7 +52,26 @@ class Attraction(db.Model):
         .correlate_except(Review)
         .scalar_subquery()
     )
-    
+
+    # Updates and deletes fail with a StaleDataError if the row was changed since it was loaded
+    __mapper_args__ = {"version_id_col": version_id}
+
+@event.listens_for(Session, 'before_flush')
+def sync_opening_hours(session, flush_context, instances):
+    """
+    Rebuilds the parsed opening hours of new attractions, and of attractions whose hours changed, before
+    they are saved. Covers every way attractions are created or edited through the ORM.
+    """
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Attraction):
+            continue
+        state = inspect(obj)
+        if state.pending or state.attrs.opening_hours.history.has_changes() or state.attrs.weekday_hours.history.has_changes():
+            obj.hours = [
+                OpeningHours(weekday=weekday, opens_at=opens_at, closes_at=closes_at)
+                for weekday, opens_at, closes_at in weekly_hours(obj.opening_hours, obj.weekday_hours)
+            ]
+
 class AttractionSchema(ma.Schema):
     """
     Schema for serialising and deserialising Attraction model objects.
@@ -56,16 +84,52 @@ class AttractionSchema(ma.Schema):
     contact_email = fields.Email()
     contact_phone = fields.String(validate=Length(equal=10, error="Phone number must contain 10 characters."))
     opening_hours = fields.String(required=True, validate=Regexp(
-        r'^((2[0-3]|[01]?[0-9]):([0-5]?[0-9]))\s*-\s*((2[0-3]|[01]?[0-9]):([0-5]?[0-9]))$',
+        HOURS_PATTERN,
         error="Opening hours must be in the format 'HH:MM - HH:MM' using 24-hour time."
     ))
+    weekday_hours = fields.Dict(
+        keys=fields.String(validate=OneOf(WEEKDAYS, error="Days must be one of: {choices}.")),
+        values=fields.String(validate=Regexp(
+            f'{HOURS_PATTERN}|^{CLOSED}$',
+            error=f"Opening hours must be in the format 'HH:MM - HH:MM' using 24-hour time, or '{CLOSED}'."
+        )),
+        allow_none=True
+    )
     
     # Helper method to calculate the average rating of the attraction.
     def get_average_rating(self, obj):
         return round(obj.average_rating, 1)
     # Fields that will be serialised and their order 
     class Meta:
-        fields = ('id', 'name', 'average_rating', 'ticket_price', 'location', 'description', 'contact_phone', 'contact_email', 'opening_hours', 'available_slots', 'reviews')
+        fields = ('id', 'name', 'average_rating', 'ticket_price', 'location', 'description', 'contact_phone', 'contact_email', 'opening_hours', 'weekday_hours', 'available_slots', 'reviews')
 
 attraction_schema = AttractionSchema()
-attractions_schema = AttractionSchema(many=True)
\ No newline at end of file
+attractions_schema = AttractionSchema(many=True)
+
+class AttractionImportSchema(AttractionSchema):
+    """
+    Schema for validating attractions in bulk imports (see utils/import_utils.py).
+
+    Rows from a file are inserted without going through the model, so every column is required and typed
+    here, and each row is checked fully before any is written. Unknown fields (such as the id and
+    average_rating columns of an export) are ignored.
+    """
+    name = fields.String(required=True, validate=Length(min=1, error="Name can't be empty."))
+    ticket_price = fields.Float(required=True, validate=Range(min=0, error="Ticket price can't be negative."))
+    location = fields.String(required=True)
+    available_slots = fields.Integer(required=True, validate=Range(min=0, error="Available slots can't be negative."))
+
+    @validates_schema
+    def require_columns(self, data, **kwargs):
+        missing = {
+            field: ["Missing data for required field."]
+            for field in ('description', 'contact_phone', 'contact_email') if field not in data
+        }
+        if missing:
+            raise ValidationError(missing)
+
+    class Meta:
+        fields = ('name', 'ticket_price', 'location', 'description', 'contact_phone', 'contact_email', 'opening_hours', 'weekday_hours', 'available_slots')
+        unknown = EXCLUDE
+
+attractions_import_schema = AttractionImportSchema(many=True)
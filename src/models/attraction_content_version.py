@@ -0,0 +1,18 @@
+from init import db
+
+class AttractionContentVersion(db.Model):
+    """
+    The version of what is shown for an attraction apart from its available slots: its own details, its reviews
+    and their reviewers' names. Keys the attraction's cached JSON (see utils/attraction_cache_utils.py).
+
+    Kept out of the attractions table so that review writes don't lock the attraction's row, which every
+    booking updates. An attraction without a row is at version 0.
+
+    Attributes:
+        attraction_id: Foreign key to the attraction.
+        version: Incremented whenever the cached JSON of the attraction goes out of date.
+    """
+    __tablename__ = "attraction_content_versions"
+
+    attraction_id = db.Column(db.Integer, db.ForeignKey('attractions.id', ondelete='CASCADE'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
@@ -0,0 +1,31 @@
+from init import db
+
+class AuditEvent(db.Model):
+    """
+    A record of a booking or account change, kept for compliance.
+
+    Events are written in batches by the audit writer thread (see utils/audit_utils.py). They have no foreign
+    keys, so the trail is kept after the users and bookings it refers to are deleted.
+
+    Attributes:
+        id: Primary key, unique ID of the event.
+        occurred_at: Timestamp when the change was made (not when the event was written).
+        action: What happened, such as 'booking.created' or 'user.locked'.
+        actor_id: ID of the user who made the change, or None for changes made by the system.
+        subject_type: The kind of record changed ('booking' or 'user').
+        subject_id: ID of the record changed.
+        details: JSON object with the values involved in the change.
+    """
+    __tablename__ = "audit_events"
+
+    id = db.Column(db.BigInteger, primary_key=True)
+    occurred_at = db.Column(db.DateTime, nullable=False, index=True)
+    action = db.Column(db.String, nullable=False)
+    actor_id = db.Column(db.Integer)
+    subject_type = db.Column(db.String, nullable=False)
+    subject_id = db.Column(db.Integer, nullable=False)
+    details = db.Column(db.JSON(none_as_null=True))
+
+    __table_args__ = (
+        db.Index('ix_audit_events_subject', 'subject_type', 'subject_id'),
+    )
@@ -24,20 +24,33 @@ class Booking(db.Model):
         total_cost: The total cost of the booking (float)
         status: The current status of the booking (Requested, Confirmed, Cancelled).
         created_at: Timestamp when the booking was created.
+        version_id: Incremented on every change, used to detect conflicting updates (exposed as the ETag).
     """
     __tablename__ = "bookings"
     
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    attraction_id = db.Column(db.Integer, db.ForeignKey('attractions.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    attraction_id = db.Column(db.Integer, db.ForeignKey('attractions.id', ondelete='CASCADE'), nullable=False, index=True)
     booking_date = db.Column(db.DateTime, nullable=False)
     number_of_guests = db.Column(db.Integer, nullable=False)
     total_cost = db.Column(db.Float)
     status = db.Column(db.String, nullable=False, default=booking_status.REQUESTED)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    version_id = db.Column(db.Integer, nullable=False, server_default='1')
 
     user = db.relationship('User', back_populates='bookings')
     attraction = db.relationship('Attraction', back_populates='bookings')
+
+    # Finds a user's past confirmed bookings of an attraction (review eligibility) from the index alone
+    __table_args__ = (
+        db.Index(
+            'ix_bookings_confirmed_user_attraction', 'user_id', 'attraction_id', 'booking_date',
+            postgresql_where=db.text("status = 'Confirmed'")
+        ),
+    )
+
+    # Updates and deletes fail with a StaleDataError if the row was changed since it was loaded
+    __mapper_args__ = {"version_id_col": version_id}
     
     # Calculates the total cost of booking based on the number of guests and the ticket price
     def calculate_total_cost(self):
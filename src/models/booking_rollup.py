@@ -0,0 +1,23 @@
+from init import db
+
+class BookingRollup(db.Model):
+    """
+    Daily totals of active (not cancelled) bookings per attraction, used for admin reporting.
+
+    Rows are kept up to date incrementally whenever a booking is created, updated or deleted, so reports
+    only read one row per attraction per day instead of scanning the bookings table.
+
+    Attributes:
+        day: The date the bookings are for (booking date, not creation date).
+        attraction_id: Foreign key to the attraction booked.
+        bookings: Number of active bookings for the attraction on this day.
+        guests: Total number of guests across those bookings.
+        revenue: Total cost of those bookings.
+    """
+    __tablename__ = "booking_daily_rollups"
+
+    day = db.Column(db.Date, primary_key=True)
+    attraction_id = db.Column(db.Integer, db.ForeignKey('attractions.id', ondelete='CASCADE'), primary_key=True)
+    bookings = db.Column(db.Integer, nullable=False, default=0)
+    guests = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
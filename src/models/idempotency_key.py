@@ -0,0 +1,37 @@
+from datetime import datetime
+
+from sqlalchemy import UniqueConstraint
+
+from init import db
+
+class IdempotencyKey(db.Model):
+    """
+    Stores the first response sent for a request made with an Idempotency-Key header,
+    so retries of the same request can be answered without running it again.
+
+    Attributes:
+        id: Primary key.
+        user_id: Foreign key to the user who sent the request. Keys are unique per user.
+        key: The Idempotency-Key header value chosen by the client.
+        request_hash: SHA-256 of the request method, path and body, used to reject a key reused for a different request.
+        status_code: HTTP status code of the stored response, or None while the request is still running.
+        content_type: Content type of the stored response.
+        response_body: Body of the stored response.
+        created_at: Timestamp when the key was claimed.
+        expires_at: Timestamp after which the key can no longer be replayed.
+    """
+    __tablename__ = "idempotency_keys"
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    key = db.Column(db.String(255), nullable=False)
+    request_hash = db.Column(db.String(64), nullable=False)
+    status_code = db.Column(db.Integer)
+    content_type = db.Column(db.String)
+    response_body = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'key', name='uix_idempotency_key'),
+    )
@@ -0,0 +1,74 @@
+import re
+
+from init import db
+
+# Day names accepted in Attraction.weekday_hours, in weekday order (0 is Monday, as in datetime.weekday())
+WEEKDAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+MINUTES_PER_DAY = 24 * 60
+
+# Opening hours in 'HH:MM - HH:MM' 24hr format
+HOURS_PATTERN = r'^((2[0-3]|[01]?[0-9]):([0-5]?[0-9]))\s*-\s*((2[0-3]|[01]?[0-9]):([0-5]?[0-9]))$'
+
+# Used in weekday_hours for a day the attraction doesn't open
+CLOSED = 'closed'
+
+class OpeningHours(db.Model):
+    """
+    The opening hours of an attraction on one day of the week, in minutes since midnight.
+
+    Rows are derived from the attraction's opening_hours and weekday_hours whenever either changes
+    (see models/attraction.py), so "open at" queries can use an index rather than parsing strings.
+    A day the attraction is closed has no row.
+
+    Attributes:
+        attraction_id: Foreign key to the attraction.
+        weekday: Day of the week, 0 (Monday) to 6 (Sunday).
+        opens_at: Opening time in minutes since midnight.
+        closes_at: Closing time in minutes since midnight. Hours that run past midnight close on the
+            next day, stored as more than 1440 (such as 1560 for 2am).
+    """
+    __tablename__ = "attraction_opening_hours"
+
+    attraction_id = db.Column(db.Integer, db.ForeignKey('attractions.id', ondelete='CASCADE'), primary_key=True)
+    weekday = db.Column(db.SmallInteger, primary_key=True)
+    opens_at = db.Column(db.SmallInteger, nullable=False)
+    closes_at = db.Column(db.SmallInteger, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_opening_hours_weekday_opens_at', 'weekday', 'opens_at', 'closes_at'),
+        # Only hours running past midnight, checked against the next day's times
+        db.Index(
+            'ix_opening_hours_weekday_overnight', 'weekday', 'closes_at',
+            postgresql_where=db.text(f'closes_at > {MINUTES_PER_DAY}')
+        ),
+    )
+
+def parse_hours(value):
+    """
+    Parses opening hours in 'HH:MM - HH:MM' format to (opens_at, closes_at) minutes since midnight,
+    or returns None for 'closed'. A closing time at or before the opening time is on the next day.
+    """
+    if value.strip().lower() == CLOSED:
+        return None
+    match = re.match(HOURS_PATTERN, value.strip())
+    if match is None:
+        raise ValueError(f"Invalid opening hours '{value}'")
+    opens_at = int(match.group(2)) * 60 + int(match.group(3))
+    closes_at = int(match.group(5)) * 60 + int(match.group(6))
+    if closes_at <= opens_at:
+        closes_at += MINUTES_PER_DAY
+    return opens_at, closes_at
+
+def weekly_hours(opening_hours, weekday_hours=None):
+    """
+    Returns the (weekday, opens_at, closes_at) of each day the attraction opens. `opening_hours` applies
+    to every day not given in `weekday_hours` ({day name: hours or 'closed'}).
+    """
+    weekday_hours = weekday_hours or {}
+    days = []
+    for weekday, name in enumerate(WEEKDAYS):
+        hours = parse_hours(weekday_hours.get(name, opening_hours))
+        if hours is not None:
+            days.append((weekday, *hours))
+    return days
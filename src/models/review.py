@@ -2,6 +2,7 @@ from datetime import datetime
 
 from marshmallow import Schema, fields, validates, ValidationError
 from marshmallow.validate import Length
+from sqlalchemy import UniqueConstraint
 
 from init import db
 
@@ -20,14 +21,19 @@ class Review(db.Model):
     __tablename__ = "reviews"
     
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    attraction_id = db.Column(db.Integer, db.ForeignKey('attractions.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    attraction_id = db.Column(db.Integer, db.ForeignKey('attractions.id', ondelete='CASCADE'), nullable=False, index=True)
     rating = db.Column(db.Integer, nullable=False)
     comment = db.Column(db.String, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     user = db.relationship('User', back_populates='reviews')  
     attraction = db.relationship('Attraction', back_populates='reviews')
+
+    # A user can leave one review per attraction, enforced by the database so concurrent requests can't both add one
+    __table_args__ = (
+        UniqueConstraint('user_id', 'attraction_id', name='uix_user_attraction_review'),
+    )
     
 class ReviewSchema(Schema):
     """
@@ -0,0 +1,20 @@
+from datetime import datetime
+
+from init import db
+
+class RevokedToken(db.Model):
+    """
+    A revoked JWT, or all of a user's JWTs issued up to a point in time.
+
+    Attributes:
+        key: 'jti:<token id>' for a single token, or 'user:<user id>' for every token issued to a user
+            at or before revoked_at.
+        revoked_at: Timestamp when the token(s) were revoked.
+        expires_at: Timestamp after which every token covered by this entry has expired anyway,
+            so the entry can be removed.
+    """
+    __tablename__ = "revoked_tokens"
+
+    key = db.Column(db.String, primary_key=True)
+    revoked_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
@@ -30,8 +30,9 @@ class User(db.Model):
     booking_attempts = db.Column(db.Integer, default=0)
     is_locked = db.Column(db.Boolean, default=False)
     
-    bookings = db.relationship('Booking', back_populates='user', cascade='all, delete')
-    reviews = db.relationship('Review', back_populates='user', cascade='all, delete')
+    # Bookings and reviews are removed by ON DELETE CASCADE in the database, without being loaded first
+    bookings = db.relationship('Booking', back_populates='user', cascade='all, delete', passive_deletes=True)
+    reviews = db.relationship('Review', back_populates='user', cascade='all, delete', passive_deletes=True)
     
     # Allows me to apply separate error messages on different fields in the same table
     __table_args__ = (
@@ -0,0 +1,101 @@
+"""
+Production server for the API, using gunicorn's pre-forking server.
+
+Run from the src folder, with the same .env as the API:
+
+    python serve.py
+
+The app is created once in the master process (preloaded) and forked into WEB_WORKERS worker processes,
+each serving requests on WEB_THREADS threads. By default the worker count is based on the number of CPU
+cores, limited so that every worker's full connection pool fits within DB_MAX_CONNECTIONS, and each worker
+gets one thread per pooled connection plus one for each of its STREAM_MAX_CLIENTS availability streams.
+
+Workers are replaced after about WEB_MAX_REQUESTS requests, to limit the effect of slow memory growth.
+Sending SIGHUP to the master replaces the workers gracefully, letting them finish their current requests.
+"""
+import multiprocessing
+import os
+
+from dotenv import load_dotenv
+from gunicorn.app.base import BaseApplication
+
+from init import db
+
+def server_options():
+    """
+    Builds the gunicorn settings from environment variables.
+    """
+    pool_size = int(os.environ.get("DB_POOL_SIZE") or 5)
+    max_overflow = int(os.environ.get("DB_MAX_OVERFLOW") or 10)
+    max_db_connections = int(os.environ.get("DB_MAX_CONNECTIONS") or 100)
+
+    stream_clients = int(os.environ.get("STREAM_MAX_CLIENTS") or 20)
+
+    # One thread per pooled connection, so threads don't queue for connections under normal load, plus one per
+    # availability stream, as each open stream occupies a thread (but no connection) for as long as it lasts
+    threads = int(os.environ.get("WEB_THREADS") or pool_size + stream_clients)
+    # The usual 2 x cores + 1, as long as every worker's pool and overflow fit in the database's connections
+    workers = int(os.environ.get("WEB_WORKERS") or max(
+        min(multiprocessing.cpu_count() * 2 + 1, max_db_connections // (pool_size + max_overflow)), 1
+    ))
+    max_requests = int(os.environ.get("WEB_MAX_REQUESTS") or 1000)
+
+    return {
+        "bind": os.environ.get("WEB_BIND", "0.0.0.0:8080"),
+        "workers": workers,
+        "worker_class": "gthread",
+        "threads": threads,
+        "preload_app": True,
+        "max_requests": max_requests,
+        # Spreads the restarts out, so the workers aren't all recycled at the same time
+        "max_requests_jitter": max_requests // 10,
+        "timeout": int(os.environ.get("WEB_TIMEOUT") or 30),
+        "graceful_timeout": int(os.environ.get("WEB_GRACEFUL_TIMEOUT") or 30),
+        "keepalive": 5,
+        "accesslog": "-",
+        "post_fork": post_fork,
+    }
+
+def post_fork(server, worker):
+    """
+    Runs in each worker process straight after it is forked from the master.
+
+    Any connections opened by the master were copied into the worker. They are dropped from the worker's pool
+    without being closed, as closing them would also close the master's connections, so the worker opens
+    connections of its own. With WARMUP_ON_START, the worker then opens its pool connections and runs the hot
+    statements before taking requests (the master only configured the mappers and schemas). The background
+    threads are then started.
+    """
+    from utils.background_utils import start_background_workers
+    from utils.warmup_utils import warm_up_database
+
+    app = server.app.application
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    if app.config["WARMUP_ON_START"]:
+        warm_up_database(app)
+    start_background_workers(app)
+
+class APIServer(BaseApplication):
+    def __init__(self, application, options):
+        self.application = application
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
+if __name__ == "__main__":
+    load_dotenv()
+    # Background threads are started in the workers by post_fork, not in the master
+    os.environ["DEFER_BACKGROUND_WORKERS"] = "1"
+    # The shared slot counters are on by default when serving, but not for flask db commands
+    os.environ.setdefault("SLOT_COUNTERS", "true")
+
+    from main import create_app
+    APIServer(create_app(), server_options()).run()
@@ -0,0 +1,212 @@
+import logging
+from threading import Condition, Lock
+from time import monotonic
+
+from flask import g, request
+
+logger = logging.getLogger(__name__)
+
+# Concurrency pool of each blueprint's endpoints, unless an endpoint picks another with @admission_pool
+BLUEPRINT_POOLS = {
+    'booking_bp': 'bookings',
+}
+
+DEFAULT_POOL = 'default'
+
+# Adaptive limits: share of the limit kept when latency is over target, and the smallest limit allowed
+DECREASE_FACTOR = 0.75
+MIN_LIMIT = 1
+
+def admission_pool(name):
+    """
+    Decorator that puts an endpoint in the named concurrency pool instead of its blueprint's.
+
+    Must be placed directly under the route decorator, as it marks the function that is registered.
+    """
+    def mark(fn):
+        fn.admission_pool = name
+        return fn
+    return mark
+
+def parse_limits(value):
+    """
+    Parses pool limits given as 'pool=limit,pool=limit' into a dict.
+    """
+    limits = {}
+    for item in value.split(','):
+        if item.strip():
+            name, limit = item.split('=')
+            limits[name.strip()] = int(limit)
+    return limits
+
+class ConcurrencyLimiter:
+    """
+    Limits how many requests of one pool run at the same time.
+
+    Requests over the limit wait in a queue of up to `queue_size` requests, for at most `queue_timeout`
+    seconds. A waiting request holds a server thread, so it only queues if the shared `budget` of threads
+    has one to spare. A request that finds the queue full, no thread to spare or whose wait runs out is
+    rejected straight away so the client can retry later, rather than tying up a thread and adding to
+    everyone's latency.
+
+    With a `target_latency`, the limit adapts (AIMD): each request finishing within the target raises it
+    by 1/limit (about one per limit's worth of requests), up to `max_limit`, and a request finishing over
+    the target cuts it to DECREASE_FACTOR of its value, at most once per target latency.
+    """
+    def __init__(self, max_limit, queue_size, queue_timeout, budget, target_latency=None):
+        self.max_limit = max_limit
+        self.budget = budget
+        self.limit = float(max_limit)
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.target_latency = target_latency
+        self.last_decrease = 0.0
+        self.in_flight = 0
+        self.waiting = 0
+        self.counts = {'admitted': 0, 'queued': 0, 'rejected': 0, 'timed_out': 0}
+        self.condition = Condition()
+
+    def has_capacity(self):
+        return self.in_flight < int(self.limit)
+
+    def acquire(self):
+        """
+        Takes a slot in the pool, waiting in the queue if needed. Returns False if the request is rejected.
+        """
+        with self.condition:
+            if self.has_capacity() and not self.waiting:
+                self.in_flight += 1
+                self.counts['admitted'] += 1
+                self.budget.take()
+                return True
+            if self.waiting >= self.queue_size or not self.budget.take(spare_only=True):
+                self.counts['rejected'] += 1
+                return False
+
+            self.waiting += 1
+            self.counts['queued'] += 1
+            try:
+                admitted = self.condition.wait_for(self.has_capacity, self.queue_timeout)
+            finally:
+                self.waiting -= 1
+            if not admitted:
+                self.budget.give_back()
+                self.counts['timed_out'] += 1
+                return False
+            self.in_flight += 1
+            self.counts['admitted'] += 1
+            return True
+
+    def release(self, latency):
+        """
+        Gives back a slot taken by a request that took `latency` seconds.
+        """
+        with self.condition:
+            self.in_flight -= 1
+            self.budget.give_back()
+            if self.target_latency is not None:
+                now = monotonic()
+                if latency > self.target_latency:
+                    if now - self.last_decrease >= self.target_latency:
+                        self.limit = max(MIN_LIMIT, self.limit * DECREASE_FACTOR)
+                        self.last_decrease = now
+                else:
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            if self.has_capacity():
+                self.condition.notify()
+
+    def stats(self):
+        with self.condition:
+            return dict(self.counts, limit=int(self.limit), in_flight=self.in_flight, waiting=self.waiting)
+
+class ThreadBudget:
+    """
+    Counts the server threads taken by admitted and queued requests across every pool.
+
+    Admitted requests are always counted, but a request may only queue while fewer than `max_threads`
+    are taken, so queued requests can't hold the threads other pools need to run.
+    """
+    def __init__(self, max_threads):
+        self.max_threads = max_threads
+        self.taken = 0
+        self.lock = Lock()
+
+    def take(self, spare_only=False):
+        with self.lock:
+            if spare_only and self.taken >= self.max_threads:
+                return False
+            self.taken += 1
+            return True
+
+    def give_back(self):
+        with self.lock:
+            self.taken -= 1
+
+def endpoint_pool(app, endpoint):
+    view = app.view_functions.get(endpoint)
+    if view is not None and hasattr(view, 'admission_pool'):
+        return view.admission_pool
+    return BLUEPRINT_POOLS.get(endpoint.rsplit('.', 1)[0] if '.' in endpoint else None, DEFAULT_POOL)
+
+def init_admission(app):
+    """
+    Registers admission control for the app.
+
+    Every endpoint belongs to a pool (bookings, admin, streams or default), each with its own concurrency
+    limit from ADMISSION_LIMITS (pools left out of it aren't limited) and queue size from ADMISSION_QUEUE_SIZES
+    (no queue if left out), so a burst on one pool (such as admin exports) can't take the threads and
+    database connections the others need. Queued requests across all pools are also kept within
+    ADMISSION_MAX_THREADS. Requests a pool can't take in time get a 503 with a Retry-After header.
+    Setting ADMISSION_TARGET_LATENCY_MS makes the limits adapt to the latency seen.
+    """
+    if not app.config["ADMISSION_CONTROL"]:
+        return
+
+    target_latency = app.config["ADMISSION_TARGET_LATENCY_MS"]
+    queue_sizes = parse_limits(app.config["ADMISSION_QUEUE_SIZES"])
+    budget = ThreadBudget(app.config["ADMISSION_MAX_THREADS"])
+    limiters = {
+        name: ConcurrencyLimiter(
+            limit,
+            queue_sizes.get(name, 0),
+            app.config["ADMISSION_QUEUE_TIMEOUT_MS"] / 1000,
+            budget,
+            target_latency / 1000 if target_latency else None,
+        )
+        for name, limit in parse_limits(app.config["ADMISSION_LIMITS"]).items()
+    }
+    app.extensions['admission_limiters'] = limiters
+    retry_after = str(app.config["ADMISSION_RETRY_AFTER_SECONDS"])
+
+    @app.before_request
+    def admit_request():
+        if request.endpoint is None:
+            return None
+        limiter = limiters.get(endpoint_pool(app, request.endpoint))
+        if limiter is None:
+            return None
+        if not limiter.acquire():
+            return {"error": "The server is busy, try again shortly"}, 503, {'Retry-After': retry_after}
+        g.admission = (limiter, monotonic())
+        return None
+
+    # Teardown runs once the view has returned, or for streamed responses that keep the request context
+    # (such as the bookings export), once the stream has finished
+    @app.teardown_request
+    def release_request(exc):
+        release_admission(g.pop('admission', None))
+
+def release_admission(admission):
+    if admission is not None:
+        limiter, started = admission
+        limiter.release(monotonic() - started)
+
+def hold_admission_until_closed(response):
+    """
+    Keeps the request's pool slot until a streamed response that doesn't keep the request context (such
+    as an availability stream) is closed, rather than releasing it when the view returns.
+    """
+    admission = g.pop('admission', None)
+    if admission is not None:
+        response.call_on_close(lambda: release_admission(admission))
+    return response
@@ -0,0 +1,178 @@
+from collections import OrderedDict
+from threading import Lock
+
+from flask import current_app, Response
+from sqlalchemy import bindparam, literal
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import selectinload
+
+from init import db
+from models.attraction import Attraction, attraction_schema
+from models.attraction_content_version import AttractionContentVersion
+from models.review import Review
+
+content_version = db.func.coalesce(AttractionContentVersion.version, 0)
+
+def select_listed():
+    """
+    Selects the ID, content version and available slots of attractions, which is all an attraction list
+    reads per request. Slots change with every booking, so they are put into the cached JSON rather than
+    being part of it.
+    """
+    return db.select(Attraction.id, content_version, Attraction.available_slots).outerjoin(AttractionContentVersion)
+
+# Every attraction, in the order the list endpoint returns them
+attraction_versions_stmt = select_listed().order_by(Attraction.name)
+# One attraction, with the version its ETag is made from
+attraction_version_stmt = (
+    db.select(Attraction.version_id, content_version, Attraction.available_slots)
+    .outerjoin(AttractionContentVersion)
+    .where(Attraction.id == bindparam('attraction_id'))
+)
+
+class FragmentCache:
+    """
+    A bounded LRU of attractions already encoded as JSON, keyed by attraction ID and content version.
+
+    Serialising an attraction loads its reviews (and their users) and runs the schema. Attractions change
+    rarely compared with how often they are read, so each is encoded once and the bytes are reused until
+    its content version changes. The content version is bumped by changes to the attraction's details and
+    reviews and to its reviewers' names (see bump_content_versions), so a stale fragment is never served,
+    even when the change was made by another process. Available slots are left out of the key, and filled
+    in from the row read for each request.
+    """
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def get(self, attraction_id, version):
+        with self.lock:
+            entry = self.entries.get(attraction_id)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(attraction_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, attraction_id, version, fragment):
+        with self.lock:
+            self.entries[attraction_id] = (version, fragment)
+            self.entries.move_to_end(attraction_id)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def evict(self, *attraction_ids):
+        with self.lock:
+            for attraction_id in attraction_ids:
+                self.entries.pop(attraction_id, None)
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+def init_attraction_cache(app):
+    app.extensions['attraction_cache'] = FragmentCache(app.config["ATTRACTION_CACHE_SIZE"])
+
+# Stands in for the available slots while encoding, so the JSON can be split where they go
+SLOTS_PLACEHOLDER = '\0available_slots\0'
+
+def encode(attraction):
+    """
+    Encodes an attraction the same way as returning its dumped dictionary from a view (the app's JSON settings,
+    compact separators). Returned as the bytes before and after the available slots' value.
+    """
+    data = attraction_schema.dump(attraction)
+    data['available_slots'] = SLOTS_PLACEHOLDER
+    body = current_app.json.dumps(data, separators=(',', ':')).encode()
+    # Quotes inside strings are escaped, so only the key itself can match
+    key = b'"available_slots":'
+    before, after = body.split(key + current_app.json.dumps(SLOTS_PLACEHOLDER).encode(), 1)
+    return before + key, after
+
+def attraction_fragments(rows):
+    """
+    Returns the encoded JSON of the attractions with the given (ID, content version, available slots) rows,
+    in the same order.
+
+    Fragments are taken from the cache where it has the same content version. The rest are loaded together,
+    with their reviews and reviewers, then encoded and cached.
+    """
+    cache = current_app.extensions['attraction_cache']
+    fragments = {attraction_id: cache.get(attraction_id, version) for attraction_id, version, _ in rows}
+
+    missing = [attraction_id for attraction_id, fragment in fragments.items() if fragment is None]
+    if missing:
+        attractions = db.session.scalars(
+            db.select(Attraction)
+            .where(Attraction.id.in_(missing))
+            .options(selectinload(Attraction.reviews).joinedload(Review.user))
+        )
+        versions = {attraction_id: version for attraction_id, version, _ in rows}
+        for attraction in attractions:
+            fragment = encode(attraction)
+            # Cached with the version listed. If it changed in between, what was loaded is newer, and the
+            # next request misses on the new version.
+            cache.put(attraction.id, versions[attraction.id], fragment)
+            fragments[attraction.id] = fragment
+
+    # An attraction deleted since it was listed is left out
+    return [
+        fragments[attraction_id][0] + str(slots).encode() + fragments[attraction_id][1]
+        for attraction_id, _, slots in rows
+        if fragments[attraction_id] is not None
+    ]
+
+def json_response(body, status=200, headers=None):
+    return Response(body + b'\n', status=status, headers=headers, mimetype='application/json')
+
+def attraction_list_response(stmt=attraction_versions_stmt, params=None):
+    """
+    Builds the response of an attraction list by joining the cached fragments of the attractions.
+    `stmt` selects the attractions to list with select_listed, every attraction by default.
+    """
+    fragments = attraction_fragments(db.session.execute(stmt, params).all())
+    return json_response(b'[' + b','.join(fragments) + b']')
+
+def attraction_response(attraction_id):
+    """
+    Builds the response for one attraction from its cached fragment, with its version as the ETag.
+    Returns None if there is no attraction with the ID.
+    """
+    row = db.session.execute(attraction_version_stmt, {'attraction_id': attraction_id}).first()
+    if row is None:
+        return None
+    version, content, slots = row
+    fragments = attraction_fragments([(attraction_id, content, slots)])
+    if not fragments:
+        return None
+    return json_response(fragments[0], headers={"ETag": f'"{version}"'})
+
+def bump_content_versions(*conditions):
+    """
+    Increments the content version of the attractions matching the conditions, for changes to what is shown
+    with an attraction other than its available slots. Runs in the caller's transaction, and drops this
+    process' cached fragments of those attractions.
+
+    Only the attraction_content_versions rows are written, so the attractions' own rows aren't locked.
+    """
+    attraction_ids = db.session.scalars(
+        insert(AttractionContentVersion.__table__)
+        .from_select(['attraction_id', 'version'], db.select(Attraction.__table__.c.id, literal(1)).where(*conditions))
+        .on_conflict_do_update(
+            index_elements=['attraction_id'],
+            set_={'version': AttractionContentVersion.__table__.c.version + 1},
+        )
+        .returning(AttractionContentVersion.__table__.c.attraction_id)
+    ).all()
+    current_app.extensions['attraction_cache'].evict(*attraction_ids)
+    return attraction_ids
+
+def reviewed_by(user_id):
+    """
+    Condition for bump_content_versions matching the attractions a user has reviewed.
+    """
+    return Attraction.__table__.c.id.in_(db.select(Review.attraction_id).where(Review.user_id == user_id))
@@ -0,0 +1,166 @@
+import atexit
+import logging
+from datetime import datetime
+from queue import Queue, Full, Empty
+from threading import Event, Lock, Thread
+from time import monotonic, sleep
+
+from flask import current_app, has_request_context
+from flask_jwt_extended import get_jwt_identity
+
+from init import db
+from models.audit_event import AuditEvent
+from utils.background_utils import register_background_worker
+
+logger = logging.getLogger(__name__)
+
+# Attempts made to write a batch before its events are given up as dropped
+WRITE_ATTEMPTS = 3
+
+class AuditLog:
+    """
+    Collects audit events in a bounded in-memory queue and writes them from a background thread.
+
+    Recording an event only puts it on the queue, so auditing adds next to nothing to a request and
+    never runs in its transaction. The writer thread inserts events in batches, as soon as AUDIT_BATCH_SIZE
+    events are waiting or AUDIT_FLUSH_INTERVAL_MS after the first one arrived, whichever comes first.
+
+    When the writer can't keep up and the queue (AUDIT_QUEUE_SIZE events) is full, AUDIT_QUEUE_FULL_POLICY
+    decides what happens. With 'block' the request waits up to AUDIT_ENQUEUE_TIMEOUT_MS for space. With
+    'drop', or if the wait times out, the event is dropped. Dropped events are counted and logged.
+    Queued events are written before the process exits.
+    """
+    def __init__(self, config):
+        self.queue = Queue(maxsize=config["AUDIT_QUEUE_SIZE"])
+        self.batch_size = config["AUDIT_BATCH_SIZE"]
+        self.flush_interval = config["AUDIT_FLUSH_INTERVAL_MS"] / 1000
+        self.block = config["AUDIT_QUEUE_FULL_POLICY"] == 'block'
+        self.enqueue_timeout = config["AUDIT_ENQUEUE_TIMEOUT_MS"] / 1000
+        self.stop_event = Event()
+        self.thread = None
+        self.counts = {'recorded': 0, 'written': 0, 'dropped': 0, 'batches': 0, 'failed_batches': 0}
+        self.lock = Lock()
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counts[name] += amount
+            return self.counts[name]
+
+    def record(self, event):
+        """
+        Queues an event for writing. Returns False if it was dropped because the queue was full.
+        """
+        try:
+            if self.block:
+                self.queue.put(event, timeout=self.enqueue_timeout)
+            else:
+                self.queue.put_nowait(event)
+        except Full:
+            dropped = self.count('dropped')
+            # Logs the first drop and then every 1000th, so an overload doesn't also flood the logs
+            if dropped == 1 or dropped % 1000 == 0:
+                logger.warning("Audit queue full, %s events dropped so far", dropped)
+            return False
+        self.count('recorded')
+        return True
+
+    def next_batch(self):
+        """
+        Waits up to the flush interval for events and returns up to a batch of them (empty if none came).
+        """
+        deadline = monotonic() + self.flush_interval
+        batch = []
+        while len(batch) < self.batch_size:
+            remaining = deadline - monotonic()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except Empty:
+                break
+        return batch
+
+    def write(self, app, batch):
+        """
+        Inserts a batch of events in one multi-row insert, retrying a failed write a couple of times.
+        """
+        for attempt in range(1, WRITE_ATTEMPTS + 1):
+            try:
+                with app.app_context():
+                    db.session.execute(db.insert(AuditEvent), batch)
+                    db.session.commit()
+                self.count('written', len(batch))
+                self.count('batches')
+                return
+            except Exception:
+                if attempt == WRITE_ATTEMPTS:
+                    self.count('failed_batches')
+                    self.count('dropped', len(batch))
+                    logger.exception("Could not write %s audit events, they have been dropped", len(batch))
+                else:
+                    sleep(attempt * 0.5)
+
+    def run(self, app):
+        # Keeps going after a stop is requested until everything queued has been written
+        while True:
+            batch = self.next_batch()
+            if batch:
+                self.write(app, batch)
+            elif self.stop_event.is_set():
+                return
+
+    def start(self, app):
+        self.stop_event.clear()
+        self.thread = Thread(target=self.run, args=(app,), name='audit-writer', daemon=True)
+        self.thread.start()
+        atexit.register(self.stop)
+
+    def stop(self, timeout=10):
+        """
+        Stops the writer thread once it has written every queued event, waiting up to `timeout` seconds.
+        """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, queued=self.queue.qsize())
+
+def init_audit(app):
+    """
+    Creates the app's audit log and registers its writer thread as a background worker.
+    """
+    app.extensions['audit_log'] = AuditLog(app.config)
+    register_background_worker(app, lambda app: app.extensions['audit_log'].start(app))
+
+def current_actor_id():
+    """
+    Returns the ID of the user making the current request, or None outside of an authenticated request.
+    """
+    if not has_request_context():
+        return None
+    try:
+        return int(get_jwt_identity())
+    except (RuntimeError, TypeError, ValueError):
+        return None
+
+def audit(action, subject_type, subject_id, details=None, actor_id=None):
+    """
+    Records an audit event for a change that has been committed. The event is written in the background.
+
+    `details` must be JSON serialisable. `actor_id` defaults to the user making the current request.
+    """
+    current_app.extensions['audit_log'].record({
+        'occurred_at': datetime.utcnow(),
+        'action': action,
+        'actor_id': actor_id if actor_id is not None else current_actor_id(),
+        'subject_type': subject_type,
+        'subject_id': subject_id,
+        'details': details,
+    })
+
+def audit_status_changes(changes, new_status, reason):
+    """
+    Records a 'booking.status_changed' event for each (booking ID, previous status) pair of a bulk status change.
+    """
+    for booking_id, previous_status in changes:
+        audit('booking.status_changed', 'booking', booking_id, {'from': previous_status, 'to': new_status, 'reason': reason})
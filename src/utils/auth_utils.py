@@ -1,10 +1,20 @@
 import functools
 from flask import g, abort
 from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import bindparam
 
 from models.user import User
 from init import db, bcrypt
 
+# Built once and reused by every admin request, so SQLAlchemy doesn't rebuild the statement and its cache key each time
+user_is_admin_stmt = db.select(User.is_admin).where(User.id == bindparam('user_id'))
+
+def is_admin(user_id):
+    """
+    Returns whether the user with the ID is an admin.
+    """
+    return bool(db.session.scalar(user_is_admin_stmt, {'user_id': user_id}))
+
 def authorise_as_admin(fn):
     """
     Decorator that enforces admin-only access to endpoints.
@@ -16,10 +26,7 @@ def authorise_as_admin(fn):
     """
     @functools.wraps(fn)
     def wrapper(*args, **kwargs):
-        user_id = get_jwt_identity()
-        stmt = db.select(User).filter_by(id=user_id)
-        user = db.session.scalar(stmt)
-        if user.is_admin:
+        if is_admin(get_jwt_identity()):
             return fn(*args, **kwargs)
         else:
             return {"error": "Not authorised. Admin access required."}, 403
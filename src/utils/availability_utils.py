@@ -0,0 +1,197 @@
+import json
+import logging
+import select
+from threading import Event, Lock, Thread
+
+from sqlalchemy import DDL, event
+
+from init import db
+from models.attraction import Attraction
+from utils.background_utils import register_background_worker
+from utils.slot_counter_utils import refresh_slot_counters
+from utils.revocation_utils import REVOCATIONS_CHANNEL, revocation_list
+
+logger = logging.getLogger(__name__)
+
+# Postgres channel that carries {"id": ..., "available_slots": ..., "version_id": ...} whenever an attraction's slots change
+SLOTS_CHANNEL = 'attraction_slots'
+
+# A trigger sends the notification, so every change is covered (bookings, bulk updates, the sweeper, admin
+# edits) whichever process or statement makes it. Notifications are only delivered when the change commits.
+SLOTS_TRIGGER_STATEMENTS = [
+    f"""
+    CREATE OR REPLACE FUNCTION notify_attraction_slots() RETURNS trigger AS $$
+    BEGIN
+        IF NEW.available_slots IS DISTINCT FROM OLD.available_slots THEN
+            PERFORM pg_notify('{SLOTS_CHANNEL}', json_build_object('id', NEW.id, 'available_slots', NEW.available_slots, 'version_id', NEW.version_id)::text);
+        END IF;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS attraction_slots_notify ON attractions",
+    """
+    CREATE TRIGGER attraction_slots_notify AFTER UPDATE OF available_slots ON attractions
+    FOR EACH ROW EXECUTE FUNCTION notify_attraction_slots()
+    """,
+]
+
+# Adds the trigger when the table is created by `flask db create` (existing databases get it from `flask db upgrade`)
+for statement in SLOTS_TRIGGER_STATEMENTS:
+    event.listen(Attraction.__table__, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+
+class Subscriber:
+    """
+    One connected client's interest in a set of attractions.
+
+    Changes are kept as the latest slot count per attraction rather than queued, so a slow client
+    only ever has one pending value per attraction and never falls further behind.
+    """
+    def __init__(self, attraction_ids):
+        self.attraction_ids = attraction_ids
+        self.pending = {}
+        self.lock = Lock()
+        self.ready = Event()
+        self.subscribed = True
+
+    def push(self, attraction_id, available_slots):
+        with self.lock:
+            self.pending[attraction_id] = available_slots
+            self.ready.set()
+
+    def wait(self, timeout):
+        """
+        Waits up to `timeout` seconds for changes and returns them as {attraction ID: available slots}.
+        """
+        self.ready.wait(timeout)
+        with self.lock:
+            changes, self.pending = self.pending, {}
+            self.ready.clear()
+        return changes
+
+class AvailabilityBroker:
+    """
+    Fans slot changes out to the clients connected to this process.
+    """
+    def __init__(self):
+        self.subscribers = {}
+        self.count = 0
+        self.lock = Lock()
+
+    def subscribe(self, attraction_ids, max_clients):
+        """
+        Returns a new Subscriber, or None if this process already has `max_clients` connected clients.
+        """
+        subscriber = Subscriber(attraction_ids)
+        with self.lock:
+            if self.count >= max_clients:
+                return None
+            self.count += 1
+            for attraction_id in attraction_ids:
+                self.subscribers.setdefault(attraction_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            if not subscriber.subscribed:
+                return
+            subscriber.subscribed = False
+            self.count -= 1
+            for attraction_id in subscriber.attraction_ids:
+                subscribers = self.subscribers[attraction_id]
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self.subscribers[attraction_id]
+
+    def publish(self, attraction_id, available_slots):
+        with self.lock:
+            subscribers = list(self.subscribers.get(attraction_id, ()))
+        for subscriber in subscribers:
+            subscriber.push(attraction_id, available_slots)
+
+    def watched_ids(self):
+        with self.lock:
+            return list(self.subscribers)
+
+def current_slots(attraction_ids):
+    """
+    Loads the available slots of the given attractions as {attraction ID: available slots}.
+    """
+    return dict(db.session.execute(
+        db.select(Attraction.id, Attraction.available_slots).where(Attraction.id.in_(attraction_ids))
+    ).all())
+
+def listen_for_slot_changes(app, broker, stop_event, poll_seconds=5):
+    """
+    Listens for slot change notifications on a dedicated database connection and publishes them to the broker,
+    and to the host's shared slot counters if they are enabled. Token revocations are also listened for on
+    the same connection, and added to the process's revoked token filter.
+
+    The connection is taken out of the pool for good. If it is lost, the listener reconnects with an increasing
+    delay, and then publishes the current slots of every watched attraction (and refreshes the counters and
+    the revoked token filter) to cover anything missed meanwhile.
+    """
+    counters = app.extensions.get('slot_counters')
+    retry_delay = 1
+    while not stop_event.is_set():
+        connection = None
+        try:
+            with app.app_context():
+                connection = db.engine.raw_connection()
+                connection.detach()
+                listener = connection.driver_connection
+                listener.autocommit = True
+                listener.cursor().execute(f"LISTEN {SLOTS_CHANNEL}; LISTEN {REVOCATIONS_CHANNEL}")
+
+                watched = broker.watched_ids()
+                if watched:
+                    for attraction_id, available_slots in current_slots(watched).items():
+                        broker.publish(attraction_id, available_slots)
+                if counters is not None:
+                    refresh_slot_counters(counters)
+                with revocation_list.lock:
+                    revocation_list.rebuild()
+                db.session.remove()
+            retry_delay = 1
+
+            while not stop_event.is_set():
+                if select.select([listener], [], [], poll_seconds) == ([], [], []):
+                    continue
+                listener.poll()
+                while listener.notifies:
+                    notification = listener.notifies.pop(0)
+                    if notification.channel == REVOCATIONS_CHANNEL:
+                        revocation_list.add(notification.payload)
+                        continue
+                    change = json.loads(notification.payload)
+                    broker.publish(change['id'], change['available_slots'])
+                    # Notifications sent by the trigger before it included the version are left to the refresh
+                    if counters is not None and 'version_id' in change:
+                        counters.update([(change['id'], change['available_slots'], change['version_id'])])
+        except Exception:
+            logger.exception("Attraction slot listener failed, reconnecting in %s seconds", retry_delay)
+            stop_event.wait(retry_delay)
+            retry_delay = min(retry_delay * 2, 60)
+        finally:
+            if connection is not None:
+                connection.close()
+
+def start_availability_listener(app):
+    """
+    Starts the slot change listener thread. Needs Postgres, so does nothing with other databases.
+    """
+    with app.app_context():
+        if db.engine.dialect.name != 'postgresql':
+            return None
+
+    stop_event = Event()
+    broker = app.extensions['availability_broker']
+    Thread(target=listen_for_slot_changes, args=(app, broker, stop_event), name='slot-listener', daemon=True).start()
+    return stop_event
+
+def init_availability(app):
+    """
+    Creates the app's availability broker and registers the slot change listener as a background worker.
+    """
+    app.extensions['availability_broker'] = AvailabilityBroker()
+    register_background_worker(app, start_availability_listener)
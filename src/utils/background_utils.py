@@ -0,0 +1,13 @@
+def register_background_worker(app, start):
+    """
+    Registers a function that starts one of the app's background threads, called with the app.
+
+    Threads don't survive a fork, so the functions are kept in app.extensions. They are called by
+    start_background_workers, either when the app is created or, when the app is preloaded by a
+    pre-forking server (serve.py), in each worker process after it is forked.
+    """
+    app.extensions.setdefault('background_workers', []).append(start)
+
+def start_background_workers(app):
+    for start in app.extensions.get('background_workers', []):
+        start(app)
@@ -0,0 +1,105 @@
+import gzip
+import hashlib
+import zlib
+from collections import OrderedDict
+from threading import Lock
+
+from flask import request
+
+# Response types worth compressing. Images and other binary formats are already compressed.
+COMPRESSIBLE_MIMETYPES = {'application/json', 'application/x-ndjson', 'text/csv', 'text/plain', 'text/html'}
+
+class CompressedBodyCache:
+    """
+    A bounded LRU of compressed response bodies, keyed by encoding and a digest of the uncompressed body.
+
+    Large responses such as the attraction list are often identical between requests. Hashing the body is
+    much cheaper than compressing it, so repeated payloads are compressed once and then served from memory.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            body = self.entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = body
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.size, 'hits': self.hits, 'misses': self.misses}
+
+def compress(data, encoding, level):
+    """
+    Compresses a response body with gzip or deflate (zlib format, as HTTP defines it).
+    """
+    if encoding == 'gzip':
+        # mtime=0 keeps the output identical for identical bodies
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    return zlib.compress(data, level)
+
+def init_compression(app):
+    """
+    Registers response compression for the app.
+
+    Responses are compressed with gzip or deflate, depending on the client's Accept-Encoding. Skipped
+    are bodies under COMPRESSION_MIN_BYTES, streamed responses (which handle their own encoding), responses
+    that are already encoded, and content types that don't compress well.
+    Compressed bodies are kept in an LRU of up to COMPRESSION_CACHE_BYTES.
+    """
+    level = app.config["COMPRESSION_LEVEL"]
+    min_bytes = app.config["COMPRESSION_MIN_BYTES"]
+    cache = CompressedBodyCache(app.config["COMPRESSION_CACHE_BYTES"])
+    app.extensions['compression_cache'] = cache
+
+    @app.after_request
+    def compress_response(response):
+        if (
+            response.direct_passthrough
+            or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.status_code < 200
+            or response.status_code in (204, 304)
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+        ):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(['gzip', 'deflate'])
+        if encoding is None:
+            return response
+
+        data = response.get_data()
+        if len(data) < min_bytes:
+            return response
+
+        key = (encoding, hashlib.blake2b(data, digest_size=16).digest())
+        body = cache.get(key)
+        if body is None:
+            body = compress(data, encoding, level)
+            cache.put(key, body)
+
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        return response
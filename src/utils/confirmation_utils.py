@@ -0,0 +1,133 @@
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from init import db
+from models.user import User
+from models.booking import Booking, booking_status
+from utils.audit_utils import audit_status_changes
+
+def account_unlocked(booking, context):
+    """Holds back bookings made by accounts that have been locked for security reasons."""
+    return booking.user_id not in context['locked_users']
+
+def booking_cost(booking, context):
+    """Holds back single bookings at or above the auto confirm cost limit."""
+    return (booking.total_cost or 0) < context['max_booking_cost']
+
+def daily_spend(booking, context):
+    """Holds back bookings from users who have spent the daily limit or more in the last 24 hours."""
+    return context['daily_spend'].get(booking.user_id, 0) < context['daily_spend_limit']
+
+# Rules that can be enabled with the AUTO_CONFIRM_RULES setting
+CONFIRMATION_RULES = {
+    'account_unlocked': account_unlocked,
+    'booking_cost': booking_cost,
+    'daily_spend': daily_spend,
+}
+
+def load_rules(rule_names):
+    """
+    Looks up the confirmation rule functions for a comma separated list of rule names.
+    Raises a ValueError for unknown rule names.
+    """
+    names = [name.strip() for name in rule_names.split(',') if name.strip()]
+    unknown = [name for name in names if name not in CONFIRMATION_RULES]
+    if unknown:
+        raise ValueError(f"Unknown confirmation rules: {', '.join(unknown)}")
+    return [CONFIRMATION_RULES[name] for name in names]
+
+def rule_context(bookings):
+    """
+    Loads everything the rules need for a batch of bookings with one query per check,
+    instead of the per-booking lookups done by the security checks in security_utils.
+    """
+    user_ids = {booking.user_id for booking in bookings}
+    threshold_time = datetime.utcnow() - timedelta(days=1)
+
+    locked_users = set(db.session.scalars(
+        db.select(User.id).where(User.id.in_(user_ids), User.is_locked.is_(True))
+    ))
+    daily_spend = dict(db.session.execute(
+        db.select(Booking.user_id, db.func.sum(Booking.total_cost))
+        .where(Booking.user_id.in_(user_ids), Booking.created_at >= threshold_time)
+        .group_by(Booking.user_id)
+    ).all())
+
+    return {
+        'locked_users': locked_users,
+        'daily_spend': daily_spend,
+        'max_booking_cost': current_app.config["AUTO_CONFIRM_MAX_BOOKING_COST"],
+        'daily_spend_limit': current_app.config["AUTO_CONFIRM_DAILY_SPEND_LIMIT"],
+    }
+
+def confirm_requested_batch(rules, batch_size, after_id=0):
+    """
+    Claims up to `batch_size` "Requested" bookings with an ID greater than `after_id` and confirms
+    the ones that pass every rule, in one transaction.
+
+    Rows are selected with FOR UPDATE SKIP LOCKED, so several workers can run at once without
+    waiting on or double processing each other's bookings. Bookings that fail a rule stay "Requested"
+    for an admin to review, so they can be claimed again by a later batch or pass. Only the bookings
+    this batch's UPDATE ... RETURNING changed count as confirmed.
+
+    Returns a tuple of (bookings claimed, bookings confirmed, IDs of the bookings held for review,
+    last booking ID seen).
+    """
+    bookings = db.session.execute(
+        db.select(Booking.id, Booking.user_id, Booking.total_cost)
+        .where(Booking.status == booking_status.REQUESTED, Booking.id > after_id)
+        .order_by(Booking.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    ).all()
+    if not bookings:
+        db.session.rollback()
+        return 0, 0, set(), after_id
+
+    context = rule_context(bookings)
+    passed_ids = [booking.id for booking in bookings if all(rule(booking, context) for rule in rules)]
+    confirmed_ids = []
+    if passed_ids:
+        confirmed_ids = db.session.scalars(
+            db.update(Booking)
+            .where(Booking.id.in_(passed_ids), Booking.status == booking_status.REQUESTED)
+            .values(status=booking_status.CONFIRMED, version_id=Booking.version_id + 1)
+            .returning(Booking.id)
+            .execution_options(synchronize_session=False)
+        ).all()
+    db.session.commit()
+    audit_status_changes(
+        [(booking_id, booking_status.REQUESTED) for booking_id in confirmed_ids], booking_status.CONFIRMED, 'auto_confirm'
+    )
+
+    held_ids = {booking.id for booking in bookings} - set(passed_ids)
+    return len(bookings), len(confirmed_ids), held_ids, bookings[-1].id
+
+def run_confirmation_worker(app, rules, batch_size, interval=None, stop_event=None):
+    """
+    Processes "Requested" bookings batch by batch in its own application context (and so its own session).
+
+    Each pass walks the bookings in ID order until no more are found. With no `interval` the worker stops
+    after one pass, otherwise it sleeps for `interval` seconds and starts a new pass until `stop_event` is set.
+
+    Returns a dictionary with the number of bookings confirmed and the set of IDs of the bookings held
+    for review by the last pass. Held bookings stay "Requested" and are seen again by every pass, so only
+    the last pass's are kept, and a booking seen twice in a pass (such as after another worker's batch) is
+    only counted once.
+    """
+    totals = {'confirmed': 0, 'held_ids': set()}
+    with app.app_context():
+        while True:
+            after_id = 0
+            held_this_pass = set()
+            while not (stop_event and stop_event.is_set()):
+                claimed, confirmed, held_ids, after_id = confirm_requested_batch(rules, batch_size, after_id)
+                if not claimed:
+                    break
+                totals['confirmed'] += confirmed
+                held_this_pass |= held_ids
+            totals['held_ids'] = held_this_pass
+
+            if interval is None or stop_event is None or stop_event.wait(interval):
+                return totals
@@ -0,0 +1,19 @@
+from flask import request, abort, make_response
+
+def etag_header(obj):
+    """
+    Returns the ETag response header for a versioned model object (Attraction or Booking).
+    """
+    return {"ETag": f'"{obj.version_id}"'}
+
+def check_if_match(obj):
+    """
+    Honours an If-Match request header for a versioned model object.
+
+    If the client sent If-Match and none of its ETags match the current version, the request is aborted
+    with 412 Precondition Failed, as the client is working from an out of date copy. Requests without
+    the header are allowed through. A change made by another request between this check and the commit
+    is still caught by the version check in the UPDATE/DELETE statement.
+    """
+    if request.if_match and not request.if_match.contains(str(obj.version_id)):
+        abort(make_response({"error": "This record has been changed by another request. Reload it and try again."}, 412))
@@ -0,0 +1,93 @@
+import base64
+import csv
+import io
+import json
+import zlib
+
+# Columns written for every exported booking, in order
+EXPORT_COLUMNS = (
+    'cursor', 'id', 'booking_date', 'created_at', 'status', 'number_of_guests', 'total_cost',
+    'attraction_id', 'attraction_name', 'attraction_location', 'user_id', 'user_name', 'user_email'
+)
+
+def encode_cursor(booking_id):
+    """
+    Encodes the ID of the last exported booking as an opaque, URL safe resume token.
+    """
+    return base64.urlsafe_b64encode(str(booking_id).encode()).decode().rstrip('=')
+
+def decode_cursor(token):
+    """
+    Decodes a resume token created by `encode_cursor`. Returns None if the token is invalid.
+    """
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        return int(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+def export_record(row):
+    """
+    Converts one joined export row into a plain dictionary of JSON serialisable values.
+    """
+    return {
+        'cursor': encode_cursor(row.id),
+        'id': row.id,
+        'booking_date': row.booking_date.strftime('%d-%m-%Y'),
+        'created_at': row.created_at.isoformat() if row.created_at else None,
+        'status': row.status,
+        'number_of_guests': row.number_of_guests,
+        'total_cost': row.total_cost,
+        'attraction_id': row.attraction_id,
+        'attraction_name': row.attraction_name,
+        'attraction_location': row.attraction_location,
+        'user_id': row.user_id,
+        'user_name': row.user_name,
+        'user_email': row.user_email,
+    }
+
+def csv_chunks(rows):
+    """
+    Yields the CSV header followed by one encoded line per row, reusing a single small buffer
+    so memory use stays constant regardless of how many rows are exported.
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+
+    def drain():
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return data.encode('utf-8')
+
+    writer.writeheader()
+    yield drain()
+    for row in rows:
+        writer.writerow(export_record(row))
+        yield drain()
+
+def ndjson_chunks(rows):
+    """
+    Yields one newline delimited JSON document per row.
+    """
+    for row in rows:
+        yield (json.dumps(export_record(row)) + '\n').encode('utf-8')
+
+def gzip_chunks(chunks, flush_bytes=64 * 1024):
+    """
+    Compresses a stream of byte chunks into a single gzip stream on the fly.
+
+    Output is flushed every `flush_bytes` of input so the client keeps receiving data
+    (and a dropped connection loses as little as possible) without compressing each row separately.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    pending = 0
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        pending += len(chunk)
+        if pending >= flush_bytes:
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            pending = 0
+        if data:
+            yield data
+    yield compressor.flush()
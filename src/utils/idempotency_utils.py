@@ -0,0 +1,170 @@
+import functools
+import hashlib
+from datetime import datetime, timedelta
+from time import monotonic, sleep
+
+from flask import current_app, request
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError, OperationalError
+from werkzeug.exceptions import HTTPException
+
+from init import db
+from models.idempotency_key import IdempotencyKey
+
+# How long a key is kept as claimed by a request that is still running, in case its process dies before
+# storing the response
+CLAIM_TTL = timedelta(minutes=5)
+
+# Seconds between checks for the response of a request still running with the same key
+CLAIM_POLL_SECONDS = 0.05
+
+# Client errors that a retry of the same request would get again (validation errors). Other errors, such as
+# 409 Conflict or 429 Too Many Requests, depend on the state at the time, so their keys are released instead.
+STORED_ERROR_STATUS_CODES = (400, 422)
+
+def should_store(status_code):
+    return 200 <= status_code < 300 or status_code in STORED_ERROR_STATUS_CODES
+
+def lock_idempotency_key(user_id, key, timeout):
+    """
+    Takes a Postgres advisory lock for a user's idempotency key in the session's transaction, so concurrent
+    requests with the same key check for and claim it one at a time. The lock is released when the
+    transaction ends, so the request needs no connection besides the session's.
+
+    Returns True once the lock is held, or False if it wasn't within `timeout` seconds.
+    """
+    params = {'user_id': user_id, 'key': key}
+    try:
+        # lock_timeout is local to this transaction, and only meant for the advisory lock
+        db.session.execute(text("SELECT set_config('lock_timeout', :timeout, true)"), {'timeout': f'{max(int(timeout * 1000), 1)}ms'})
+        db.session.execute(text("SELECT pg_advisory_xact_lock(:user_id, hashtext(:key))"), params)
+        db.session.execute(text("SET LOCAL lock_timeout TO DEFAULT"))
+    except OperationalError:
+        db.session.rollback()
+        return False
+    return True
+
+def find_stored_response(user_id, key):
+    """
+    Returns the stored response (or claim) for a user's idempotency key, removing it first if it has expired.
+    """
+    stored = db.session.scalar(db.select(IdempotencyKey).filter_by(user_id=user_id, key=key))
+    if stored and stored.expires_at <= datetime.utcnow():
+        db.session.delete(stored)
+        db.session.flush()
+        return None
+    return stored
+
+def claim_key(user_id, key, request_hash, deadline):
+    """
+    Claims a user's idempotency key for the current request, in the session's transaction.
+
+    Returns None once claimed, or the response to send instead: the stored response of an earlier request
+    with the key, or an error. A request still running with the key is waited for until `deadline`.
+    """
+    while True:
+        if not lock_idempotency_key(user_id, key, deadline - monotonic()):
+            return {"error": "A request with this Idempotency-Key is still being processed. Please retry later."}, 409
+
+        stored = find_stored_response(user_id, key)
+        if stored is None:
+            db.session.add(IdempotencyKey(
+                user_id=user_id, key=key, request_hash=request_hash, expires_at=datetime.utcnow() + CLAIM_TTL,
+            ))
+            db.session.flush()
+            return None
+        if stored.request_hash != request_hash:
+            return {"error": "This Idempotency-Key has already been used for a different request."}, 422
+        if stored.status_code is not None:
+            response = current_app.response_class(stored.response_body, status=stored.status_code, content_type=stored.content_type)
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        # Claimed by a request that has committed its changes but not yet stored its response
+        db.session.rollback()
+        if monotonic() >= deadline:
+            return {"error": "A request with this Idempotency-Key is still being processed. Please retry later."}, 409
+        sleep(CLAIM_POLL_SECONDS)
+
+def store_response(user_id, key, request_hash, response):
+    """
+    Stores the response to the request holding a user's idempotency key if it is a success or a validation
+    error. The key is released for any other error (see should_store) so the request can be retried.
+    """
+    # The claim is committed along with the view's changes, or gone if the view committed nothing
+    stored = db.session.scalar(db.select(IdempotencyKey).filter_by(user_id=user_id, key=key))
+    if not should_store(response.status_code):
+        if stored is not None:
+            db.session.delete(stored)
+    else:
+        if stored is None:
+            stored = IdempotencyKey(user_id=user_id, key=key, request_hash=request_hash)
+            db.session.add(stored)
+        stored.status_code = response.status_code
+        stored.content_type = response.content_type
+        stored.response_body = response.get_data(as_text=True)
+        stored.expires_at = datetime.utcnow() + timedelta(hours=current_app.config["IDEMPOTENCY_KEY_TTL_HOURS"])
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Claimed again by a retry since the view gave up the claim without committing
+        db.session.rollback()
+
+def run_view(fn, *args, **kwargs):
+    """
+    Runs a view and converts its return value, or any HTTP error it raised with abort(), into a response.
+    """
+    try:
+        return current_app.make_response(fn(*args, **kwargs))
+    except HTTPException as err:
+        return current_app.make_response(current_app.handle_http_exception(err))
+
+def idempotent(fn):
+    """
+    Decorator that makes an endpoint safe to retry with an Idempotency-Key header.
+
+    The first response (status and body) for a key is stored for IDEMPOTENCY_KEY_TTL_HOURS. Retries of the
+    same request (method, path and body) with the key get the stored response back without running the
+    endpoint, so they can't create duplicates. Concurrent retries wait for the original request to finish,
+    for up to IDEMPOTENCY_LOCK_TIMEOUT_SECONDS, instead of running alongside it. Only successes and validation
+    errors are stored; other errors (conflicts, rate limits, server errors) release the key so those requests
+    can be retried. Requests without the header run as normal.
+
+    The key is claimed in the request's own transaction, so the claim is committed along with the
+    endpoint's changes.
+
+    Must be applied after @jwt_required, as keys are scoped to the authenticated user.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if key is None:
+            return fn(*args, **kwargs)
+        if not key or len(key) > 255:
+            return {"error": "Idempotency-Key must be between 1 and 255 characters."}, 400
+
+        user_id = int(get_jwt_identity())
+        # The same key and body sent to another endpoint (or for another user) is a different request
+        request_hash = hashlib.sha256(f"{request.method} {request.path}\n".encode() + request.get_data()).hexdigest()
+
+        deadline = monotonic() + current_app.config["IDEMPOTENCY_LOCK_TIMEOUT_SECONDS"]
+        earlier = claim_key(user_id, key, request_hash, deadline)
+        if earlier is not None:
+            return earlier
+
+        response = run_view(fn, *args, **kwargs)
+        # Discards anything a failed request left uncommitted before storing its response
+        db.session.rollback()
+        store_response(user_id, key, request_hash, response)
+        return response
+
+    return wrapper
+
+def purge_expired_idempotency_keys():
+    """
+    Deletes every expired idempotency key. Returns the number of keys deleted.
+    """
+    result = db.session.execute(db.delete(IdempotencyKey).where(IdempotencyKey.expires_at <= datetime.utcnow()))
+    db.session.commit()
+    return result.rowcount
@@ -0,0 +1,168 @@
+import csv
+import json
+from itertools import islice
+
+from flask import current_app
+from marshmallow import ValidationError
+from sqlalchemy import literal_column
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import DBAPIError
+
+from init import db
+from models.attraction import Attraction, attractions_import_schema
+from models.opening_hours import OpeningHours, weekly_hours
+from utils.attraction_cache_utils import bump_content_versions
+
+IMPORT_FORMATS = ('csv', 'ndjson')
+
+# Columns written by an import, matching AttractionImportSchema
+IMPORT_COLUMNS = (
+    'name', 'ticket_price', 'location', 'description', 'contact_phone', 'contact_email',
+    'opening_hours', 'weekday_hours', 'available_slots',
+)
+
+def read_csv(stream):
+    """
+    Yields (row number, row) for each row of a CSV file with a header row. Empty cells are left out,
+    and weekday_hours is parsed from JSON.
+    """
+    for number, record in enumerate(csv.DictReader(stream), start=2):
+        row = {key: value for key, value in record.items() if key and value not in (None, '')}
+        if 'weekday_hours' in row:
+            try:
+                row['weekday_hours'] = json.loads(row['weekday_hours'])
+            except ValueError:
+                pass  # Left as a string, which the schema rejects with a field error
+        yield number, row
+
+def read_ndjson(stream):
+    """
+    Yields (line number, row) for each non-empty line of a newline delimited JSON file. A line that isn't a
+    JSON object is yielded as its error message.
+    """
+    for number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as err:
+            row = f"Invalid JSON: {err}"
+        if not isinstance(row, (dict, str)):
+            row = "Each line must be a JSON object."
+        yield number, row
+
+# Inserts attractions, updating the one with the same name instead where it exists. Built once and run with a
+# list of rows, which SQLAlchemy sends as multi-row INSERT statements without compiling the SQL for each batch.
+attraction_table = Attraction.__table__
+attraction_insert = insert(attraction_table)
+upsert_attractions_stmt = attraction_insert.on_conflict_do_update(
+    index_elements=[attraction_table.c.name],
+    set_={
+        **{column: attraction_insert.excluded[column] for column in IMPORT_COLUMNS if column != 'name'},
+        'version_id': attraction_table.c.version_id + 1,
+    },
+).returning(
+    attraction_table.c.id,
+    attraction_table.c.name,
+    # xmax is 0 for a row version created by an insert, and set when the row was updated instead
+    (literal_column('xmax') == '0').label('inserted'),
+)
+
+def upsert_attractions(rows):
+    """
+    Inserts the rows as attractions, updating the attractions that already have the same name instead.
+    Names must be unique within the rows. Returns {name: (attraction ID, whether it was inserted)}.
+    """
+    return {name: (attraction_id, inserted) for attraction_id, name, inserted in db.session.execute(upsert_attractions_stmt, rows)}
+
+def replace_opening_hours(rows, attractions):
+    """
+    Replaces the parsed opening hours of imported attractions, which an insert that bypasses the model
+    doesn't update (see models/attraction.py).
+    """
+    attraction_ids = [attraction_id for attraction_id, _ in attractions.values()]
+    db.session.execute(db.delete(OpeningHours.__table__).where(OpeningHours.attraction_id.in_(attraction_ids)))
+    hours = [
+        {'attraction_id': attractions[row['name']][0], 'weekday': weekday, 'opens_at': opens_at, 'closes_at': closes_at}
+        for row in rows
+        for weekday, opens_at, closes_at in weekly_hours(row['opening_hours'], row['weekday_hours'])
+    ]
+    if hours:
+        db.session.execute(db.insert(OpeningHours.__table__), hours)
+
+def import_batch(batch, result):
+    """
+    Validates a batch of (row number, row) pairs together and writes the valid rows in one transaction.
+    Invalid rows are added to the result's errors, and the others to its counts.
+    """
+    errors = {}
+    loadable = []
+    for number, row in batch:
+        if isinstance(row, str):
+            errors[number] = {'_row': [row]}
+        else:
+            loadable.append((number, row))
+
+    try:
+        loaded = attractions_import_schema.load([row for _, row in loadable])
+        invalid = {}
+    except ValidationError as err:
+        loaded, invalid = err.valid_data, err.messages
+    for index, (number, _) in enumerate(loadable):
+        if index in invalid:
+            errors[number] = invalid[index]
+
+    # A name can only be upserted once per statement, so a later row with the same name replaces an earlier one
+    rows = {}
+    for index, (number, _) in enumerate(loadable):
+        if index in invalid:
+            continue
+        row = {column: loaded[index].get(column) for column in IMPORT_COLUMNS}
+        if row['name'] in rows:
+            errors[rows[row['name']][0]] = {'name': [f"Replaced by row {number} with the same name."]}
+        rows[row['name']] = (number, row)
+
+    if rows:
+        valid_rows = [row for _, row in rows.values()]
+        try:
+            attractions = upsert_attractions(valid_rows)
+            replace_opening_hours(valid_rows, attractions)
+            bump_content_versions(Attraction.id.in_([attraction_id for attraction_id, _ in attractions.values()]))
+            db.session.commit()
+        except DBAPIError as err:
+            db.session.rollback()
+            message = str(err.orig).strip().splitlines()[0]
+            for number, _ in rows.values():
+                errors[number] = {'_batch': [f"Not imported, the batch failed: {message}"]}
+        else:
+            inserted = sum(1 for _, was_inserted in attractions.values() if was_inserted)
+            result['inserted'] += inserted
+            result['updated'] += len(attractions) - inserted
+
+    result['failed'] += len(errors)
+    for number in sorted(errors):
+        if len(result['errors']) < current_app.config["IMPORT_MAX_ERRORS"]:
+            result['errors'].append({'row': number, 'errors': errors[number]})
+        else:
+            result['errors_truncated'] = True
+
+def import_attractions(stream, file_format, batch_size=1000):
+    """
+    Imports attractions from a CSV (with a header row) or newline delimited JSON text stream, reading it
+    in batches of `batch_size` rows, so the file is never held in memory as a whole.
+
+    Each batch is validated with AttractionImportSchema(many=True), then written with multi-row
+    INSERT ... ON CONFLICT (name) DO UPDATE, so existing attractions with the same name are updated.
+    Invalid rows are reported and skipped without stopping the import. Returns the counts of inserted,
+    updated and failed rows and the errors of the failed rows (up to IMPORT_MAX_ERRORS of them), by row number.
+    """
+    if file_format not in IMPORT_FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(IMPORT_FORMATS)}.")
+
+    rows = read_csv(stream) if file_format == 'csv' else read_ndjson(stream)
+    result = {'inserted': 0, 'updated': 0, 'failed': 0, 'errors': [], 'errors_truncated': False}
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return result
+        import_batch(batch, result)
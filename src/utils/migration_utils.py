@@ -0,0 +1,159 @@
+from sqlalchemy import text
+
+from init import db
+
+# Schema changes for databases created before the matching model change, run in order by `flask db upgrade`.
+# Every migration is safe to run more than once, so the whole list is applied on each upgrade.
+migrations = []
+
+def migration(description):
+    """
+    Decorator that registers a function as the next migration step.
+    """
+    def register(fn):
+        migrations.append((description, fn))
+        return fn
+    return register
+
+def execute_statements(*statements, lock_timeout='5s'):
+    """
+    Runs SQL statements in one transaction. A short lock_timeout makes a statement that can't get its
+    lock fail quickly, rather than queueing behind long transactions and blocking every request behind it.
+    """
+    with db.engine.begin() as conn:
+        conn.execute(text("SELECT set_config('lock_timeout', :timeout, true)"), {'timeout': lock_timeout})
+        for statement in statements:
+            conn.execute(text(statement))
+
+@migration("Add version columns to attractions and bookings")
+def add_version_columns():
+    # Adding a column with a constant default doesn't rewrite the table
+    execute_statements(
+        "ALTER TABLE attractions ADD COLUMN IF NOT EXISTS version_id INTEGER NOT NULL DEFAULT 1",
+        "ALTER TABLE bookings ADD COLUMN IF NOT EXISTS version_id INTEGER NOT NULL DEFAULT 1",
+    )
+
+def create_index_concurrently(name, table, columns, unique=False, where=None):
+    """
+    Builds an index without blocking writes to the table, if it doesn't exist yet. CREATE INDEX CONCURRENTLY
+    can't run inside a transaction, so it uses an autocommit connection. Partitioned tables (such as bookings
+    after `flask db partition-bookings`) can't be indexed concurrently, so theirs are built normally.
+    """
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if conn.execute(text("SELECT to_regclass(:name)"), {'name': name}).scalar() is not None:
+            return
+        partitioned = conn.execute(
+            text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = CAST(:table AS regclass)"), {'table': table}
+        ).first() is not None
+
+        statement = (
+            f"CREATE {'UNIQUE ' if unique else ''}INDEX {'' if partitioned else 'CONCURRENTLY '}"
+            f"IF NOT EXISTS {name} ON {table} ({columns})"
+        )
+        if where:
+            statement += f" WHERE {where}"
+        conn.execute(text(statement))
+
+def cascade_foreign_key(table, column, referenced_table):
+    """
+    Replaces the foreign key on `table.column` with one that has ON DELETE CASCADE, without a long lock.
+
+    The new constraint is added NOT VALID (no table scan while holding the lock) and swapped in for the old
+    one in a short transaction. It is then validated separately, which only takes a lock that allows reads
+    and writes to continue. Does nothing if the foreign key already cascades.
+    """
+    with db.engine.connect() as conn:
+        existing = conn.execute(text("""
+            SELECT con.conname, con.confdeltype, con.convalidated
+            FROM pg_constraint con
+            JOIN pg_attribute att ON att.attrelid = con.conrelid AND att.attnum = ANY(con.conkey)
+            WHERE con.contype = 'f' AND con.conrelid = CAST(:table AS regclass) AND att.attname = :column
+        """), {'table': table, 'column': column}).first()
+
+    name = existing.conname if existing else f"{table}_{column}_fkey"
+    if existing is None or existing.confdeltype != 'c':
+        statements = [
+            f"ALTER TABLE {table} ADD CONSTRAINT {name}_cascade FOREIGN KEY ({column}) "
+            f"REFERENCES {referenced_table} (id) ON DELETE CASCADE NOT VALID",
+        ]
+        if existing is not None:
+            statements.append(f"ALTER TABLE {table} DROP CONSTRAINT {name}")
+        statements.append(f"ALTER TABLE {table} RENAME CONSTRAINT {name}_cascade TO {name}")
+        execute_statements(*statements)
+
+    if existing is None or existing.confdeltype != 'c' or not existing.convalidated:
+        execute_statements(f"ALTER TABLE {table} VALIDATE CONSTRAINT {name}")
+
+@migration("Index foreign keys and cascade deletes from users and attractions in the database")
+def cascade_deletes():
+    # Indexes first, so each cascaded delete finds the child rows without scanning the table
+    for table, column, referenced_table in [
+        ('bookings', 'user_id', 'users'),
+        ('bookings', 'attraction_id', 'attractions'),
+        ('reviews', 'user_id', 'users'),
+        ('reviews', 'attraction_id', 'attractions'),
+    ]:
+        create_index_concurrently(f"ix_{table}_{column}", table, column)
+        cascade_foreign_key(table, column, referenced_table)
+
+@migration("Allow one review per user and attraction, and index confirmed bookings for review checks")
+def unique_reviews():
+    create_index_concurrently(
+        "ix_bookings_confirmed_user_attraction", "bookings", "user_id, attraction_id, booking_date",
+        where="status = 'Confirmed'"
+    )
+
+    with db.engine.connect() as conn:
+        has_constraint = conn.execute(
+            text("SELECT 1 FROM pg_constraint WHERE conname = 'uix_user_attraction_review'")
+        ).first()
+    if has_constraint:
+        return
+
+    # Duplicates left by earlier concurrent requests would fail the unique index, so only the first review is kept
+    execute_statements("""
+        DELETE FROM reviews r USING reviews earlier
+        WHERE r.user_id = earlier.user_id AND r.attraction_id = earlier.attraction_id AND r.id > earlier.id
+    """)
+    # A failed concurrent build leaves an invalid index behind, which would then be skipped as already existing
+    execute_statements("DROP INDEX IF EXISTS uix_user_attraction_review")
+    create_index_concurrently("uix_user_attraction_review", "reviews", "user_id, attraction_id", unique=True)
+    execute_statements(
+        "ALTER TABLE reviews ADD CONSTRAINT uix_user_attraction_review UNIQUE USING INDEX uix_user_attraction_review"
+    )
+
+@migration("Notify availability streams when attraction slots change")
+def notify_slot_changes():
+    from utils.availability_utils import SLOTS_TRIGGER_STATEMENTS
+    execute_statements(*SLOTS_TRIGGER_STATEMENTS)
+
+@migration("Store parsed opening hours for open at queries")
+def structured_opening_hours():
+    from utils.opening_hours_utils import backfill_opening_hours
+    # The attraction_opening_hours table itself is created by create_all
+    execute_statements("ALTER TABLE attractions ADD COLUMN IF NOT EXISTS weekday_hours JSON")
+    backfill_opening_hours()
+
+@migration("Include the attraction version in slot change notifications")
+def notify_slot_versions():
+    from utils.availability_utils import SLOTS_TRIGGER_STATEMENTS
+    # Replaces the trigger function, for the shared slot counters
+    execute_statements(*SLOTS_TRIGGER_STATEMENTS)
+
+@migration("Let idempotency keys be claimed before their response is stored")
+def claim_idempotency_keys():
+    execute_statements(
+        "ALTER TABLE idempotency_keys ALTER COLUMN status_code DROP NOT NULL",
+        "ALTER TABLE idempotency_keys ALTER COLUMN content_type DROP NOT NULL",
+        "ALTER TABLE idempotency_keys ALTER COLUMN response_body DROP NOT NULL",
+    )
+
+def run_migrations():
+    """
+    Creates any missing tables, then applies every migration step in order.
+    Yields the description of each step as it completes.
+    """
+    db.create_all()
+    for description, fn in migrations:
+        fn()
+        yield description
@@ -0,0 +1,80 @@
+import re
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import bindparam
+
+from init import db
+from models.attraction import Attraction
+from models.opening_hours import OpeningHours, WEEKDAYS, MINUTES_PER_DAY, weekly_hours
+from utils.attraction_cache_utils import select_listed
+
+# The attractions open at a time (see select_listed), ordered by name like the attraction list. An attraction
+# is open if that day's hours include the time, or the previous day's hours run past midnight beyond it.
+# Each branch is a range on one of the opening hours indexes.
+open_attraction_versions_stmt = (
+    select_listed()
+    .where(Attraction.id.in_(
+        db.select(OpeningHours.attraction_id).where(db.or_(
+            db.and_(
+                OpeningHours.weekday == bindparam('weekday'),
+                OpeningHours.opens_at <= bindparam('minute'),
+                OpeningHours.closes_at > bindparam('minute'),
+            ),
+            db.and_(
+                OpeningHours.weekday == bindparam('previous_weekday'),
+                OpeningHours.closes_at > MINUTES_PER_DAY,
+                OpeningHours.closes_at > bindparam('minute') + MINUTES_PER_DAY,
+            ),
+        ))
+    ))
+    .order_by(Attraction.name)
+)
+
+def open_at_params(open_at, day=None):
+    """
+    Returns the parameters of open_attraction_versions_stmt for a time in 'HH:MM' format, on a day
+    from 'mon' to 'sun' (today in ATTRACTIONS_TIMEZONE by default). Raises ValueError if either is invalid.
+    """
+    match = re.match(r'^(2[0-3]|[01]?[0-9]):([0-5][0-9])$', open_at)
+    if match is None:
+        raise ValueError("open_at must be a time in 'HH:MM' format using 24-hour time.")
+    if day is None:
+        weekday = datetime.now(current_app.config["ATTRACTIONS_TIMEZONE"]).weekday()
+    elif day in WEEKDAYS:
+        weekday = WEEKDAYS.index(day)
+    else:
+        raise ValueError(f"day must be one of: {', '.join(WEEKDAYS)}.")
+    return {
+        'weekday': weekday,
+        'previous_weekday': (weekday - 1) % 7,
+        'minute': int(match.group(1)) * 60 + int(match.group(2)),
+    }
+
+def backfill_opening_hours(batch_size=500):
+    """
+    Parses the opening hours of attractions that have none stored yet, in batches of `batch_size`.
+    Returns the number of attractions filled in.
+    """
+    filled = 0
+    after_id = 0
+    while True:
+        attractions = db.session.execute(
+            db.select(Attraction.id, Attraction.opening_hours, Attraction.weekday_hours)
+            .where(Attraction.id > after_id, ~db.exists().where(OpeningHours.attraction_id == Attraction.id))
+            .order_by(Attraction.id)
+            .limit(batch_size)
+        ).all()
+        if not attractions:
+            return filled
+
+        rows = [
+            {'attraction_id': attraction_id, 'weekday': weekday, 'opens_at': opens_at, 'closes_at': closes_at}
+            for attraction_id, opening_hours, weekday_hours in attractions
+            for weekday, opens_at, closes_at in weekly_hours(opening_hours, weekday_hours)
+        ]
+        if rows:
+            db.session.execute(db.insert(OpeningHours), rows)
+        db.session.commit()
+        filled += len(attractions)
+        after_id = attractions[-1].id
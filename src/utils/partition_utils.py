@@ -0,0 +1,201 @@
+from datetime import date, datetime
+
+from sqlalchemy import text
+from sqlalchemy.schema import CreateIndex
+
+from init import db
+from models.booking import Booking, booking_status
+from models.archived_booking import ArchivedBooking
+
+# Columns copied between bookings and archived_bookings, in the same order for both
+BOOKING_COLUMNS = ", ".join(column.name for column in Booking.__table__.columns)
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+def add_months(month, count):
+    months = month.year * 12 + month.month - 1 + count
+    return date(months // 12, months % 12 + 1, 1)
+
+def partition_name(month):
+    return f"bookings_y{month.year}m{month.month:02d}"
+
+def partition_month(name):
+    """
+    Returns the month of a monthly partition from its name, or None for the default partition.
+    """
+    if not name.startswith("bookings_y"):
+        return None
+    return date(int(name[10:14]), int(name[15:17]), 1)
+
+def is_partitioned(conn):
+    return conn.execute(
+        text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('bookings')")
+    ).first() is not None
+
+def booking_partitions(conn):
+    """
+    Returns the names of the partitions of the bookings table.
+    """
+    return conn.scalars(text(
+        "SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = to_regclass('bookings')"
+    )).all()
+
+def create_month_partition(conn, month):
+    """
+    Creates the partition for the bookings of one month, if it doesn't exist yet.
+
+    Bookings for the month that were stored in the default partition (because their partition didn't exist)
+    are moved into the new partition before it is attached. Returns True if the partition was created.
+    """
+    name = partition_name(month)
+    if conn.execute(text("SELECT to_regclass(:name)"), {'name': name}).scalar() is not None:
+        return False
+
+    bounds = {'start': month, 'end': add_months(month, 1)}
+    conn.execute(text(f"CREATE TABLE {name} (LIKE bookings INCLUDING DEFAULTS)"))
+    conn.execute(text(f"""
+        WITH moved AS (
+            DELETE FROM bookings_default WHERE booking_date >= :start AND booking_date < :end
+            RETURNING {BOOKING_COLUMNS}
+        )
+        INSERT INTO {name} ({BOOKING_COLUMNS}) SELECT {BOOKING_COLUMNS} FROM moved
+    """), bounds)
+    conn.execute(text(
+        f"ALTER TABLE bookings ATTACH PARTITION {name} FOR VALUES FROM ('{bounds['start']}') TO ('{bounds['end']}')"
+    ))
+    return True
+
+def convert_to_partitioned(conn, first_month, last_month):
+    """
+    Replaces the bookings table with one partitioned by booking_date month, copying every booking across.
+
+    Runs in the caller's transaction, which holds a lock that blocks writes to bookings (reads carry on)
+    until it commits. The new table has a partition for each month from `first_month` to `last_month`,
+    and a default partition for bookings outside them. Its primary key is (id, booking_date), as Postgres
+    requires the partition key in it. IDs still come from the same sequence.
+    """
+    conn.execute(text("LOCK TABLE bookings IN EXCLUSIVE MODE"))
+    sequence = conn.execute(text("SELECT pg_get_serial_sequence('bookings', 'id')")).scalar()
+
+    conn.execute(text("""
+        CREATE TABLE bookings_partitioned (LIKE bookings INCLUDING DEFAULTS, PRIMARY KEY (id, booking_date))
+        PARTITION BY RANGE (booking_date)
+    """))
+    conn.execute(text("CREATE TABLE bookings_default PARTITION OF bookings_partitioned DEFAULT"))
+    month = first_month
+    while month <= last_month:
+        conn.execute(text(
+            f"CREATE TABLE {partition_name(month)} PARTITION OF bookings_partitioned "
+            f"FOR VALUES FROM ('{month}') TO ('{add_months(month, 1)}')"
+        ))
+        month = add_months(month, 1)
+
+    conn.execute(text(f"INSERT INTO bookings_partitioned ({BOOKING_COLUMNS}) SELECT {BOOKING_COLUMNS} FROM bookings"))
+
+    # The sequence belongs to the old id column and would be dropped with it
+    conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY NONE"))
+    conn.execute(text("DROP TABLE bookings"))
+    conn.execute(text("ALTER TABLE bookings_partitioned RENAME TO bookings"))
+    conn.execute(text("ALTER TABLE bookings RENAME CONSTRAINT bookings_partitioned_pkey TO bookings_pkey"))
+    conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY bookings.id"))
+    conn.execute(text(
+        "ALTER TABLE bookings ADD CONSTRAINT bookings_user_id_fkey FOREIGN KEY (user_id) "
+        "REFERENCES users (id) ON DELETE CASCADE"
+    ))
+    conn.execute(text(
+        "ALTER TABLE bookings ADD CONSTRAINT bookings_attraction_id_fkey FOREIGN KEY (attraction_id) "
+        "REFERENCES attractions (id) ON DELETE CASCADE"
+    ))
+    # Indexes created on the parent table are created on every partition, including ones added later
+    for index in Booking.__table__.indexes:
+        conn.execute(CreateIndex(index))
+
+def partition_bookings(months_ahead):
+    """
+    Partitions the bookings table by booking_date month, or if it is already partitioned, adds the partitions
+    for the months up to `months_ahead` months from now. Returns the number of monthly partitions created.
+
+    Queries that filter on booking_date only read the partitions for those months (partition pruning).
+    Run it regularly (such as monthly) so upcoming months have their own partition.
+    """
+    today = datetime.utcnow().date()
+    last_month = add_months(month_start(today), months_ahead)
+
+    with db.engine.begin() as conn:
+        conn.execute(text("SELECT set_config('lock_timeout', '5s', true)"))
+        if not is_partitioned(conn):
+            oldest = conn.execute(text("SELECT min(booking_date) FROM bookings")).scalar()
+            first_month = month_start(min(oldest.date(), today) if oldest else today)
+            convert_to_partitioned(conn, first_month, last_month)
+            return len(booking_partitions(conn)) - 1
+
+        created = 0
+        month = month_start(today)
+        while month <= last_month:
+            created += create_month_partition(conn, month)
+            month = add_months(month, 1)
+        return created
+
+def archive_bookings(before, batch_size=5000):
+    """
+    Moves every booking with a booking date before the month `before` (the first of a month) to the
+    archived_bookings table. Yields a description of each step.
+
+    Whole monthly partitions are copied in one statement each, then detached and dropped, which is much
+    cheaper than deleting their rows. Any remaining bookings (in the default partition, or all of them
+    when bookings isn't partitioned) are moved in batches of `batch_size`.
+
+    "Requested" bookings still hold their attraction's slots, so they aren't archived. They are left until
+    they are confirmed, cancelled or expired by the sweeper, and a partition holding any is moved in batches.
+    """
+    ArchivedBooking.__table__.create(db.engine, checkfirst=True)
+
+    with db.engine.connect() as conn:
+        partitions = booking_partitions(conn) if is_partitioned(conn) else []
+
+    for name in sorted(partitions):
+        month = partition_month(name)
+        if month is None or add_months(month, 1) > before:
+            continue
+        with db.engine.begin() as conn:
+            conn.execute(text("SELECT set_config('lock_timeout', '5s', true)"))
+            # Blocks writes (but not reads) so no booking changes between the check, the copy and the detach
+            conn.execute(text(f"LOCK TABLE {name} IN EXCLUSIVE MODE"))
+            requested = conn.scalar(
+                text(f"SELECT count(*) FROM {name} WHERE status = :requested"), {'requested': booking_status.REQUESTED}
+            )
+            if requested:
+                yield f"Partition {name} has {requested} Requested bookings, moving its other bookings in batches"
+                continue
+            moved = conn.execute(text(
+                f"INSERT INTO archived_bookings ({BOOKING_COLUMNS}) SELECT {BOOKING_COLUMNS} FROM {name}"
+            )).rowcount
+            conn.execute(text(f"ALTER TABLE bookings DETACH PARTITION {name}"))
+            conn.execute(text(f"DROP TABLE {name}"))
+        yield f"Archived partition {name}: {moved} bookings"
+
+    params = {'before': before, 'batch_size': batch_size, 'requested': booking_status.REQUESTED}
+    moved = 0
+    while True:
+        with db.engine.begin() as conn:
+            batch = conn.execute(text(f"""
+                WITH moved AS (
+                    DELETE FROM bookings WHERE booking_date < :before AND status <> :requested AND id IN (
+                        SELECT id FROM bookings WHERE booking_date < :before AND status <> :requested LIMIT :batch_size
+                    )
+                    RETURNING {BOOKING_COLUMNS}
+                )
+                INSERT INTO archived_bookings ({BOOKING_COLUMNS}) SELECT {BOOKING_COLUMNS} FROM moved
+            """), params).rowcount
+        moved += batch
+        if batch < batch_size:
+            break
+    yield f"Archived {moved} other bookings"
+
+    with db.engine.connect() as conn:
+        requested = conn.scalar(
+            text("SELECT count(*) FROM bookings WHERE booking_date < :before AND status = :requested"), params
+        )
+    if requested:
+        yield f"Left {requested} Requested bookings, archive them once they are confirmed, cancelled or expired"
@@ -0,0 +1,84 @@
+from sqlalchemy.orm import joinedload
+
+from init import db
+from models.user import UserSchema
+from models.booking import Booking, BookingSchema, booking_status
+from models.review import Review, reviews_schema
+
+# The account details shown in both profile views
+profile_schema = UserSchema(exclude=['password', 'bookings', 'reviews'])
+# A user's own bookings, without the user nested in each one
+user_bookings_schema = BookingSchema(many=True, exclude=['user'])
+
+def booking_totals(user_id):
+    """
+    Counts a user's bookings by status and adds up their spend, in one aggregate query.
+    Cancelled bookings are counted but not included in the spend.
+    """
+    rows = db.session.execute(
+        db.select(Booking.status, db.func.count(), db.func.coalesce(db.func.sum(Booking.total_cost), 0))
+        .where(Booking.user_id == user_id)
+        .group_by(Booking.status)
+    ).all()
+
+    counts = {status: 0 for status in (booking_status.REQUESTED, booking_status.CONFIRMED, booking_status.CANCELLED)}
+    total_spend = 0
+    for status, count, spend in rows:
+        counts[status] = count
+        if status != booking_status.CANCELLED:
+            total_spend += spend
+    return counts, total_spend
+
+def review_count(user_id):
+    return db.session.scalar(db.select(db.func.count()).select_from(Review).where(Review.user_id == user_id))
+
+def user_bookings(user_id, limit, offset=0):
+    """
+    Loads a page of a user's bookings, most recent booking date first, with each attraction loaded in the same query.
+    """
+    return db.session.scalars(
+        db.select(Booking)
+        .options(joinedload(Booking.attraction))
+        .where(Booking.user_id == user_id)
+        .order_by(Booking.booking_date.desc(), Booking.id.desc())
+        .limit(limit)
+        .offset(offset)
+    ).all()
+
+def profile_summary(user, recent_count):
+    """
+    Builds the summary view of a user's profile: their account details, booking counts by status,
+    total spend, review count and their `recent_count` most recent bookings.
+    """
+    counts, total_spend = booking_totals(user.id)
+    summary = profile_schema.dump(user)
+    summary['bookings_by_status'] = counts
+    summary['total_spend'] = total_spend
+    summary['review_count'] = review_count(user.id)
+    summary['recent_bookings'] = user_bookings_schema.dump(user_bookings(user.id, recent_count))
+    return summary
+
+def profile_full_page(user, page, per_page):
+    """
+    Builds one page of the full view of a user's profile: their account details with a page of their
+    bookings and a page of their reviews (newest first), plus the totals needed to page through them.
+    """
+    offset = (page - 1) * per_page
+    reviews = db.session.scalars(
+        db.select(Review)
+        .options(joinedload(Review.attraction))
+        .where(Review.user_id == user.id)
+        .order_by(Review.created_at.desc(), Review.id.desc())
+        .limit(per_page)
+        .offset(offset)
+    ).all()
+    counts, _ = booking_totals(user.id)
+
+    profile = profile_schema.dump(user)
+    profile['bookings'] = user_bookings_schema.dump(user_bookings(user.id, per_page, offset))
+    profile['reviews'] = reviews_schema.dump(reviews)
+    profile['page'] = page
+    profile['per_page'] = per_page
+    profile['total_bookings'] = sum(counts.values())
+    profile['total_reviews'] = review_count(user.id)
+    return profile
@@ -0,0 +1,352 @@
+import cProfile
+import json
+import logging
+import os
+import pstats
+import secrets
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from itertools import count
+from time import monotonic, perf_counter
+
+from flask import g, request
+from flask.json.provider import DefaultJSONProvider
+from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt.exceptions import PyJWTError
+from marshmallow import Schema
+from sqlalchemy import event
+from sqlalchemy.engine import Connection
+
+from init import db
+from utils.auth_utils import is_admin
+
+logger = logging.getLogger(__name__)
+
+# Request header an admin sends to have that request profiled
+PROFILE_HEADER = 'X-Profile'
+
+# Functions whose cumulative time makes up each section of a profile. Sections can overlap (the admin
+# check in auth runs a query), and query time covers running statements, not loading the rows returned.
+SECTION_FUNCTIONS = {
+    'auth': (verify_jwt_in_request, is_admin),
+    'query': (Connection._execute_context,),
+    'dump': (Schema.dump,),
+    'json': (DefaultJSONProvider.dumps,),
+}
+
+# Functions listed in a profile, by cumulative time
+TOP_FUNCTIONS = 40
+
+# Longest SQL kept per statement
+MAX_STATEMENT_LENGTH = 1000
+
+def function_key(fn):
+    code = fn.__code__
+    return code.co_filename, code.co_firstlineno, code.co_name
+
+SECTION_KEYS = {section: [function_key(fn) for fn in functions] for section, functions in SECTION_FUNCTIONS.items()}
+
+# The profile being recorded by the current thread, if any
+active = threading.local()
+
+class RequestProfile:
+    """
+    A request being profiled: the stdlib profiler and the SQL statements run while it is enabled.
+    """
+    def __init__(self, trigger, max_statements):
+        self.id = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{secrets.token_hex(4)}"
+        self.trigger = trigger
+        self.max_statements = max_statements
+        self.statements = []
+        self.statements_truncated = False
+        self.profiler = cProfile.Profile()
+        self.started_at = datetime.now(timezone.utc)
+        self.started = perf_counter()
+        self.duration = None
+
+    def start(self):
+        active.profile = self
+        self.profiler.enable()
+
+    def stop(self):
+        self.profiler.disable()
+        self.duration = perf_counter() - self.started
+        active.profile = None
+
+    def record_statement(self, statement, duration, executemany):
+        if len(self.statements) >= self.max_statements:
+            self.statements_truncated = True
+            return
+        # Parameters are left out, as they can hold personal details and password hashes
+        self.statements.append({
+            'statement': statement[:MAX_STATEMENT_LENGTH],
+            'duration_ms': round(duration * 1000, 3),
+            'executemany': executemany,
+        })
+
+    def report(self, response):
+        stats = pstats.Stats(self.profiler)
+        sections = {
+            section: round(sum(stats.stats[key][3] for key in keys if key in stats.stats) * 1000, 3)
+            for section, keys in SECTION_KEYS.items()
+        }
+        sections['sql'] = round(sum(statement['duration_ms'] for statement in self.statements), 3)
+        functions = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:TOP_FUNCTIONS]
+        return stats, {
+            'id': self.id,
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'trigger': self.trigger,
+            'started_at': self.started_at.isoformat(),
+            'duration_ms': round(self.duration * 1000, 3),
+            # A streamed response (such as the bookings export) is profiled up to the start of the stream
+            'streamed': response.is_streamed,
+            'sections_ms': sections,
+            'statements': self.statements,
+            'statements_truncated': self.statements_truncated,
+            'functions': [
+                {
+                    'function': pstats.func_std_string(key),
+                    'calls': calls,
+                    'total_ms': round(total * 1000, 3),
+                    'cumulative_ms': round(cumulative * 1000, 3),
+                }
+                for key, (_, calls, total, cumulative, _) in functions
+            ],
+        }
+
+class RequestProfiler:
+    """
+    Decides which requests are profiled, and keeps the profile directory within its limits.
+
+    Profiling slows the request it runs on several times over, so only one request per process is
+    profiled at a time, and at most `max_per_minute`. Requests that would be profiled beyond that are
+    served normally. Each profile is written as a JSON report (with the SQL run and the time spent in
+    each section) and the raw stats for pstats or snakeviz. Only the newest `max_files` profiles are
+    kept, in at most `max_bytes`.
+    """
+    def __init__(self, directory, sample_every, max_per_minute, max_files, max_bytes, max_statements):
+        self.directory = directory
+        self.sample_every = sample_every
+        self.max_per_minute = max_per_minute
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.max_statements = max_statements
+        self.requests = count(1)
+        self.running = threading.Lock()
+        self.recent = deque()
+        self.lock = threading.Lock()
+        self.counts = {'profiled': 0, 'skipped_busy': 0, 'skipped_budget': 0}
+
+    def sampled(self):
+        return bool(self.sample_every) and next(self.requests) % self.sample_every == 0
+
+    def begin(self, trigger):
+        """
+        Returns a started profile for the current request, or None if the limits don't allow one now.
+        """
+        if not self.running.acquire(blocking=False):
+            self.count('skipped_busy')
+            return None
+        with self.lock:
+            now = monotonic()
+            while self.recent and now - self.recent[0] > 60:
+                self.recent.popleft()
+            if len(self.recent) >= self.max_per_minute:
+                self.counts['skipped_budget'] += 1
+                self.running.release()
+                return None
+            self.recent.append(now)
+            self.counts['profiled'] += 1
+
+        profile = RequestProfile(trigger, self.max_statements)
+        try:
+            profile.start()
+        except ValueError:
+            # Another profiler is already running in this process
+            active.profile = None
+            self.running.release()
+            return None
+        return profile
+
+    def end(self, profile, response=None):
+        """
+        Stops a profile, and writes it unless the request didn't get as far as a response.
+        """
+        try:
+            profile.stop()
+            if response is not None:
+                stats, report = profile.report(response)
+                try:
+                    self.write(profile.id, stats, report)
+                except OSError as err:
+                    logger.warning("Couldn't write profile %s: %s", profile.id, err)
+        finally:
+            self.running.release()
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def write(self, profile_id, stats, report):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, profile_id)
+        stats.dump_stats(f"{path}.prof.tmp")
+        with open(f"{path}.json.tmp", 'w') as file:
+            json.dump(report, file, default=str)
+        # Renamed into place last, so a listing never sees a profile half written
+        os.replace(f"{path}.prof.tmp", f"{path}.prof")
+        os.replace(f"{path}.json.tmp", f"{path}.json")
+        self.rotate()
+
+    def rotate(self):
+        """
+        Deletes the oldest profiles until at most max_files are left, using at most max_bytes.
+        """
+        profiles = list_profile_files(self.directory)
+        total = sum(size for _, _, size in profiles)
+        while profiles and (len(profiles) > self.max_files or total > self.max_bytes):
+            profile_id, _, size = profiles.pop()
+            total -= size
+            for extension in ('json', 'prof'):
+                try:
+                    os.remove(os.path.join(self.directory, f"{profile_id}.{extension}"))
+                except FileNotFoundError:
+                    pass  # Already rotated out by another process
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, sample_every=self.sample_every, max_per_minute=self.max_per_minute)
+
+def list_profile_files(directory):
+    """
+    Returns (profile ID, modified time, size of its files) for each profile in the directory, newest first.
+    """
+    profiles = []
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return profiles
+    sizes = {}
+    for entry in entries:
+        if entry.name.endswith('.prof'):
+            try:
+                sizes[entry.name[:-len('.prof')]] = entry.stat().st_size
+            except FileNotFoundError:
+                pass
+    for entry in entries:
+        if entry.name.endswith('.json'):
+            profile_id = entry.name[:-len('.json')]
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            profiles.append((profile_id, stat.st_mtime, stat.st_size + sizes.get(profile_id, 0)))
+    profiles.sort(key=lambda profile: profile[1], reverse=True)
+    return profiles
+
+def list_profiles(directory):
+    """
+    Returns a summary of each stored profile, newest first.
+    """
+    summaries = []
+    for profile_id, _, size in list_profile_files(directory):
+        try:
+            with open(os.path.join(directory, f"{profile_id}.json")) as file:
+                report = json.load(file)
+        except (FileNotFoundError, ValueError):
+            continue
+        summaries.append({
+            'id': profile_id,
+            'method': report['method'],
+            'path': report['path'],
+            'status': report['status'],
+            'trigger': report['trigger'],
+            'started_at': report['started_at'],
+            'duration_ms': report['duration_ms'],
+            'sections_ms': report['sections_ms'],
+            'statements': len(report['statements']),
+            'bytes': size,
+        })
+    return summaries
+
+def requested_by_admin():
+    """
+    Returns whether the current request carries a valid token of an admin. Invalid tokens are ignored
+    here and rejected by the view as usual.
+    """
+    try:
+        verify_jwt_in_request(optional=True)
+    except (JWTExtendedException, PyJWTError):
+        return False
+    user_id = get_jwt_identity()
+    return user_id is not None and is_admin(user_id)
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if getattr(active, 'profile', None) is not None:
+        conn.info.setdefault('profile_statement_started', []).append(perf_counter())
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = getattr(active, 'profile', None)
+    started = conn.info.get('profile_statement_started')
+    if profile is not None and started:
+        profile.record_statement(statement, perf_counter() - started.pop(), executemany)
+
+def init_profiler(app):
+    """
+    Registers the per-request profiler for the app, if PROFILER_ENABLED is set.
+
+    A request is profiled when an admin sends the X-Profile header, or when it is one of every
+    PROFILER_SAMPLE_EVERY requests. The profile ID is returned in the X-Profile-Id response header and
+    the profile can be downloaded from /profiles.
+    """
+    if not app.config["PROFILER_ENABLED"]:
+        return
+
+    profiler = RequestProfiler(
+        app.config["PROFILER_DIR"],
+        app.config["PROFILER_SAMPLE_EVERY"],
+        app.config["PROFILER_MAX_PER_MINUTE"],
+        app.config["PROFILER_MAX_FILES"],
+        app.config["PROFILER_MAX_DISK_MB"] * 1024 * 1024,
+        app.config["PROFILER_MAX_STATEMENTS"],
+    )
+    app.extensions['request_profiler'] = profiler
+
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+
+    @app.before_request
+    def start_profile():
+        if request.endpoint is None:
+            return
+        if request.headers.get(PROFILE_HEADER) and requested_by_admin():
+            trigger = 'header'
+        elif profiler.sampled():
+            trigger = 'sample'
+        else:
+            return
+        profile = profiler.begin(trigger)
+        if profile is not None:
+            g.request_profile = profile
+
+    @app.after_request
+    def finish_profile(response):
+        profile = g.pop('request_profile', None)
+        if profile is not None:
+            profiler.end(profile, response)
+            response.headers['X-Profile-Id'] = profile.id
+        return response
+
+    # Stops the profiler of a request that failed before reaching after_request
+    @app.teardown_request
+    def discard_profile(exc):
+        profile = g.pop('request_profile', None)
+        if profile is not None:
+            profiler.end(profile)
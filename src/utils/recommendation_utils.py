@@ -0,0 +1,272 @@
+import logging
+import os
+import tempfile
+from datetime import datetime
+from threading import Lock, Thread, Event
+from time import monotonic
+
+import numpy as np
+from sqlalchemy import bindparam, text
+
+from init import db
+from models.archived_booking import ArchivedBooking
+from models.attraction import Attraction
+from models.booking import Booking, booking_status
+
+logger = logging.getLogger(__name__)
+
+METRICS = ('cosine', 'cooccurrence')
+
+# Most (attraction, attraction) pairs generated at once, which bounds the memory a build uses
+PAIR_CHUNK_SIZE = 4_000_000
+
+# The attractions shown as related, and the attraction asked about (to tell if it exists)
+related_attractions_stmt = db.select(
+    Attraction.id, Attraction.name, Attraction.location, Attraction.ticket_price
+).where(Attraction.id.in_(bindparam('attraction_ids', expanding=True)))
+
+class RecommendationIndex:
+    """
+    The top related attractions of every attraction, held in flat arrays.
+
+    The related attractions of attraction `i` are related_ids[offsets[i]:offsets[i + 1]], best first,
+    with their scores at the same positions in `scores`. Offsets are indexed by attraction ID directly,
+    so a lookup is two array reads and a slice of at most K entries.
+    """
+    def __init__(self, offsets, related_ids, scores, metric, built_at):
+        self.offsets = offsets
+        self.related_ids = related_ids
+        self.scores = scores
+        self.metric = metric
+        self.built_at = built_at
+
+    def related(self, attraction_id, limit):
+        """
+        Returns the IDs and scores of up to `limit` attractions most often booked by the same users.
+        """
+        if attraction_id < 0 or attraction_id + 1 >= len(self.offsets):
+            return [], []
+        start = self.offsets[attraction_id]
+        end = min(self.offsets[attraction_id + 1], start + limit)
+        return self.related_ids[start:end].tolist(), self.scores[start:end].tolist()
+
+    def save(self, path):
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        # Written to a temporary file of its own and renamed, so processes reloading the index never read
+        # half a file, and two builds saving at once can't write to the same file
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f"{os.path.basename(path)}.", suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                np.savez(
+                    file, offsets=self.offsets, related_ids=self.related_ids, scores=self.scores,
+                    metric=np.array(self.metric), built_at=np.array(self.built_at),
+                )
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data['offsets'], data['related_ids'], data['scores'], str(data['metric']), str(data['built_at']))
+
+    def stats(self):
+        return {
+            'built_at': self.built_at,
+            'metric': self.metric,
+            'attractions': int(np.count_nonzero(np.diff(self.offsets))),
+            'pairs': len(self.related_ids),
+            'bytes': self.offsets.nbytes + self.related_ids.nbytes + self.scores.nbytes,
+        }
+
+def booked_pairs():
+    """
+    Returns the distinct (user ID, attraction ID) pairs of bookings that weren't cancelled, ordered by
+    user, as two arrays. Archived bookings are included, the same as in the rollups.
+    """
+    def rows(model):
+        return db.select(model.user_id, model.attraction_id).where(model.status != booking_status.CANCELLED)
+
+    # UNION rather than UNION ALL, so a pair booked both before and after archiving is counted once
+    history = db.union(rows(Booking), rows(ArchivedBooking)).subquery('history')
+    result = db.session.execute(
+        db.select(history.c.user_id, history.c.attraction_id)
+        .order_by(history.c.user_id)
+        .execution_options(yield_per=50000)
+    )
+    chunks = [np.array(rows, dtype=np.int64).reshape(-1, 2) for rows in result.partitions()]
+    pairs = np.concatenate(chunks) if chunks else np.empty((0, 2), dtype=np.int64)
+    return pairs[:, 0], pairs[:, 1]
+
+def cooccurrence_counts(users, columns, column_count):
+    """
+    Counts, for each ordered pair of different attraction columns, the users who booked both.
+
+    `users` is sorted, so each user's columns are a contiguous run. Every pair within a run is generated
+    with repeat/arange arithmetic, a few runs at a time, and pairs are counted by their key
+    (left * column_count + right). Returns the keys and counts.
+    """
+    run_starts = np.flatnonzero(np.r_[True, users[1:] != users[:-1]]) if len(users) else np.empty(0, dtype=np.int64)
+    run_lengths = np.diff(np.r_[run_starts, len(users)])
+    # Per booking pair: the start and length of its user's run
+    entry_starts = np.repeat(run_starts, run_lengths)
+    entry_lengths = np.repeat(run_lengths, run_lengths)
+
+    keys, counts = [], []
+    pairs_through_run = np.cumsum(run_lengths ** 2)
+    run = 0
+    while run < len(run_starts):
+        # The runs whose pairs fit in one chunk (at least one run, however large)
+        pairs_before = pairs_through_run[run] - run_lengths[run] ** 2
+        last = max(run + 1, int(np.searchsorted(pairs_through_run, pairs_before + PAIR_CHUNK_SIZE, side='right')))
+        first_entry, end_entry = run_starts[run], run_starts[last - 1] + run_lengths[last - 1]
+
+        lengths = entry_lengths[first_entry:end_entry]
+        left = np.repeat(columns[first_entry:end_entry], lengths)
+        position = np.arange(len(left)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        right = columns[np.repeat(entry_starts[first_entry:end_entry], lengths) + position]
+
+        different = left != right
+        chunk_keys, chunk_counts = np.unique(left[different] * column_count + right[different], return_counts=True)
+        keys.append(chunk_keys)
+        counts.append(chunk_counts)
+        run = last
+
+    if not keys:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    all_keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+    return all_keys, np.bincount(inverse.ravel(), weights=np.concatenate(counts)).astype(np.int64)
+
+def build_recommendation_index(top_k, metric='cosine'):
+    """
+    Builds the "also booked" index from every booking that wasn't cancelled.
+
+    Bookings form a sparse user x attraction matrix, and the attraction x attraction co-occurrence is
+    counted from it in vectorised form. With the cosine metric, counts are divided by the square root
+    of the product of both attractions' user counts, so popular attractions don't top every list.
+    The top_k highest scoring attractions of each attraction are kept. Returns the index and the number
+    of users it was built from.
+    """
+    if metric not in METRICS:
+        raise ValueError(f"metric must be one of: {', '.join(METRICS)}.")
+
+    users, attraction_ids = booked_pairs()
+    column_ids, columns = np.unique(attraction_ids, return_inverse=True)
+    columns = columns.ravel()
+    column_count = len(column_ids)
+
+    keys, counts = cooccurrence_counts(users, columns, column_count)
+    left, right = keys // column_count, keys % column_count
+    if metric == 'cosine':
+        users_per_column = np.bincount(columns, minlength=column_count)
+        scores = counts / np.sqrt(users_per_column[left] * users_per_column[right])
+    else:
+        scores = counts.astype(np.float64)
+
+    # Sorted by attraction, then best score first (ties by the lower ID), keeping the first top_k of each
+    order = np.lexsort((right, -scores, left))
+    left, right, scores = left[order], right[order], scores[order]
+    group_starts = np.flatnonzero(np.r_[True, left[1:] != left[:-1]]) if len(left) else np.empty(0, dtype=np.int64)
+    rank = np.arange(len(left)) - np.repeat(group_starts, np.diff(np.r_[group_starts, len(left)]))
+    keep = rank < top_k
+
+    source_ids = column_ids[left[keep]]
+    max_id = int(column_ids[-1]) if column_count else 0
+    offsets = np.r_[0, np.cumsum(np.bincount(source_ids, minlength=max_id + 1))].astype(np.int64)
+    return RecommendationIndex(
+        offsets,
+        column_ids[right[keep]].astype(np.int32),
+        scores[keep].astype(np.float32),
+        metric,
+        datetime.utcnow().isoformat(timespec='seconds'),
+    ), len(np.unique(users))
+
+class RecommendationStore:
+    """
+    The index loaded by an API process. The index file is checked at most every `reload_seconds`, and
+    reloaded when it has been rebuilt, by this process or another.
+    """
+    def __init__(self, path, reload_seconds):
+        self.path = path
+        self.reload_seconds = reload_seconds
+        self.index = None
+        self.modified = None
+        self.checked = None
+        self.lock = Lock()
+
+    def get(self):
+        now = monotonic()
+        if self.checked is not None and now - self.checked < self.reload_seconds:
+            return self.index
+        with self.lock:
+            if self.checked is None or now - self.checked >= self.reload_seconds:
+                self.checked = now
+                try:
+                    modified = os.stat(self.path).st_mtime
+                    if modified != self.modified:
+                        self.index = RecommendationIndex.load(self.path)
+                        self.modified = modified
+                except FileNotFoundError:
+                    pass  # Not built yet
+                except (OSError, ValueError, KeyError):
+                    logger.exception("Couldn't load the recommendation index")
+        return self.index
+
+    def stats(self):
+        index = self.get()
+        return index.stats() if index is not None else None
+
+def refresh_recommendations(app):
+    """
+    Rebuilds the index and saves it where every API process picks it up.
+    Returns the index and the number of users it was built from.
+    """
+    index, user_count = build_recommendation_index(app.config["RECOMMENDATIONS_TOP_K"], app.config["RECOMMENDATIONS_METRIC"])
+    index.save(app.config["RECOMMENDATIONS_PATH"])
+    return index, user_count
+
+def init_recommendations(app):
+    app.extensions['recommendations'] = RecommendationStore(
+        app.config["RECOMMENDATIONS_PATH"], app.config["RECOMMENDATIONS_RELOAD_SECONDS"]
+    )
+
+def start_recommendation_thread(app):
+    """
+    Starts a daemon thread that rebuilds the index every RECOMMENDATIONS_REFRESH_SECONDS.
+    Does nothing if the interval isn't configured. Returns the Event used to stop the thread.
+
+    Every worker process runs the thread, so only the process that gets a Postgres advisory lock
+    rebuilds, and only if no other process has since the last interval. That is checked again once the
+    lock is held, since another process may have finished a rebuild and released the lock in between.
+    """
+    interval = app.config["RECOMMENDATIONS_REFRESH_SECONDS"]
+    if not interval:
+        return None
+
+    stop_event = Event()
+
+    def rebuilt_recently():
+        path = app.config["RECOMMENDATIONS_PATH"]
+        return os.path.exists(path) and datetime.now().timestamp() - os.stat(path).st_mtime < interval
+
+    def run():
+        while not stop_event.wait(interval):
+            try:
+                if rebuilt_recently():
+                    continue
+                with app.app_context():
+                    # Held until the session's transaction ends with the app context
+                    if not db.session.scalar(text("SELECT pg_try_advisory_xact_lock(hashtext('recommendations'))")):
+                        continue
+                    if rebuilt_recently():
+                        continue
+                    index, user_count = refresh_recommendations(app)
+                logger.info("Recommendations rebuilt from %s users: %s related pairs", user_count, len(index.related_ids))
+            except Exception:
+                logger.exception("Recommendation rebuild failed")
+
+    Thread(target=run, name='recommendations', daemon=True).start()
+    return stop_event
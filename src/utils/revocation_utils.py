@@ -0,0 +1,197 @@
+import hashlib
+import logging
+import math
+from datetime import datetime, timedelta, timezone
+from threading import Event, Lock, Thread
+from time import monotonic
+
+from sqlalchemy import event, text
+from sqlalchemy.dialects.postgresql import insert
+
+from init import db, jwt
+from models.revoked_token import RevokedToken
+from utils.background_utils import register_background_worker
+
+logger = logging.getLogger(__name__)
+
+# Postgres channel that carries the key of each revocation when it commits, to every API process
+REVOCATIONS_CHANNEL = 'revoked_tokens'
+
+# Lifetime of access tokens issued at login. Revocation entries are kept for this long.
+ACCESS_TOKEN_LIFETIME = timedelta(days=1)
+
+class BloomFilter:
+    """
+    A fixed-size Bloom filter of strings.
+
+    `might_contain` never returns False for a key that was added, and returns True for a key that wasn't
+    added with a probability of about `error_rate` when holding `capacity` keys.
+    """
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hash_count = max(round(self.size / capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        # Derives every bit position from two hashes (Kirsch-Mitzenmacher double hashing)
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def might_contain(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+class RevocationList:
+    """
+    A per-process Bloom filter of revoked token keys, backed by the revoked_tokens table.
+
+    Checking a token only hashes its keys against the filter. The database is only queried when the filter
+    reports a possible match, which happens for revoked tokens and for a small share of false positives.
+
+    Revocations are added to the filter of every process once committed, through Postgres notifications
+    (see utils/availability_utils.py). As a fallback for any notification missed, a background thread
+    rebuilds the filter from the table every REVOCATION_REFRESH_SECONDS. Added keys are kept until the next
+    rebuild starts, so a rebuild that read the table before they were committed still includes them.
+    """
+    def __init__(self):
+        self.filter = BloomFilter(0)
+        self.built_at = None
+        self.lock = Lock()
+        # Keys added since the last rebuild started, with the time they were added
+        self.recent = {}
+        self.recent_lock = Lock()
+
+    def rebuild(self):
+        started = monotonic()
+        now = datetime.utcnow()
+        count = db.session.scalar(db.select(db.func.count()).where(RevokedToken.expires_at > now))
+        # Sized with room to grow, so revocations added until the next rebuild keep the error rate low
+        new_filter = BloomFilter(count * 2 + 1024)
+        keys = db.session.scalars(
+            db.select(RevokedToken.key).where(RevokedToken.expires_at > now).execution_options(yield_per=5000)
+        )
+        for key in keys:
+            new_filter.add(key)
+        with self.recent_lock:
+            # Keys added before the rebuild started were committed before the table was read
+            self.recent = {key: added for key, added in self.recent.items() if added >= started}
+            for key in self.recent:
+                new_filter.add(key)
+            self.filter = new_filter
+        self.built_at = monotonic()
+
+    def ensure_built(self):
+        # Only the first check in a process builds the filter, later rebuilds run in the background
+        if self.built_at is None:
+            with self.lock:
+                if self.built_at is None:
+                    self.rebuild()
+
+    def add(self, key):
+        with self.recent_lock:
+            self.filter.add(key)
+            self.recent[key] = monotonic()
+
+    def is_revoked(self, jwt_payload):
+        self.ensure_built()
+        candidates = [
+            key for key in (f"jti:{jwt_payload['jti']}", f"user:{jwt_payload['sub']}")
+            if self.filter.might_contain(key)
+        ]
+        if not candidates:
+            return False
+
+        entries = db.session.scalars(
+            db.select(RevokedToken).where(RevokedToken.key.in_(candidates), RevokedToken.expires_at > datetime.utcnow())
+        )
+        for entry in entries:
+            if entry.key.startswith('jti:'):
+                return True
+            # A user-wide entry only covers tokens issued at or before the revocation
+            if jwt_payload['iat'] <= entry.revoked_at.replace(tzinfo=timezone.utc).timestamp():
+                return True
+        return False
+
+revocation_list = RevocationList()
+
+@jwt.token_in_blocklist_loader
+def token_is_revoked(jwt_header, jwt_payload):
+    return revocation_list.is_revoked(jwt_payload)
+
+def revoke(key, expires_at):
+    """
+    Records a revocation entry in the current transaction, which adds it to this process's filter once
+    committed, and notifies the other processes when it commits. Revoking an already revoked key moves
+    its revocation time forward.
+    """
+    now = datetime.utcnow()
+    stmt = insert(RevokedToken).values(key=key, revoked_at=now, expires_at=expires_at)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[RevokedToken.key],
+        set_={'revoked_at': stmt.excluded.revoked_at, 'expires_at': stmt.excluded.expires_at}
+    )
+    db.session.execute(stmt)
+    db.session.execute(text("SELECT pg_notify(:channel, :key)"), {'channel': REVOCATIONS_CHANNEL, 'key': key})
+    db.session.info.setdefault('revoked_keys', []).append(key)
+
+@event.listens_for(db.session, 'after_commit')
+def add_committed_revocations(session):
+    for key in session.info.pop('revoked_keys', ()):
+        revocation_list.add(key)
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_rolled_back_revocations(session):
+    session.info.pop('revoked_keys', None)
+
+def revoke_token(jwt_payload):
+    """
+    Revokes a single token, until the time it would have expired anyway.
+    """
+    revoke(f"jti:{jwt_payload['jti']}", datetime.utcfromtimestamp(jwt_payload['exp']))
+
+def revoke_user_tokens(user_id):
+    """
+    Revokes every token issued to a user up to now.
+    """
+    revoke(f"user:{user_id}", datetime.utcnow() + ACCESS_TOKEN_LIFETIME)
+
+def start_revocation_refresher(app):
+    """
+    Starts a daemon thread that rebuilds the revoked token filter every REVOCATION_REFRESH_SECONDS.
+    Returns the Event used to stop the thread.
+    """
+    stop_event = Event()
+    interval = app.config["REVOCATION_REFRESH_SECONDS"]
+
+    def run():
+        while not stop_event.wait(interval):
+            try:
+                with app.app_context():
+                    with revocation_list.lock:
+                        revocation_list.rebuild()
+            except Exception:
+                logger.exception("Revoked token filter rebuild failed")
+
+    Thread(target=run, name='revocation-refresher', daemon=True).start()
+    return stop_event
+
+def init_revocations(app):
+    """
+    Registers the background rebuild of the revoked token filter. The revoked token check itself is
+    registered with the JWT manager when this module is imported.
+    """
+    register_background_worker(app, start_revocation_refresher)
+
+def purge_expired_revocations():
+    """
+    Deletes revocation entries for tokens that have expired anyway. Returns the number deleted.
+    """
+    result = db.session.execute(db.delete(RevokedToken).where(RevokedToken.expires_at <= datetime.utcnow()))
+    db.session.commit()
+    return result.rowcount
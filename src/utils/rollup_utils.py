@@ -0,0 +1,150 @@
+from collections import defaultdict
+
+from sqlalchemy.dialects.postgresql import insert
+
+from init import db
+from models.booking import Booking, booking_status
+from models.booking_rollup import BookingRollup
+from models.archived_booking import ArchivedBooking
+
+def booking_snapshot(booking):
+    """
+    Captures the values of a booking that contribute to the daily rollups, so the old
+    contribution can be removed after the booking has been changed.
+    """
+    return {
+        'day': booking.booking_date.date(),
+        'attraction_id': booking.attraction_id,
+        'status': booking.status,
+        'number_of_guests': booking.number_of_guests,
+        'total_cost': booking.total_cost or 0,
+    }
+
+def apply_rollup_deltas(deltas):
+    """
+    Adds the given changes to the daily rollups in a single multi-row upsert.
+
+    `deltas` maps (day, attraction_id) to a (bookings, guests, revenue) tuple of amounts to add
+    (negative to remove). Runs in the caller's transaction so the rollups commit together with the bookings.
+    """
+    rows = [
+        {'day': day, 'attraction_id': attraction_id, 'bookings': bookings, 'guests': guests, 'revenue': revenue}
+        for (day, attraction_id), (bookings, guests, revenue) in deltas.items()
+        if bookings or guests or revenue
+    ]
+    if not rows:
+        return
+
+    stmt = insert(BookingRollup).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[BookingRollup.day, BookingRollup.attraction_id],
+        set_={
+            'bookings': BookingRollup.bookings + stmt.excluded.bookings,
+            'guests': BookingRollup.guests + stmt.excluded.guests,
+            'revenue': BookingRollup.revenue + stmt.excluded.revenue,
+        }
+    )
+    db.session.execute(stmt)
+
+def record_booking_change(before=None, after=None):
+    """
+    Updates the daily rollups for a created (no `before`), updated, or deleted (no `after`) booking.
+
+    `before` and `after` are snapshots from `booking_snapshot`. Cancelled bookings don't count towards the
+    rollups, so cancelling a booking removes it and reinstating it adds it back.
+    """
+    deltas = defaultdict(lambda: (0, 0, 0))
+    for snapshot, sign in ((before, -1), (after, 1)):
+        if snapshot is None or snapshot['status'] == booking_status.CANCELLED:
+            continue
+        key = (snapshot['day'], snapshot['attraction_id'])
+        bookings, guests, revenue = deltas[key]
+        deltas[key] = (
+            bookings + sign,
+            guests + sign * snapshot['number_of_guests'],
+            revenue + sign * snapshot['total_cost'],
+        )
+    apply_rollup_deltas(deltas)
+
+def record_bulk_change(bookings, sign):
+    """
+    Adds (`sign` 1) or removes (`sign` -1) a set of active bookings from the daily rollups in one upsert.
+
+    `bookings` can be any rows with booking_date, attraction_id, number_of_guests and total_cost,
+    such as the rows returned by a bulk UPDATE ... RETURNING.
+    """
+    deltas = defaultdict(lambda: (0, 0, 0))
+    for booking in bookings:
+        key = (booking.booking_date.date(), booking.attraction_id)
+        count, guests, revenue = deltas[key]
+        deltas[key] = (
+            count + sign,
+            guests + sign * booking.number_of_guests,
+            revenue + sign * (booking.total_cost or 0),
+        )
+    apply_rollup_deltas(deltas)
+
+def booking_history(user_id=None):
+    """
+    Builds a subquery of the active (not cancelled) bookings and archived bookings, optionally of one user only.
+    Archived bookings still count towards the rollups.
+    """
+    def rows(model):
+        stmt = (
+            db.select(model.attraction_id, model.booking_date, model.number_of_guests, model.total_cost)
+            .where(model.status != booking_status.CANCELLED)
+        )
+        if user_id is not None:
+            stmt = stmt.where(model.user_id == user_id)
+        return stmt
+
+    return db.union_all(rows(Booking), rows(ArchivedBooking)).subquery('history')
+
+def remove_user_from_rollups(user_id):
+    """
+    Removes all of a user's active and archived bookings from the daily rollups with a single
+    INSERT ... SELECT ... GROUP BY ... ON CONFLICT statement. Used before deleting the user.
+    """
+    history = booking_history(user_id)
+    day = db.func.date(history.c.booking_date)
+    totals = (
+        db.select(
+            day, history.c.attraction_id, -db.func.count(),
+            -db.func.sum(history.c.number_of_guests), -db.func.coalesce(db.func.sum(history.c.total_cost), 0)
+        )
+        .group_by(day, history.c.attraction_id)
+    )
+    stmt = insert(BookingRollup).from_select(['day', 'attraction_id', 'bookings', 'guests', 'revenue'], totals)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[BookingRollup.day, BookingRollup.attraction_id],
+        set_={
+            'bookings': BookingRollup.bookings + stmt.excluded.bookings,
+            'guests': BookingRollup.guests + stmt.excluded.guests,
+            'revenue': BookingRollup.revenue + stmt.excluded.revenue,
+        }
+    )
+    db.session.execute(stmt)
+
+def rebuild_booking_rollups():
+    """
+    Recalculates every daily rollup from the bookings and archived bookings tables in one transaction.
+    Used to initialise the rollups for existing data or to repair them.
+    """
+    history = booking_history()
+    day = db.func.date(history.c.booking_date)
+    totals = (
+        db.select(
+            day, history.c.attraction_id, db.func.count(),
+            db.func.sum(history.c.number_of_guests), db.func.coalesce(db.func.sum(history.c.total_cost), 0)
+        )
+        .group_by(day, history.c.attraction_id)
+    )
+
+    db.session.execute(db.delete(BookingRollup))
+    result = db.session.execute(
+        db.insert(BookingRollup).from_select(
+            ['day', 'attraction_id', 'bookings', 'guests', 'revenue'], totals
+        )
+    )
+    db.session.commit()
+    return result.rowcount
@@ -1,8 +1,34 @@
 from datetime import datetime, timedelta
 
+from sqlalchemy import bindparam
+
 from models.user import User
 from models.booking import Booking
 from init import db
+from utils.audit_utils import audit
+
+# The checks run for every new booking, so their statements are built once with bound parameters and reused,
+# along with their cache key, rather than rebuilt by each request.
+#
+# They count a user's bookings created since a threshold time. They deliberately don't also filter on booking_date,
+# which would let a partitioned bookings table skip earlier months but miss bookings an admin has moved to an
+# earlier date.
+recent_bookings_conditions = (
+    Booking.user_id == bindparam('user_id'),
+    Booking.created_at >= bindparam('threshold_time'),
+)
+requested_bookings_count_stmt = (
+    db.select(db.func.count())
+    .select_from(Booking)
+    .where(*recent_bookings_conditions, Booking.status == 'Requested')
+)
+recent_bookings_cost_stmt = db.select(db.func.sum(Booking.total_cost)).where(*recent_bookings_conditions)
+
+def recent_bookings_params(user_id, threshold_time):
+    """
+    The parameters of the statements above for a user's bookings created since `threshold_time`.
+    """
+    return {'user_id': user_id, 'threshold_time': threshold_time}
 
 def is_rate_limited(user_id):
     """
@@ -15,23 +41,21 @@ def is_rate_limited(user_id):
     verify them  and unlock their account, then change the status of their bookings to either "Confirmed" 
     or "Cancelled". The user is then able to proceed with more bookings.
     """
-    user = User.query.get(user_id)
+    user = db.session.get(User, user_id)
     # Check if user is already locked
     if user.is_locked:
         return True
 
     # Check bookings made in the past 24 hours and are in "Requested" status
     threshold_time = datetime.utcnow() - timedelta(days=1)
-    bookings_count = Booking.query.filter(
-        Booking.user_id == user_id,
-        Booking.status == 'Requested',  # Only counts bookings that are in "Requested" status
-        Booking.created_at >= threshold_time
-    ).count()
+    # Only counts bookings that are in "Requested" status
+    bookings_count = db.session.scalar(requested_bookings_count_stmt, recent_bookings_params(user_id, threshold_time))
 
     # Lock the user if they have made 5 or more bookings in "Requested" status
     if bookings_count >= 5:
         user.is_locked = True
         db.session.commit()
+        audit('user.locked', 'user', user_id, {'reason': 'rate_limit', 'requested_bookings': bookings_count})
         return True
 
     return False
@@ -39,8 +63,6 @@ def is_rate_limited(user_id):
 def exceeded_booking_cost_limit(user_id, cost_limit=2500):
     """Check if the total cost of bookings made by a user in the last 24 hours exceeds the cost limit of $2500."""
     threshold_time = datetime.utcnow() - timedelta(days=1)
-    total_cost = db.session.query(db.func.sum(Booking.total_cost))\
-                .filter(Booking.user_id == user_id, Booking.created_at >= threshold_time)\
-                .scalar() or 0
+    total_cost = db.session.scalar(recent_bookings_cost_stmt, recent_bookings_params(user_id, threshold_time)) or 0
     print(f"Total cost calculated for user {user_id} in the last 24 hours: {total_cost}")
     return total_cost >= cost_limit
\ No newline at end of file
@@ -0,0 +1,187 @@
+import fcntl
+import logging
+import mmap
+import os
+from threading import Lock, Thread, Event
+
+import numpy as np
+
+from init import db
+from models.attraction import Attraction
+from utils.background_utils import register_background_worker
+
+logger = logging.getLogger(__name__)
+
+class SlotCounters:
+    """
+    The available slots of each attraction, in a memory-mapped file shared by every API process on the host.
+
+    The file holds two arrays of 32-bit integers indexed by attraction ID: the slots plus one (so the zeros
+    of a new file mean "not known yet"), and the attraction version the slots were read at. Reading a
+    counter is a plain memory read, with no lock or database query. The same memory is also viewed as
+    NumPy arrays, for the operations that go over every counter.
+
+    Counters are written from the database (see refresh_slot_counters) and from the slot change
+    notifications every process receives (see utils/availability_utils.py). Writes hold a lock on the
+    file and only ever move a counter to a newer version, so notifications handled late by one process
+    can't overwrite a newer count written by another. The counters are only a hint for rejecting
+    bookings early. The database stays authoritative, and reserve_slots still checks every booking.
+    """
+    def __init__(self, path, capacity):
+        self.path = path
+        self.capacity = capacity
+        self.rejected = 0
+        self.lock = Lock()
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = capacity * 2 * 4
+        with self.locked():
+            # Only ever grown, as other processes may have the file mapped at its current size
+            if os.fstat(self.fd).st_size < size:
+                os.ftruncate(self.fd, size)
+        self.map = mmap.mmap(self.fd, size)
+        counters = memoryview(self.map).cast('i')
+        self.slots = counters[:capacity]
+        self.versions = counters[capacity:]
+        arrays = np.frombuffer(self.map, dtype=np.intc)
+        self.slot_array = arrays[:capacity]
+        self.version_array = arrays[capacity:]
+
+    def locked(self):
+        return FileLock(self.fd, self.lock)
+
+    def available(self, attraction_id):
+        """
+        Returns the last known available slots of an attraction, or None if they aren't known.
+        """
+        if not 0 <= attraction_id < self.capacity:
+            return None
+        value = self.slots[attraction_id]
+        return value - 1 if value else None
+
+    def update(self, changes, replacing=None):
+        """
+        Writes (attraction ID, available slots, version) changes, skipping any older than the stored version.
+        Returns {attraction ID: stored version} of the skipped changes.
+
+        `replacing` ({attraction ID: stored version}) instead overwrites counters still at those versions,
+        whatever the version of the change.
+        """
+        skipped = {}
+        with self.locked():
+            for attraction_id, available_slots, version in changes:
+                if not 0 <= attraction_id < self.capacity:
+                    continue
+                stored = self.versions[attraction_id]
+                if version >= stored if replacing is None else replacing.get(attraction_id) == stored:
+                    self.slots[attraction_id] = max(available_slots, 0) + 1
+                    self.versions[attraction_id] = version
+                else:
+                    skipped[attraction_id] = stored
+        return skipped
+
+    def forget_except(self, attraction_ids):
+        """
+        Marks the counters of every attraction not in `attraction_ids` as not known.
+        """
+        keep = np.fromiter(attraction_ids, dtype=np.int64, count=len(attraction_ids))
+        with self.locked():
+            forgotten = np.setdiff1d(np.flatnonzero(self.version_array), keep, assume_unique=True)
+            self.slot_array[forgotten] = 0
+            self.version_array[forgotten] = 0
+
+    def stats(self):
+        return {
+            'capacity': self.capacity,
+            'known': int(np.count_nonzero(self.slot_array)),
+            'sold_out': int(np.count_nonzero(self.slot_array == 1)),
+            'rejected': self.rejected,
+        }
+
+class FileLock:
+    """
+    Holds a thread lock and an exclusive lock on a file, so one writer at a time across threads and processes.
+    Record locks (lockf) are used because they belong to the process, unlike flock locks, which forked
+    workers would share with the master through the inherited file descriptor.
+    """
+    def __init__(self, fd, lock):
+        self.fd = fd
+        self.lock = lock
+
+    def __enter__(self):
+        self.lock.acquire()
+        fcntl.lockf(self.fd, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc):
+        fcntl.lockf(self.fd, fcntl.LOCK_UN)
+        self.lock.release()
+
+def sold_out(counters, attraction_id, guests):
+    """
+    Returns True if the counters show an attraction without enough slots left for `guests`.
+    Unknown attractions and invalid values are left for the usual checks.
+    """
+    if counters is None or not isinstance(attraction_id, int) or not isinstance(guests, int):
+        return False
+    available = counters.available(attraction_id)
+    if available is None or available >= guests:
+        return False
+    counters.rejected += 1
+    return True
+
+def refresh_slot_counters(counters):
+    """
+    Writes the current slots of every attraction from the database to the counters.
+
+    A counter newer than the database is normally a change notified while the slots were being read,
+    and is kept. If the database is still behind it when read again, the counter can't be right (such
+    as after the database was recreated, restarting the versions), so it is replaced.
+    """
+    rows = db.session.execute(
+        db.select(Attraction.id, Attraction.available_slots, Attraction.version_id)
+        .where(Attraction.id < counters.capacity)
+    ).all()
+    ahead = counters.update(rows)
+    if ahead:
+        replaced = db.session.execute(
+            db.select(Attraction.id, Attraction.available_slots, Attraction.version_id)
+            .where(Attraction.id.in_(ahead))
+        ).all()
+        counters.update(replaced, replacing=ahead)
+    # Attractions deleted since their counter was written are no longer known
+    counters.forget_except({row.id for row in rows})
+
+def start_slot_counter_refresher(app):
+    """
+    Starts a daemon thread that refreshes the counters from the database straight away and then every
+    SLOT_COUNTERS_REFRESH_SECONDS, covering attractions created since and any notification missed.
+    Returns the Event used to stop the thread.
+    """
+    counters = app.extensions.get('slot_counters')
+    if counters is None:
+        return None
+
+    stop_event = Event()
+    interval = app.config["SLOT_COUNTERS_REFRESH_SECONDS"]
+
+    def run():
+        while True:
+            try:
+                with app.app_context():
+                    refresh_slot_counters(counters)
+            except Exception:
+                logger.exception("Slot counter refresh failed")
+            if stop_event.wait(interval):
+                return
+
+    Thread(target=run, name='slot-counters', daemon=True).start()
+    return stop_event
+
+def init_slot_counters(app):
+    """
+    Maps the shared slot counters for the app, if SLOT_COUNTERS is set, and registers their refresh
+    as a background worker. Forked worker processes share the mapping of the process that created the app.
+    """
+    if not app.config["SLOT_COUNTERS"]:
+        return
+    app.extensions['slot_counters'] = SlotCounters(app.config["SLOT_COUNTERS_PATH"], app.config["SLOT_COUNTERS_CAPACITY"])
+    register_background_worker(app, start_slot_counter_refresher)
@@ -0,0 +1,82 @@
+from sqlalchemy import values, column, Integer
+
+from init import db
+from models.attraction import Attraction
+from models.booking import Booking, booking_status
+
+# Slot changes are made with UPDATE statements rather than through the ORM, so they also increment
+# version_id themselves. This keeps an admin edit based on an older copy of the attraction from
+# overwriting them (see Attraction.__mapper_args__).
+
+def holds_slots(status):
+    """
+    Returns True if a booking with this status takes up slots on its attraction.
+    Cancelled bookings give their slots back.
+    """
+    return status != booking_status.CANCELLED
+
+def reserve_slots(attraction_id, guests):
+    """
+    Takes `guests` slots from an attraction in a single conditional UPDATE, so concurrent
+    bookings can't take more slots than are available.
+
+    Returns True if the slots were reserved, False if the attraction doesn't have enough left.
+    """
+    result = db.session.execute(
+        db.update(Attraction)
+        .where(Attraction.id == attraction_id, Attraction.available_slots >= guests)
+        .values(available_slots=Attraction.available_slots - guests, version_id=Attraction.version_id + 1)
+    )
+    return result.rowcount == 1
+
+def release_slots(attraction_id, guests):
+    """
+    Gives `guests` slots back to an attraction.
+    """
+    db.session.execute(
+        db.update(Attraction)
+        .where(Attraction.id == attraction_id)
+        .values(available_slots=Attraction.available_slots + guests, version_id=Attraction.version_id + 1)
+    )
+
+def adjust_slots_bulk(deltas):
+    """
+    Applies slot changes to many attractions with one UPDATE ... FROM (VALUES ...) statement.
+
+    `deltas` maps attraction IDs to the number of slots to add (negative to take slots). An attraction
+    is left unchanged if taking its slots would leave it below zero.
+    Returns the set of attraction IDs that were updated.
+    """
+    rows = [(attraction_id, delta) for attraction_id, delta in sorted(deltas.items()) if delta]
+    if not rows:
+        return set()
+
+    changes = values(
+        column('attraction_id', Integer), column('delta', Integer), name='slot_changes'
+    ).data(rows)
+    result = db.session.execute(
+        db.update(Attraction)
+        .where(Attraction.id == changes.c.attraction_id, Attraction.available_slots + changes.c.delta >= 0)
+        .values(available_slots=Attraction.available_slots + changes.c.delta, version_id=Attraction.version_id + 1)
+        .returning(Attraction.id)
+        .execution_options(synchronize_session=False)
+    )
+    return set(result.scalars())
+
+def release_user_slots(user_id):
+    """
+    Gives back the slots held by all of a user's active bookings, with one
+    UPDATE ... FROM (SELECT ... GROUP BY attraction_id) statement. Used before deleting the user.
+    """
+    held = (
+        db.select(Booking.attraction_id, db.func.sum(Booking.number_of_guests).label('guests'))
+        .where(Booking.user_id == user_id, Booking.status != booking_status.CANCELLED)
+        .group_by(Booking.attraction_id)
+        .subquery('held')
+    )
+    db.session.execute(
+        db.update(Attraction)
+        .where(Attraction.id == held.c.attraction_id)
+        .values(available_slots=Attraction.available_slots + held.c.guests, version_id=Attraction.version_id + 1)
+        .execution_options(synchronize_session=False)
+    )
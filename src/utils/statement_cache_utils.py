@@ -0,0 +1,59 @@
+from threading import Lock
+
+from sqlalchemy import event
+from sqlalchemy.engine.interfaces import CacheStats
+from sqlalchemy.util import LRUCache
+
+from init import db
+
+# Compiled statements kept per engine, the same as SQLAlchemy's default query_cache_size
+STATEMENT_CACHE_SIZE = 500
+
+class StatementCacheStats:
+    """
+    Counts how often statements run by the app were found compiled in SQLAlchemy's statement cache.
+
+    A miss means the statement was compiled to SQL again, which is what the prebuilt statements (such as
+    user_is_admin_stmt in auth_utils) avoid. Statements without a cache key, such as text() statements
+    with no parameters, are counted separately and left out of the hit ratio.
+
+    The cache itself is owned here and given to the engine with the compiled_cache execution option, so its
+    size can be reported without reaching into the engine.
+    """
+    def __init__(self, capacity=STATEMENT_CACHE_SIZE):
+        self.counts = {'hits': 0, 'misses': 0, 'uncached': 0}
+        self.lock = Lock()
+        self.cache = LRUCache(capacity)
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        if context is None:
+            return
+        if context.cache_hit is CacheStats.CACHE_HIT:
+            name = 'hits'
+        elif context.cache_hit is CacheStats.CACHE_MISS:
+            name = 'misses'
+        else:
+            name = 'uncached'
+        with self.lock:
+            self.counts[name] += 1
+
+    def stats(self):
+        with self.lock:
+            counts = dict(self.counts)
+        cached = counts['hits'] + counts['misses']
+        counts['hit_ratio'] = round(counts['hits'] / cached, 4) if cached else None
+        counts['cache_entries'] = len(self.cache)
+        counts['cache_capacity'] = self.cache.capacity
+        return counts
+
+def init_statement_cache_stats(app):
+    """
+    Gives the app's database engine a statement cache of its own, and counts its hits and misses.
+    Other engines (binds) keep SQLAlchemy's cache, and only their hits and misses are counted.
+    """
+    cache_stats = StatementCacheStats()
+    app.extensions['statement_cache_stats'] = cache_stats
+    with app.app_context():
+        db.engine.update_execution_options(compiled_cache=cache_stats.cache)
+        for engine in db.engines.values():
+            event.listen(engine, 'after_cursor_execute', cache_stats.record)
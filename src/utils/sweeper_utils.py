@@ -0,0 +1,154 @@
+import logging
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from time import monotonic
+from threading import Lock, Thread, Event
+
+from flask import current_app
+
+from init import db
+from models.booking import Booking, booking_status
+from utils.slot_utils import adjust_slots_bulk
+from utils.rollup_utils import record_bulk_change
+from utils.audit_utils import audit_status_changes
+
+logger = logging.getLogger(__name__)
+
+# Running totals for every sweep made by this process
+sweeper_metrics = {
+    'runs': 0,
+    'batches': 0,
+    'bookings_expired': 0,
+    'slots_released': 0,
+    'last_run_at': None,
+    'last_run_seconds': None,
+}
+_metrics_lock = Lock()
+
+def stale_booking_filter(now=None):
+    """
+    Matches "Requested" bookings whose booking date has passed, or that have not been
+    confirmed within REQUESTED_BOOKING_TTL_HOURS of being made.
+    """
+    now = now or datetime.utcnow()
+    ttl = timedelta(hours=current_app.config["REQUESTED_BOOKING_TTL_HOURS"])
+    return db.and_(
+        Booking.status == booking_status.REQUESTED,
+        db.or_(
+            Booking.booking_date < datetime.combine(now.date(), time.min),
+            Booking.created_at < now - ttl,
+        )
+    )
+
+def expire_stale_batch(batch_size, now=None):
+    """
+    Cancels up to `batch_size` stale bookings and gives their slots back in one short transaction.
+
+    Bookings are claimed with FOR UPDATE SKIP LOCKED, so the sweep never waits on (or blocks) bookings
+    being changed by requests, and only the claimed bookings and their attractions are locked.
+    Slots are returned with one UPDATE ... FROM (VALUES ...) for all attractions in the batch.
+
+    The UPDATE checks the bookings are still stale, and only the rows it changed are returned, so bookings
+    another sweeper (in another process) expired first are neither counted nor released twice.
+
+    Returns a tuple of (bookings expired, slots released).
+    """
+    stale = stale_booking_filter(now)
+    # A CTE, so the claiming query (and its row locks) runs once rather than once per booking compared
+    claimed = (
+        db.select(Booking.id)
+        .where(stale)
+        .order_by(Booking.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+        .cte('claimed')
+    )
+    expired = db.session.execute(
+        db.update(Booking)
+        .where(Booking.id == claimed.c.id, stale)
+        .values(status=booking_status.CANCELLED, version_id=Booking.version_id + 1)
+        .returning(Booking.id, Booking.attraction_id, Booking.number_of_guests, Booking.booking_date, Booking.total_cost)
+        .execution_options(synchronize_session=False)
+    ).all()
+    if not expired:
+        db.session.rollback()
+        return 0, 0
+
+    released = defaultdict(int)
+    for booking in expired:
+        released[booking.attraction_id] += booking.number_of_guests
+    adjust_slots_bulk(released)
+    record_bulk_change(expired, -1)
+    db.session.commit()
+    audit_status_changes(
+        [(booking.id, booking_status.REQUESTED) for booking in expired], booking_status.CANCELLED, 'expired'
+    )
+
+    return len(expired), sum(released.values())
+
+def preview_stale_bookings(now=None):
+    """
+    Counts the bookings, slots and attractions a sweep would affect, without changing or locking anything.
+    """
+    bookings, slots, attractions = db.session.execute(
+        db.select(
+            db.func.count(Booking.id),
+            db.func.coalesce(db.func.sum(Booking.number_of_guests), 0),
+            db.func.count(db.distinct(Booking.attraction_id)),
+        ).where(stale_booking_filter(now))
+    ).one()
+    return {'bookings': bookings, 'slots': slots, 'attractions': attractions}
+
+def sweep_stale_bookings(batch_size=None, max_batches=None):
+    """
+    Expires stale bookings batch by batch until none are left (or `max_batches` have run),
+    committing after every batch so locks are only ever held on one batch at a time.
+
+    Returns the metrics for this run and adds them to `sweeper_metrics`.
+    """
+    batch_size = batch_size or current_app.config["SWEEPER_BATCH_SIZE"]
+    started = monotonic()
+    now = datetime.utcnow()
+    run = {'batches': 0, 'bookings_expired': 0, 'slots_released': 0}
+
+    while max_batches is None or run['batches'] < max_batches:
+        expired, released = expire_stale_batch(batch_size, now)
+        if not expired:
+            break
+        run['batches'] += 1
+        run['bookings_expired'] += expired
+        run['slots_released'] += released
+
+    run['seconds'] = round(monotonic() - started, 3)
+    with _metrics_lock:
+        sweeper_metrics['runs'] += 1
+        sweeper_metrics['batches'] += run['batches']
+        sweeper_metrics['bookings_expired'] += run['bookings_expired']
+        sweeper_metrics['slots_released'] += run['slots_released']
+        sweeper_metrics['last_run_at'] = now.isoformat()
+        sweeper_metrics['last_run_seconds'] = run['seconds']
+    return run
+
+def start_sweeper_thread(app):
+    """
+    Starts a daemon thread that sweeps stale bookings every SWEEPER_INTERVAL_SECONDS.
+    Does nothing if the interval isn't configured. Returns the Event used to stop the thread.
+    """
+    interval = app.config["SWEEPER_INTERVAL_SECONDS"]
+    if not interval:
+        return None
+
+    stop_event = Event()
+
+    def run():
+        while not stop_event.wait(interval):
+            try:
+                with app.app_context():
+                    result = sweep_stale_bookings()
+                if result['bookings_expired']:
+                    logger.info("Expired %(bookings_expired)s stale bookings, released %(slots_released)s slots", result)
+            except Exception:
+                logger.exception("Stale booking sweep failed")
+
+    Thread(target=run, name='booking-sweeper', daemon=True).start()
+    return stop_event
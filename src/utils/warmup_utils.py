@@ -0,0 +1,133 @@
+from datetime import datetime
+from time import perf_counter
+
+from marshmallow import fields
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import configure_mappers
+
+from init import db
+from models.user import user_schema, users_schema, user_registration_schema
+from models.attraction import attraction_schema, attractions_schema
+from models.booking import booking_schema, bookings_schema
+from models.review import review_schema, reviews_schema
+from utils.revocation_utils import revocation_list
+from utils.auth_utils import user_is_admin_stmt
+from utils.security_utils import requested_bookings_count_stmt, recent_bookings_cost_stmt, recent_bookings_params
+from utils.attraction_cache_utils import attraction_versions_stmt, attraction_version_stmt
+from controllers.auth_controller import user_by_email_stmt
+from controllers.booking_controller import user_bookings_stmt
+from controllers.review_controller import user_reviews_stmt
+
+# The schema instances shared by every request
+SCHEMAS = [
+    user_schema, users_schema, user_registration_schema,
+    attraction_schema, attractions_schema,
+    booking_schema, bookings_schema,
+    review_schema, reviews_schema,
+]
+
+# The statements behind the most used endpoints, with parameters that match nothing, so running each once puts
+# its compiled form in SQLAlchemy's statement cache. The prebuilt ones are the very objects the endpoints run.
+HOT_STATEMENTS = [
+    (attraction_versions_stmt, {}),
+    (attraction_version_stmt, {'attraction_id': 0}),
+    (user_by_email_stmt, {'email': ''}),
+    (user_is_admin_stmt, {'user_id': 0}),
+    (user_bookings_stmt, {'user_id': 0}),
+    (user_reviews_stmt, {'user_id': 0}),
+    (requested_bookings_count_stmt, recent_bookings_params(0, datetime.utcnow())),
+    (recent_bookings_cost_stmt, recent_bookings_params(0, datetime.utcnow())),
+]
+
+def resolve_nested_schemas(schema, seen=None):
+    """
+    Resolves the nested schemas referenced by name (such as 'ReviewSchema'), which marshmallow otherwise
+    looks up from its class registry the first time each schema serialises a record. Returns the number
+    of nested fields resolved.
+    """
+    seen = set() if seen is None else seen
+    if id(schema) in seen:
+        return 0
+    seen.add(id(schema))
+
+    resolved = 0
+    for field in schema.fields.values():
+        while isinstance(field, fields.List):
+            field = field.inner
+        if isinstance(field, fields.Nested):
+            resolved += 1 + resolve_nested_schemas(field.schema, seen)
+    return resolved
+
+def open_pool_connections(count):
+    """
+    Opens `count` database connections at the same time and returns them to the pool, so the first requests
+    don't pay for connecting. Limited to the pool size, as anything above it would be closed again on return.
+    """
+    count = min(count, db.engine.pool.size())
+    connections = []
+    try:
+        for _ in range(count):
+            conn = db.engine.connect()
+            connections.append(conn)
+            conn.execute(text("SELECT 1"))
+    finally:
+        for conn in connections:
+            conn.close()
+    return len(connections)
+
+def run_hot_statements():
+    for stmt, params in HOT_STATEMENTS:
+        db.session.execute(stmt, params).all()
+    db.session.rollback()
+    return len(HOT_STATEMENTS)
+
+def timed(timings, name, fn):
+    started = perf_counter()
+    result = fn()
+    timings[name] = round((perf_counter() - started) * 1000, 2)
+    return result
+
+def warm_up_database(app, timings=None):
+    """
+    Opens WARMUP_POOL_CONNECTIONS database connections, runs each hot statement once and loads the revoked
+    token filter. A pre-forking server (serve.py) runs this in each worker process after it is forked, as
+    the connections opened before the fork aren't kept by the workers.
+
+    A database that can't be reached is logged and skipped, leaving connections to be opened by requests
+    as before. Returns a tuple of (connections opened, statements run), and adds the time taken by each
+    step to `timings`.
+    """
+    timings = {} if timings is None else timings
+    with app.app_context():
+        try:
+            connections = timed(timings, 'open_connections', lambda: open_pool_connections(app.config["WARMUP_POOL_CONNECTIONS"]))
+            statements = timed(timings, 'hot_statements', run_hot_statements)
+            timed(timings, 'revocation_filter', revocation_list.rebuild)
+        except OperationalError as err:
+            db.session.rollback()
+            app.logger.warning("Warm-up skipped the database steps: %s", err.orig)
+            connections = statements = 0
+        finally:
+            db.session.remove()
+    return connections, statements
+
+def warm_up(app, database=True):
+    """
+    Does the work that would otherwise happen lazily on the first requests to a new process: configuring the
+    mappers (including the average_rating column_property) and resolving nested schemas, then, unless
+    `database` is False, the database steps of warm_up_database.
+
+    Returns a dictionary with the time taken by each phase, in milliseconds.
+    """
+    timings = {}
+    with app.app_context():
+        timed(timings, 'configure_mappers', configure_mappers)
+        resolved = timed(timings, 'resolve_schemas', lambda: sum(resolve_nested_schemas(schema) for schema in SCHEMAS))
+    connections, statements = warm_up_database(app, timings) if database else (0, 0)
+
+    app.logger.info(
+        "Warm-up finished: %s nested schemas, %s connections, %s statements, timings (ms) %s",
+        resolved, connections, statements, timings
+    )
+    return timings